@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, Workout, DailyRollup
 
 
 @admin.register(User)
@@ -37,3 +37,10 @@ class WorkoutAdmin(admin.ModelAdmin):
     list_filter = ('activity_type', 'difficulty')
     search_fields = ('name', 'activity_type')
     ordering = ('name',)
+
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('user_email', 'day', 'total_activities', 'total_calories', 'total_duration', 'updated_at')
+    search_fields = ('user_email',)
+    ordering = ('-day',)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Registers the Motor system check.
+        from . import mongo_async  # noqa: F401
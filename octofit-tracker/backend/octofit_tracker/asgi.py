@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_asgi_application()
+
+# Each worker follows the other workers' writes when OCTOFIT_CHANGES is
+# enabled. Start the server without preloading the app, so that every
+# worker starts its own feed thread.
+from octofit_tracker import changes  # noqa: E402
+
+changes.start()
@@ -0,0 +1,133 @@
+"""
+Async read endpoints for the hot collections.
+
+These views query MongoDB through Motor instead of the blocking Djongo
+stack, so under an ASGI server, e.g.
+
+    uvicorn octofit_tracker.asgi:application --workers 4
+
+a worker keeps serving other requests while its queries are in flight.
+Pages are ordered and their cursors encoded by the synchronous lists'
+paginators, and rows rendered with the serializers' fast path, so the
+payloads, their order and their cursors match the synchronous list
+endpoints.
+"""
+import functools
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from .instrumentation import serializing
+from .models import Activity, Leaderboard, User
+from .mongo_async import get_collection, motor_client_class
+from .pagination import ActivityCursorPagination, KeysetCursorPagination, LeaderboardCursorPagination
+from .serializers import ActivitySerializer, LeaderboardSerializer, UserSerializer
+
+
+def requires_motor(view):
+    """Answer 503 where Motor cannot be imported (see mongo_async)."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            motor_client_class()
+        except ImproperlyConfigured as exc:
+            return JsonResponse({'detail': str(exc)}, status=503)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def ordering_value(value):
+    # Djongo hands the synchronous paginator aware UTC datetimes; positions
+    # are their text, so Motor's naive ones are made alike.
+    if isinstance(value, datetime) and settings.USE_TZ and timezone.is_naive(value):
+        return timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+async def keyset_page(request, model, serializer_class, query, pagination_class=KeysetCursorPagination):
+    """
+    Return one page of `model` documents matching `query`.
+
+    `pagination_class` is the synchronous list's, which orders the page,
+    decodes the cursor and builds the links as in `paginate_queryset`;
+    only the query runs on Motor.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    request = Request(request)
+    paginator = pagination_class()
+    paginator.page_size = paginator.get_page_size(request)
+    paginator.base_url = request.build_absolute_uri()
+    paginator.ordering = paginator.get_ordering(request, None, None)
+    try:
+        paginator.cursor = paginator.decode_cursor(request)
+    except NotFound as exc:
+        return JsonResponse({'detail': str(exc.detail)}, status=404)
+    offset, reverse, position = paginator.cursor or (0, False, None)
+
+    order = paginator.ordering[0]
+    field = model._meta.get_field(order.lstrip('-'))
+    descending = order.startswith('-') != reverse
+    if position is not None:
+        query = {**query, field.column: {'$lt' if descending else '$gt': field.to_python(position)}}
+    projection = {name: 1 for name in serializer_class.fast_fields()}
+    documents = await (
+        get_collection(model)
+        .find(query, projection)
+        .sort(field.column, -1 if descending else 1)
+        .skip(offset)
+        .limit(paginator.page_size + 1)
+        .to_list(paginator.page_size + 1)
+    )
+    for document in documents:
+        document[field.attname] = ordering_value(document.get(field.column))
+
+    page = documents[:paginator.page_size]
+    following = None
+    if len(documents) > len(page):
+        following = paginator._get_position_from_instance(documents[-1], paginator.ordering)
+    if reverse:
+        page.reverse()
+        paginator.has_next = position is not None or offset > 0
+        paginator.has_previous = following is not None
+        paginator.next_position, paginator.previous_position = position, following
+    else:
+        paginator.has_next = following is not None
+        paginator.has_previous = position is not None or offset > 0
+        paginator.next_position, paginator.previous_position = following, position
+    paginator.page = page
+    # JsonResponse renders the body as it is built.
+    with serializing(request):
+        return JsonResponse({
+            'next': paginator.get_next_link(),
+            'previous': paginator.get_previous_link(),
+            'results': list(serializer_class.represent_rows(page)),
+        })
+
+
+def equality_query(request, *names):
+    return {name: request.GET[name] for name in names if request.GET.get(name)}
+
+
+@requires_motor
+async def activity_list(request):
+    """Activities, newest first; filter by `user_email` and `activity_type`."""
+    query = equality_query(request, 'user_email', 'activity_type')
+    return await keyset_page(request, Activity, ActivitySerializer, query, ActivityCursorPagination)
+
+
+@requires_motor
+async def user_list(request):
+    """Users, newest first; filter by `team`."""
+    return await keyset_page(request, User, UserSerializer, equality_query(request, 'team'))
+
+
+@requires_motor
+async def leaderboard_list(request):
+    """Leaderboard rows by rank."""
+    return await keyset_page(request, Leaderboard, LeaderboardSerializer, {}, LeaderboardCursorPagination)
@@ -0,0 +1,243 @@
+"""
+Response cache for the read-heavy API endpoints.
+
+Cached responses are keyed by namespace (one per viewset), a namespace
+generation and the request URL. Writes bump the generation, so every
+entry cached before the write becomes unreachable at once. The backend is
+chosen by the ``OCTOFIT_RESPONSE_CACHE`` setting: ``'lru'`` keeps entries
+in process, ``'django'`` stores them in one of the configured ``CACHES``.
+With the LRU in several worker processes, the change feed (see
+changes.py), which starts by default whenever there are several workers,
+brings each worker's writes to the others' caches.
+
+The same cache briefly keeps the raw documents behind detail lookups
+(``OBJECT_TIMEOUT`` seconds), so they are invalidated with the responses.
+Only safe (read) requests use them: writes start from the stored document.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .mongo import find_document
+
+DEFAULTS = {
+    'BACKEND': 'lru',
+    'ALIAS': 'default',
+    'TIMEOUT': 60,
+    'MAX_ENTRIES': 1024,
+    'OBJECT_TIMEOUT': 5,
+}
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with per-entry expiry.
+    """
+
+    def __init__(self, max_entries=1024, timeout=60):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        expires = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def generation(self, namespace):
+        # Generations live outside the LRU so they are never evicted.
+        with self._lock:
+            return self._generations.setdefault(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Adapter storing entries and generations in a Django cache backend,
+    which lets several worker processes share one cache.
+    """
+
+    def __init__(self, alias='default', timeout=60):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(key, value, self.timeout if timeout is None else timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def generation(self, namespace):
+        key = f'octofit:generation:{namespace}'
+        # Seed missing generations with the clock so an evicted counter
+        # never restarts at a value older entries were stored under.
+        self.cache.add(key, time.time_ns(), None)
+        return self.cache.get(key)
+
+    def bump(self, namespace):
+        key = f'octofit:generation:{namespace}'
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, time.time_ns(), None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_RESPONSE_CACHE', {})}
+
+
+def get_response_cache():
+    """Return the process-wide response cache configured in settings."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = get_config()
+                if config['BACKEND'] == 'django':
+                    _cache = DjangoCacheBackend(config['ALIAS'], config['TIMEOUT'])
+                elif config['BACKEND'] == 'lru':
+                    _cache = LRUCache(config['MAX_ENTRIES'], config['TIMEOUT'])
+                else:
+                    raise ValueError(f"Unknown response cache backend '{config['BACKEND']}'.")
+    return _cache
+
+
+def invalidate(*namespaces):
+    """Drop every cached response in the given namespaces."""
+    cache = get_response_cache()
+    for namespace in namespaces:
+        cache.bump(namespace)
+
+
+def etag_for(content):
+    return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+
+class CachedResponseMixin:
+    """
+    Viewset mixin caching `list` and `retrieve` responses.
+
+    Responses carry an ETag and a matching `If-None-Match` gets a 304.
+    Writes through the viewset invalidate its namespace, which defaults to
+    the router basename; set `cache_namespace` to share one across views.
+    Pass `load_document` to `get_object_by_id` to cache detail lookups too.
+    """
+    cache_namespace = None
+    cache_timeout = None
+
+    def get_cache_namespace(self):
+        return self.cache_namespace or self.basename
+
+    def cached_response(self, request, build_response):
+        cache = get_response_cache()
+        namespace = self.get_cache_namespace()
+        key = 'octofit:response:{}:{}:{}'.format(
+            namespace, cache.generation(namespace), request.build_absolute_uri()
+        )
+        entry = cache.get(key)
+        if entry is None:
+            response = build_response()
+            if response.status_code != status.HTTP_200_OK or not hasattr(response, 'data'):
+                return response
+            content = JSONRenderer().render(response.data)
+            entry = {'etag': etag_for(content), 'data': json.loads(content)}
+            cache.set(key, entry, self.cache_timeout)
+
+        if_none_match = [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]
+        if entry['etag'] in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        return response
+
+    def load_document(self, model, object_id):
+        """
+        Return the raw document `object_id`, memoized for the request and,
+        for safe methods, cached for ``OBJECT_TIMEOUT`` seconds under the
+        viewset's namespace.
+        """
+        documents = self.__dict__.setdefault('_documents', {})
+        if object_id in documents:
+            return documents[object_id]
+        timeout = get_config()['OBJECT_TIMEOUT']
+        if not timeout or self.request.method not in SAFE_METHODS:
+            document = find_document(model, object_id)
+        else:
+            cache = get_response_cache()
+            namespace = self.get_cache_namespace()
+            key = f'octofit:document:{namespace}:{cache.generation(namespace)}:{object_id}'
+            document = cache.get(key)
+            if document is None:
+                document = find_document(model, object_id)
+                if document is not None:
+                    cache.set(key, document, timeout)
+        documents[object_id] = document
+        return document
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        invalidate(self.get_cache_namespace())
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        invalidate(self.get_cache_namespace())
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        invalidate(self.get_cache_namespace())
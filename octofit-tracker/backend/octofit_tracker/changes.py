@@ -0,0 +1,401 @@
+"""
+Change notifications for the users, activities, teams and workouts
+collections, and for `activity_deltas` (see rollups.py).
+
+Each worker process keeps caches and derived data (response cache,
+identity map, rankings, search index, recommendation profiles) current
+for the writes it serves itself. With ``OCTOFIT_CHANGES['ENABLED']``
+(by default whenever there are several workers, see `enabled`), a
+`ChangeFeed` thread brings in the writes of every other process and
+hands them to the handlers registered for the collection, as events::
+
+    {'collection': 'workouts', 'operation': 'insert', '_id': ObjectId(...),
+     'document': {...}, 'local': False}
+
+`operation` is insert, update, replace or delete, or reload when the
+feed cannot tell what changed and handlers should drop what they hold
+for the collection. `document` is the current version, when known.
+
+On a replica set the feed follows one change stream over the database,
+resuming from its last token after errors. Where change streams are not
+available (a standalone mongod) it polls instead: new documents are found
+by the creation time in their ObjectId, looking back ``LOOKBACK`` seconds
+for writes that were slow to land, and any other change in a collection's
+document count is reported as a reload, unless this process's own
+deletes account for it. Polling does not see in-place updates. A quiet
+round costs one estimated count and one `_id` range read per collection
+every ``POLL_INTERVAL`` seconds in each worker; set ``POLL`` to False to
+leave the collections change streams cannot follow to the TTL reloads. Change streams do not report writes to time-series collections
+either, so those (activities, once converted by
+``convert_activities_timeseries``) are polled next to the stream; the
+collection types are read when the feed starts.
+
+This process's own writes come back through the feed too. Write paths
+call `mark_local` for the ids they have already applied, and those events
+arrive with ``local`` set so that handlers which are not idempotent can
+skip them.
+
+Change events of updates and deletes do not carry the previous version
+of a document, so the activity write paths publish the rollup deltas of
+their updates and deletes to `activity_deltas`, which is followed like
+the other collections.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo.errors import OperationFailure, PyMongoError
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+COLLECTIONS = ('users', 'activities', 'teams', 'workouts', 'activity_deltas')
+
+DEFAULTS = {
+    # 'auto' follows other processes' writes when there is more than one of
+    # the WORKERS processes.
+    'ENABLED': 'auto',
+    'WORKERS': 1,
+    # 'auto' falls back to polling when change streams are unavailable.
+    'MODE': 'auto',
+    # False leaves what change streams do not report (a standalone mongod,
+    # time-series collections) to the TTL reloads instead of polling it.
+    'POLL': True,
+    'POLL_INTERVAL': 5.0,
+    'LOOKBACK': 30,
+    'MAX_LOCAL_WRITES': 100000,
+}
+
+OPERATIONS = ('insert', 'update', 'replace', 'delete')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_CHANGES', {})}
+
+
+def enabled(config=None):
+    """Return whether this process should follow the writes of other processes."""
+    config = config or get_config()
+    if config['ENABLED'] != 'auto':
+        return bool(config['ENABLED'])
+    # Each worker holds its own identity map, rankings and search index, and
+    # with the 'lru' backend its own responses; nothing else would tell it
+    # about the writes of the other workers.
+    return config['WORKERS'] > 1
+
+
+_handlers = defaultdict(list)
+
+
+def register(collection, handler=None):
+    """Call `handler(event)` for each change to `collection`; usable as a decorator."""
+    if handler is None:
+        return lambda handler: register(collection, handler)
+    if collection not in COLLECTIONS:
+        raise ValueError(f"Changes to '{collection}' are not followed.")
+    if handler not in _handlers[collection]:
+        _handlers[collection].append(handler)
+    return handler
+
+
+def dispatch(event):
+    for handler in list(_handlers.get(event['collection'], ())):
+        try:
+            handler(event)
+        except Exception:
+            logger.exception('Change handler %s failed on a %s of %s',
+                             handler.__qualname__, event['operation'], event['collection'])
+
+
+class LocalWrites:
+    """
+    Bounded set of (collection, _id) written by this process whose change
+    events are still to come.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # {collection: deletes not yet seen in a polled document count}
+        self._deleted = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, collection, ids, deleted=False):
+        with self._lock:
+            for object_id in ids:
+                self._entries[(collection, object_id)] = None
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if deleted:
+                self._deleted[collection] += len(ids)
+
+    def take_deleted(self, collection, limit):
+        """Return how many, up to `limit`, of this process's deletes from `collection` are still unaccounted for, forgetting them."""
+        with self._lock:
+            taken = min(self._deleted[collection], limit)
+            self._deleted[collection] -= taken
+            return taken
+
+    def pop(self, collection, object_id):
+        """Return whether `object_id` was marked, forgetting it."""
+        with self._lock:
+            if (collection, object_id) not in self._entries:
+                return False
+            del self._entries[(collection, object_id)]
+            return True
+
+
+local_writes = LocalWrites(DEFAULTS['MAX_LOCAL_WRITES'])
+
+
+def mark_local(collection, ids, deleted=False):
+    """
+    Flag the coming change events of `ids` as already applied by this
+    process; with `deleted`, the polled document count drops by them too.
+    """
+    local_writes.add(collection, ids, deleted)
+
+
+def make_event(collection, operation, object_id=None, document=None):
+    return {
+        'collection': collection,
+        'operation': operation,
+        '_id': object_id,
+        'document': document,
+        'local': object_id is not None and local_writes.pop(collection, object_id),
+    }
+
+
+def reload_all():
+    for collection in COLLECTIONS:
+        dispatch(make_event(collection, 'reload'))
+
+
+def timeseries_collections(database, collections=COLLECTIONS):
+    """Return the names among `collections` stored as time-series collections."""
+    return tuple(
+        info['name'] for info in database.list_collections(filter={'type': 'timeseries'})
+        if info['name'] in collections
+    )
+
+
+class ChangeStreamFeed:
+    """
+    Follows one database change stream over `collections`.
+    """
+
+    def __init__(self, database, collections=COLLECTIONS):
+        self.database = database
+        self.collections = tuple(collections)
+        self.resume_token = None
+
+    def open(self):
+        """Open the stream; raises `OperationFailure` where change streams are unavailable."""
+        return self.database.watch(
+            [{'$match': {'ns.coll': {'$in': list(self.collections)}}}],
+            full_document='updateLookup',
+            resume_after=self.resume_token,
+            max_await_time_ms=1000,
+        )
+
+    def translate(self, change):
+        """Dispatch the events of one change document."""
+        operation = change['operationType']
+        collection = change.get('ns', {}).get('coll')
+        if operation in OPERATIONS:
+            if collection in self.collections:
+                dispatch(make_event(collection, operation, change['documentKey']['_id'], change.get('fullDocument')))
+        elif collection in self.collections:
+            # drop or rename: everything known about the collection is gone.
+            dispatch(make_event(collection, 'reload'))
+        elif operation in ('dropDatabase', 'invalidate'):
+            reload_all()
+
+    def follow(self, stream, stopping, poller=None, poll_interval=1.0):
+        """Dispatch changes until `stopping` is set, polling `poller` every `poll_interval` seconds."""
+        polled_at = None
+        while stream is not None and not stopping.is_set():
+            if poller is not None and (polled_at is None or time.monotonic() - polled_at >= poll_interval):
+                polled_at = time.monotonic()
+                try:
+                    poller.poll()
+                except PyMongoError:
+                    logger.exception('Polling for changes failed')
+            try:
+                change = stream.try_next()
+            except PyMongoError:
+                logger.exception('The change stream failed; reopening it')
+                stream.close()
+                stream = self.reopen(stopping)
+                continue
+            if change is None:
+                continue
+            self.resume_token = stream.resume_token
+            self.translate(change)
+            if change['operationType'] == 'invalidate':
+                self.resume_token = None
+                stream.close()
+                stream = self.reopen(stopping)
+        if stream is not None:
+            stream.close()
+
+    def reopen(self, stopping):
+        """Return a new stream from the resume token, or None once `stopping` is set."""
+        delay = 0.5
+        while not stopping.is_set():
+            try:
+                return self.open()
+            except OperationFailure:
+                if self.resume_token is None:
+                    raise
+                # The oplog no longer holds the resume point: changes were missed.
+                logger.warning('The change stream could not resume; reloading derived data')
+                self.resume_token = None
+                reload_all()
+            except PyMongoError:
+                logger.exception('Reopening the change stream failed; retrying')
+                stopping.wait(delay)
+                delay = min(delay * 2, 30)
+
+
+class PollingFeed:
+    """
+    Finds new documents of `collections` by ObjectId time and reports other
+    changes in their document counts as reloads.
+    """
+
+    def __init__(self, database, collections=COLLECTIONS, lookback=30):
+        self.database = database
+        self.collections = tuple(collections)
+        self.lookback = lookback
+        self._seen = {collection: set() for collection in self.collections}
+        # {collection: document count the dispatched inserts account for}
+        self._counts = {}
+
+    def poll(self):
+        for collection in self.collections:
+            self.poll_collection(collection)
+
+    def poll_collection(self, name):
+        collection = self.database[name]
+        since = ObjectId.from_datetime(datetime.fromtimestamp(time.time() - self.lookback, dt_timezone.utc))
+        seen = self._seen[name]
+        seen.difference_update([object_id for object_id in seen if object_id < since])
+
+        before = collection.estimated_document_count()
+        new = [
+            document['_id'] for document in collection.find({'_id': {'$gte': since}}, {'_id': 1})
+            if document['_id'] not in seen
+        ]
+        seen.update(new)
+        if name not in self._counts:
+            self._counts[name] = collection.estimated_document_count()
+            return
+        if new:
+            for document in collection.find({'_id': {'$in': new}}).sort('_id', 1):
+                dispatch(make_event(name, 'insert', document['_id'], document))
+        self._counts[name] += len(new)
+        if before == self._counts[name]:
+            return
+        # Writes racing the scan make the counts disagree for a moment;
+        # they are compared on a quiet round.
+        after = collection.estimated_document_count()
+        if before == after:
+            expected = self._counts[name]
+            if after < expected:
+                # Deletes made by this process were applied when it made them.
+                expected -= local_writes.take_deleted(name, expected - after)
+            if after != expected:
+                dispatch(make_event(name, 'reload'))
+            self._counts[name] = after
+
+
+class ChangeFeed:
+    """
+    The process's change feed thread: a change stream where possible,
+    polling otherwise.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.mode = None
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='octofit-changes', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def run(self):
+        database = User.objects.mongo_database
+        if self.config['MODE'] in ('auto', 'stream'):
+            polled = timeseries_collections(database)
+            feed = ChangeStreamFeed(database, [name for name in COLLECTIONS if name not in polled])
+            try:
+                stream = feed.open()
+            except OperationFailure as exc:
+                if self.config['MODE'] == 'stream':
+                    raise
+                if not self.config['POLL']:
+                    logger.warning('Change streams are unavailable (%s) and polling is off; '
+                                   'other processes\' writes arrive with the TTL reloads', exc)
+                    return
+                logger.info('Change streams are unavailable (%s); polling every %ss',
+                            exc, self.config['POLL_INTERVAL'])
+            else:
+                self.mode = 'stream'
+                poll = polled and self.config['POLL']
+                poller = PollingFeed(database, polled, lookback=self.config['LOOKBACK']) if poll else None
+                feed.follow(stream, self._stopping, poller, self.config['POLL_INTERVAL'])
+                return
+        self.mode = 'poll'
+        feed = PollingFeed(database, lookback=self.config['LOOKBACK'])
+        while True:
+            try:
+                feed.poll()
+            except PyMongoError:
+                logger.exception('Polling for changes failed')
+            if self._stopping.wait(self.config['POLL_INTERVAL']):
+                return
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def start():
+    """Start this process's change feed if `enabled`; return it or None."""
+    global _feed
+    config = get_config()
+    if not enabled(config):
+        return None
+    # The project's handlers register on import.
+    from . import invalidation  # noqa: F401
+
+    with _feed_lock:
+        if _feed is None:
+            local_writes.max_entries = config['MAX_LOCAL_WRITES']
+            feed = ChangeFeed(config)
+            feed.start()
+            atexit.register(feed.stop)
+            _feed = feed
+    return _feed
+
+
+def shutdown():
+    """Stop and forget the change feed, if it was started."""
+    global _feed
+    with _feed_lock:
+        if _feed is not None:
+            _feed.stop()
+            _feed = None
@@ -0,0 +1,56 @@
+"""
+MongoDB command metrics.
+
+`command_listener` is registered on the Djongo client through the
+``event_listeners`` client option, next to the pool listener, and counts
+the commands each thread sends and the time the server took to answer
+them. A request is served on one thread, so resetting the counters when
+it starts and reading them when it ends gives its database cost.
+"""
+import threading
+
+from pymongo import monitoring
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    Command listener keeping a per-thread command count and duration.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _counters(self):
+        local = self._local
+        if not hasattr(local, 'commands'):
+            local.commands = 0
+            local.failures = 0
+            local.duration = 0.0
+        return local
+
+    def started(self, event):
+        self._counters().commands += 1
+
+    def succeeded(self, event):
+        self._counters().duration += event.duration_micros / 1e6
+
+    def failed(self, event):
+        counters = self._counters()
+        counters.failures += 1
+        counters.duration += event.duration_micros / 1e6
+
+    def read(self):
+        """Return (commands, failures, seconds) counted on this thread."""
+        counters = self._counters()
+        return counters.commands, counters.failures, counters.duration
+
+    def reset(self):
+        """Zero this thread's counters and return their previous values."""
+        values = self.read()
+        counters = self._local
+        counters.commands = counters.failures = 0
+        counters.duration = 0.0
+        return values
+
+
+command_listener = CommandMetricsListener()
@@ -0,0 +1,42 @@
+"""
+Streaming encoders for bulk data exports.
+
+Each encoder consumes an iterator of representation dicts and yields
+encoded chunks one row at a time, so memory use does not depend on the
+size of the export.
+"""
+import csv
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """File-like object whose `write` returns the value instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def csv_lines(rows, fields):
+    writer = csv.DictWriter(Echo(), fieldnames=fields)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def encode(rows, export_format, fields):
+    """Return a generator encoding `rows` in `export_format` (see CONTENT_TYPES)."""
+    if export_format == 'csv':
+        return csv_lines(rows, fields)
+    return ndjson_lines(rows)
@@ -0,0 +1,31 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+EXACT = ['exact']
+RANGE = ['exact', 'gt', 'gte', 'lt', 'lte']
+
+
+class FieldFilterBackend(BaseFilterBackend):
+    """
+    Equality and range filters taken from query parameters.
+
+    `?user_email=tony.stark@marvel.com&date__gte=2024-01-01` becomes a
+    queryset filter, which Djongo pushes down to MongoDB. A view opts in
+    fields through `filter_fields`, mapping each field to its allowed
+    lookups (`exact`, `gt`, `gte`, `lt`, `lte`).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        allowed = getattr(view, 'filter_fields', {})
+        filters = {}
+        for param, value in request.query_params.items():
+            field_name, _, lookup = param.partition('__')
+            lookup = lookup or 'exact'
+            if lookup not in allowed.get(field_name, ()):
+                continue
+            try:
+                filters[f'{field_name}__{lookup}'] = queryset.model._meta.get_field(field_name).to_python(value)
+            except DjangoValidationError as exc:
+                raise ValidationError({param: exc.messages})
+        return queryset.filter(**filters)
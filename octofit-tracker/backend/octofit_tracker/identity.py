@@ -0,0 +1,170 @@
+"""
+Process-wide map between users and teams.
+
+Activities name their athlete by `user_email` and users their team by
+name, so filtering activities by team starts from the team's members.
+`IdentityMap` answers that from memory. It is loaded with one scan of
+`users` on first use and kept current by the `UserViewSet` write hooks
+below and, for the writes of other processes, by the change feed. It is
+also reloaded every ``TTL`` seconds, which bounds how stale it can get
+when the change feed is off.
+
+The leaderboard's `$inc` updates and the team statistics take users'
+teams from the map as well. The writes of this process's `UserViewSet` are
+applied before they are answered, and with more than one worker the
+change feed runs by default (see `changes.enabled`). An activity written
+before another worker's team change has reached this one is credited to
+the previous team, like one written just before the change.
+
+Reloads read `users` outside the lock, one at a time. The writes that
+arrive meanwhile are applied to the current map and replayed onto the
+new one; `reset` discards a reload in progress.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .models import User
+
+DEFAULTS = {
+    # Seconds before the map is reloaded from `users`; None never.
+    'TTL': 60,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_IDENTITY', {})}
+
+
+class IdentityMap:
+    """
+    Thread-safe email → team and team → emails indexes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Serializes reloads, which read MongoDB without holding `_lock`.
+        self._reload_lock = threading.Lock()
+        self._teams = None
+        self._members = None
+        self._emails = None
+        self._loaded_at = None
+        self._generation = 0
+        # [(object_id, email, team)] written during a reload; email is None
+        # for a removal.
+        self._pending = None
+
+    def _fresh(self):
+        # Callers hold the lock.
+        ttl = get_config()['TTL']
+        return self._teams is not None and not (ttl and time.monotonic() - self._loaded_at >= ttl)
+
+    def _reload(self):
+        with self._reload_lock:
+            with self._lock:
+                if self._fresh():
+                    return
+                generation = self._generation
+                self._pending = []
+            try:
+                users = list(User.objects.mongo_find({}, {'email': 1, 'team': 1}))
+            finally:
+                with self._lock:
+                    pending, self._pending = self._pending, None
+            with self._lock:
+                if self._generation != generation:
+                    # reset() ran during the load.
+                    return
+                self._teams = {}
+                self._members = {}
+                self._emails = {}
+                for user in users:
+                    self._add(user['_id'], user['email'], user.get('team'))
+                for object_id, email, team in pending:
+                    self._apply(object_id, email, team)
+                self._loaded_at = time.monotonic()
+
+    def _add(self, object_id, email, team):
+        previous = self._emails.get(object_id)
+        if previous is not None:
+            self._discard(previous)
+        self._discard(email)
+        self._emails[object_id] = email
+        self._teams[email] = team
+        if team:
+            self._members.setdefault(team, set()).add(email)
+
+    def _discard(self, email):
+        team = self._teams.pop(email, None)
+        members = self._members.get(team)
+        if members is not None:
+            members.discard(email)
+            if not members:
+                del self._members[team]
+
+    def _apply(self, object_id, email, team):
+        # Callers hold the lock and have loaded the indexes.
+        if email is not None:
+            self._add(object_id, email, team)
+        else:
+            email = self._emails.pop(object_id, None)
+            if email is not None:
+                self._discard(email)
+
+    def _read(self, read):
+        """Return `read()` under the lock, reloading the indexes first if stale."""
+        while True:
+            with self._lock:
+                if self._fresh():
+                    return read()
+            self._reload()
+
+    def members(self, team):
+        """Return the sorted emails of `team`'s users."""
+        return self._read(lambda: sorted(self._members.get(team, ())))
+
+    def team_of(self, email):
+        """Return the team of the user with `email`, or None."""
+        return self._read(lambda: self._teams.get(email))
+
+    def teams_of(self, emails):
+        """Return {email: team} for those of `emails` that belong to a user."""
+        return self._read(lambda: {email: self._teams[email] for email in emails if email in self._teams})
+
+    def _write(self, object_id, email, team):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((object_id, email, team))
+            if self._teams is not None:
+                self._apply(object_id, email, team)
+
+    def set_user(self, object_id, email, team):
+        self._write(object_id, email, team)
+
+    def remove_user(self, object_id):
+        self._write(object_id, None, None)
+
+    def reset(self):
+        """Drop the indexes; the next read reloads them from MongoDB."""
+        with self._lock:
+            self._generation += 1
+            self._teams = None
+            self._members = None
+            self._emails = None
+            self._loaded_at = None
+
+
+identity = IdentityMap()
+
+
+def record_user_created(user):
+    identity.set_user(user._id, user.email, user.team)
+
+
+def record_user_updated(before, after):
+    identity.set_user(after._id, after.email, after.team)
+
+
+def record_user_deleted(object_id):
+    identity.remove_user(object_id)
@@ -0,0 +1,341 @@
+"""
+Write-behind ingestion of activities.
+
+With ``OCTOFIT_INGEST['ENABLED']``, `ActivityViewSet.create` validates the
+activity, gives it its `_id`, appends it to a local spool file and queues
+it, answering 202 straight away. A background thread writes the queue to
+`activities` with unordered `insert_many` batches of up to ``BATCH_SIZE``
+documents, flushing at least every ``FLUSH_INTERVAL`` seconds, and then
+updates the leaderboard, rollups and recommendation profiles from the
+documents that were written.
+
+At most ``MAX_QUEUE`` activities wait at a time; a request that finds the
+queue full waits ``SUBMIT_TIMEOUT`` seconds for room and is then refused
+with 503. Spool segments are deleted once all their activities are
+written. Segments left behind by a process that died are locked by
+nobody, and the next process to start its queue replays them. `_id`s are
+fixed when an activity is accepted, and a time-series `activities` has no
+unique `_id` to refuse a second copy, so replayed and retried batches
+first look up which of their `_id`s are already stored; those are handled
+as duplicate keys and not counted twice.
+"""
+import atexit
+import fcntl
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from bson import json_util
+from django.conf import settings
+from pymongo.errors import BulkWriteError, PyMongoError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import changes, leaderboard, recommendations, rollups
+from .models import Activity
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SPOOL_DIR': 'spool',
+    'FSYNC': True,
+    'MAX_QUEUE': 10000,
+    'SUBMIT_TIMEOUT': 0.5,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 0.2,
+    'SEGMENT_SIZE': 5000,
+    'MAX_STATUSES': 100000,
+}
+
+DUPLICATE_KEY = 11000
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_INGEST', {})}
+
+
+def enabled():
+    return get_config()['ENABLED']
+
+
+class QueueFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The ingestion queue is full; retry shortly.'
+    default_code = 'ingest_queue_full'
+    # Sent back as Retry-After by DRF's exception handler.
+    wait = 1
+
+
+class Spool:
+    """
+    Append-only NDJSON segments holding accepted activities until written.
+
+    A process holds an exclusive `flock` on the segments it owns, so an
+    unlocked segment belongs to a process that is gone.
+    """
+
+    def __init__(self, directory, segment_size=5000, fsync=True):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.outstanding = {}
+        self._files = {}
+        self._current = None
+        self._appended = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f'{os.getpid()}-{time.time_ns()}.ndjson')
+        handle = open(path, 'a', encoding='utf-8')
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._files[path] = handle
+        self.outstanding[path] = 0
+        self._current = path
+        self._appended = 0
+
+    def append(self, document):
+        """Durably record `document`; return the segment it was written to."""
+        line = json_util.dumps(document, json_options=json_util.RELAXED_JSON_OPTIONS) + '\n'
+        with self._lock:
+            if self._current is None or self._appended >= self.segment_size:
+                self._open_segment()
+            handle = self._files[self._current]
+            handle.write(line)
+            handle.flush()
+            if self.fsync:
+                os.fsync(handle.fileno())
+            self._appended += 1
+            self.outstanding[self._current] += 1
+            return self._current
+
+    def written(self, segment, count=1):
+        """Mark `count` activities of `segment` as stored; drop drained segments."""
+        with self._lock:
+            self.outstanding[segment] -= count
+            if self.outstanding[segment] <= 0:
+                self._remove(segment)
+
+    def _remove(self, segment):
+        if segment == self._current:
+            self._current = None
+        self._files.pop(segment).close()
+        del self.outstanding[segment]
+        os.remove(segment)
+
+    def recover(self):
+        """
+        Claim the segments of dead processes and return [(segment, document)]
+        for their activities.
+        """
+        recovered = []
+        with self._lock:
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if not name.endswith('.ndjson') or path in self._files:
+                    continue
+                handle = open(path, 'r+', encoding='utf-8')
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    handle.close()
+                    continue
+                documents = []
+                for line in handle:
+                    try:
+                        documents.append(json_util.loads(line, json_options=json_util.RELAXED_JSON_OPTIONS))
+                    except ValueError:
+                        # A line cut short by the crash was never acknowledged.
+                        logger.warning('Skipping a truncated line in %s', path)
+                self._files[path] = handle
+                self.outstanding[path] = len(documents)
+                if not documents:
+                    self._remove(path)
+                recovered.extend((path, document) for document in documents)
+        return recovered
+
+
+class IngestQueue:
+    """
+    Bounded in-process queue of spooled activities and its writer thread.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.spool = Spool(config['SPOOL_DIR'], config['SEGMENT_SIZE'], config['FSYNC'])
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(config['MAX_QUEUE'])
+        self._statuses = OrderedDict()
+        self._status_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._thread = threading.Thread(target=self.run, name='octofit-ingest', daemon=True)
+
+    def start(self):
+        for segment, document in self.spool.recover():
+            self._enqueue(segment, document, replayed=True)
+        self._thread.start()
+
+    def _enqueue(self, segment, document, replayed=False):
+        # Replayed activities do not hold a queue slot.
+        with self._idle:
+            self._pending += 1
+        self.set_status(document['_id'], 'queued')
+        self._queue.put((segment, document, replayed))
+
+    def submit(self, document):
+        """Spool and queue a validated activity document, or raise `QueueFull`."""
+        if not self._slots.acquire(timeout=self.config['SUBMIT_TIMEOUT']):
+            raise QueueFull()
+        try:
+            segment = self.spool.append(document)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._enqueue(segment, document)
+
+    def set_status(self, object_id, state, error=None):
+        with self._status_lock:
+            self._statuses[object_id] = (state, error)
+            self._statuses.move_to_end(object_id)
+            while len(self._statuses) > self.config['MAX_STATUSES']:
+                self._statuses.popitem(last=False)
+
+    def status(self, object_id):
+        """Return (state, error) for an activity accepted by this process, or None."""
+        with self._status_lock:
+            return self._statuses.get(object_id)
+
+    def next_batch(self):
+        """Block for the first activity, then collect more until the batch is full or the interval ends."""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.config['FLUSH_INTERVAL']
+        while len(batch) < self.config['BATCH_SIZE']:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self.next_batch()
+            if batch:
+                self.flush(batch)
+
+    def insert(self, documents, check_stored=False):
+        """
+        Insert `documents`, retrying until MongoDB answers; return
+        ({index: write error}, whether it took more than one attempt).
+
+        With `check_stored`, and on every retry, the documents already in
+        `activities` are skipped and reported as duplicate keys.
+        """
+        delay = 0.5
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                errors = {}
+                positions = list(range(len(documents)))
+                if check_stored or attempts > 1:
+                    ids = [document['_id'] for document in documents]
+                    stored = {row['_id'] for row in Activity.objects.mongo_find({'_id': {'$in': ids}}, {'_id': 1})}
+                    errors = {
+                        index: {'index': index, 'code': DUPLICATE_KEY, 'errmsg': 'Already stored.'}
+                        for index in positions if ids[index] in stored
+                    }
+                    positions = [index for index in positions if index not in errors]
+                if positions:
+                    try:
+                        Activity.objects.mongo_insert_many([documents[index] for index in positions], ordered=False)
+                    except BulkWriteError as exc:
+                        for error in exc.details.get('writeErrors', []):
+                            errors[positions[error['index']]] = error
+                return errors, attempts > 1
+            except PyMongoError:
+                # The batch is spooled and still in hand, so nothing is lost by waiting.
+                logger.exception('Writing %d queued activities failed; retrying', len(documents))
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def flush(self, batch):
+        changes.mark_local('activities', [document['_id'] for _, document, _ in batch])
+        errors, retried = self.insert(
+            [document for _, document, _ in batch],
+            check_stored=any(replayed for _, _, replayed in batch),
+        )
+        written = []
+        for index, (segment, document, replayed) in enumerate(batch):
+            error = errors.get(index)
+            if error is None:
+                written.append(document)
+                self.set_status(document['_id'], 'written')
+            elif error.get('code') == DUPLICATE_KEY:
+                # Already stored: by an earlier attempt at this batch, whose
+                # derived updates are still due, or before a replay.
+                if retried and not replayed:
+                    written.append(document)
+                self.set_status(document['_id'], 'written')
+            else:
+                self.set_status(document['_id'], 'failed', error.get('errmsg', 'Write failed.'))
+            self.spool.written(segment)
+            if not replayed:
+                self._slots.release()
+        try:
+            leaderboard.record_activity_documents(written)
+            rollups.record_activity_documents(written)
+            recommendations.record_activity_documents(written)
+        except PyMongoError:
+            logger.exception('Updating the data derived from %d activities failed', len(written))
+        with self._idle:
+            self._pending -= len(batch)
+            self._idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Wait until every queued activity has been handled; return False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def stop(self, timeout=10):
+        """Write what is queued and stop the writer thread."""
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_ingest_queue():
+    """Return this process's ingestion queue, starting it on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                ingest_queue = IngestQueue(get_config())
+                ingest_queue.start()
+                atexit.register(ingest_queue.stop)
+                _queue = ingest_queue
+    return _queue
+
+
+def shutdown():
+    """Stop and forget the ingestion queue, if it was started."""
+    global _queue
+    with _queue_lock:
+        if _queue is not None:
+            _queue.stop()
+            _queue = None
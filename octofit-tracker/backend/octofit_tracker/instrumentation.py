@@ -0,0 +1,265 @@
+"""
+Opt-in request instrumentation.
+
+When ``OCTOFIT_INSTRUMENTATION['ENABLED']`` is set, `InstrumentationMiddleware`
+records for every request the view that served it (``UserViewSet.list``,
+``ActivityViewSet.create``, ...), the MongoDB commands it issued, the time
+spent in MongoDB, in serializing (building the rows' representations and
+rendering the response) and in total. Each response
+carries the numbers in a ``Server-Timing`` header, the per-view totals are
+served in the Prometheus text format by `metrics`, and a sample of the
+requests slower than ``PROFILE_THRESHOLD_MS`` is profiled with cProfile and
+dumped to ``PROFILE_DIR``. While disabled, `metrics` answers 404.
+
+Like the pool metrics, the totals are kept per worker process.
+"""
+import asyncio
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse
+
+from .command_metrics import command_listener
+
+DEFAULTS = {
+    'ENABLED': False,
+    'PROFILE_THRESHOLD_MS': None,
+    'PROFILE_SAMPLE_RATE': 0.1,
+    'PROFILE_DIR': 'profiles',
+}
+
+# Upper bounds, in seconds, of the request duration histogram buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_INSTRUMENTATION', {})}
+
+
+def view_name(view_func, method):
+    """
+    Return the name requests to `view_func` are recorded under.
+
+    Viewset routes are named after the class and the action the HTTP
+    method maps to, `@api_view` functions and plain views after the function.
+    """
+    cls = getattr(view_func, 'cls', None)
+    actions = getattr(view_func, 'actions', None)
+    if cls is not None and actions:
+        return f'{cls.__name__}.{actions.get(method.lower(), method.lower())}'
+    if cls is not None:
+        return cls.__name__
+    return getattr(view_func, '__name__', type(view_func).__name__)
+
+
+class ViewStats:
+    def __init__(self):
+        self.statuses = Counter()
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.total = 0.0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.commands = 0
+
+
+class RequestMetrics:
+    """
+    Thread-safe per-view request totals, rendered in the Prometheus format.
+    """
+
+    def __init__(self):
+        self._views = defaultdict(ViewStats)
+        self._lock = threading.Lock()
+
+    def record(self, view, status_code, total, db, serialize, commands):
+        with self._lock:
+            stats = self._views[view]
+            stats.statuses[status_code] += 1
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    stats.buckets[index] += 1
+            stats.total += total
+            stats.db += db
+            stats.serialize += serialize
+            stats.commands += commands
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        with self._lock:
+            views = sorted(self._views.items())
+            lines = [
+                '# HELP octofit_requests_total Requests served, by view and status code.',
+                '# TYPE octofit_requests_total counter',
+            ]
+            for view, stats in views:
+                for status_code, count in sorted(stats.statuses.items()):
+                    lines.append(f'octofit_requests_total{{view="{view}",status="{status_code}"}} {count}')
+
+            lines += [
+                '# HELP octofit_request_duration_seconds Time spent serving requests, by view.',
+                '# TYPE octofit_request_duration_seconds histogram',
+            ]
+            for view, stats in views:
+                count = sum(stats.statuses.values())
+                for bound, observed in zip(DURATION_BUCKETS, stats.buckets):
+                    lines.append(f'octofit_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {observed}')
+                lines.append(f'octofit_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {count}')
+                lines.append(f'octofit_request_duration_seconds_sum{{view="{view}"}} {stats.total:.6f}')
+                lines.append(f'octofit_request_duration_seconds_count{{view="{view}"}} {count}')
+
+            for name, attribute, help_text in (
+                ('octofit_request_db_seconds_total', 'db', 'Time spent waiting on MongoDB commands, by view.'),
+                ('octofit_request_serialize_seconds_total', 'serialize', 'Time spent serializing responses, by view.'),
+                ('octofit_mongo_commands_total', 'commands', 'MongoDB commands issued, by view.'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for view, stats in views:
+                    value = getattr(stats, attribute)
+                    value = f'{value:.6f}' if isinstance(value, float) else value
+                    lines.append(f'{name}{{view="{view}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+def metrics(request):
+    """Per-view request metrics of this worker process in the Prometheus text format."""
+    if not get_config()['ENABLED']:
+        raise Http404('Instrumentation is disabled.')
+    return HttpResponse(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@contextmanager
+def serializing(request):
+    """
+    Count the time spent in the block as `request`'s serialize time.
+
+    For views that build representations themselves, such as the fast list
+    path's `represent_rows`. Rows streamed after the view returns are not
+    counted.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        # DRF requests wrap the HttpRequest the middleware annotated.
+        http_request = getattr(request, '_request', request)
+        if hasattr(http_request, '_instrumentation_serialize'):
+            http_request._instrumentation_serialize += time.perf_counter() - started
+
+
+class InstrumentationMiddleware:
+    """
+    Time each request and attribute its MongoDB commands to the view.
+
+    Keep it first in ``MIDDLEWARE`` so the total covers the whole stack.
+
+    It runs in the mode of the stack it wraps. Under ASGI, sync views run
+    on the thread-sensitive thread of their request, so the commands are
+    counted there; the commands of async (Motor) views are not counted, and
+    async requests are not profiled since the event loop interleaves them.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # Django tells async middleware apart with asyncio.iscoroutinefunction().
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        else:
+            self._is_coroutine = None
+        threshold = config['PROFILE_THRESHOLD_MS']
+        self.profile_threshold = threshold / 1000 if threshold else None
+        self.profile_sample_rate = config['PROFILE_SAMPLE_RATE']
+        self.profile_dir = config['PROFILE_DIR']
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        self.start_request(request)
+        profiler = self.start_profiler()
+        command_listener.reset()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+        commands, _, db = command_listener.read()
+        self.finish_request(request, response, total, db, commands)
+        if profiler is not None and total >= self.profile_threshold:
+            self.dump_profile(profiler, request._instrumentation_view)
+        return response
+
+    async def __acall__(self, request):
+        self.start_request(request)
+        await sync_to_async(command_listener.reset)()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            total = time.perf_counter() - started
+        commands, _, db = await sync_to_async(command_listener.read)()
+        self.finish_request(request, response, total, db, commands)
+        return response
+
+    def start_request(self, request):
+        request._instrumentation_view = 'unmatched'
+        request._instrumentation_serialize = 0.0
+
+    def finish_request(self, request, response, total, db, commands):
+        view = request._instrumentation_view
+        serialize = request._instrumentation_serialize
+        request_metrics.record(view, response.status_code, total, db, serialize, commands)
+        response['Server-Timing'] = (
+            f'db;dur={db * 1000:.2f};desc="{commands} mongo commands", '
+            f'serialize;dur={serialize * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f};desc="{view}"'
+        )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._instrumentation_view = view_name(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns; the
+        # post-render callback closes the measurement.
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._instrumentation_serialize += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def start_profiler(self):
+        if self.profile_threshold is None or random.random() >= self.profile_sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this thread.
+            return None
+        return profiler
+
+    def dump_profile(self, profiler, view):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        filename = f'{view}-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{threading.get_ident()}.prof'
+        profiler.dump_stats(os.path.join(self.profile_dir, filename))
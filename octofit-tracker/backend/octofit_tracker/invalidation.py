@@ -0,0 +1,72 @@
+"""
+Change feed handlers keeping this process's caches and derived data in
+step with writes made by other processes.
+
+Events for this process's own writes arrive too, after the write hooks
+in the views have applied them. The handlers either set state from the
+current document, which is safe to repeat, or skip events marked local.
+"""
+from . import changes, rankings, rollups, search
+from .cache import invalidate
+from .identity import identity
+from .recommendations import recommender
+
+
+@changes.register('users')
+def user_changed(event):
+    operation = event['operation']
+    if operation == 'reload':
+        identity.reset()
+    elif operation == 'delete':
+        identity.remove_user(event['_id'])
+    elif event['document'] is not None:
+        document = event['document']
+        identity.set_user(document['_id'], document['email'], document.get('team'))
+    # Team member counts move with users.
+    invalidate('team')
+
+
+@changes.register('teams')
+def team_changed(event):
+    invalidate('team')
+
+
+@changes.register('workouts')
+def workout_changed(event):
+    operation = event['operation']
+    if operation == 'reload':
+        search.catalog.reset()
+    elif operation == 'delete' or event['document'] is None:
+        search.record_workout_deleted(event['_id'])
+    else:
+        search.catalog.update([(event['_id'], search.workout_entry(event['document']))])
+    recommender.invalidate_catalog()
+    invalidate('workout')
+
+
+@changes.register('activities')
+def activity_changed(event):
+    operation = event['operation']
+    document = event['document']
+    if operation == 'reload':
+        recommender.drop_profiles()
+        rankings.rankings.reset()
+    elif operation == 'insert' and document is not None:
+        if not event['local']:
+            recommender.drop_profiles([document['user_email']])
+            rankings.rankings.apply_deltas(rollups.add_activity({}, document))
+    # Updates and deletes arrive through their published deltas.
+    # Team totals and ranks are kept in MongoDB by the writing process.
+    invalidate('leaderboard')
+
+
+@changes.register('activity_deltas')
+def activity_deltas_published(event):
+    # Reloads are left to the activities handler, which reload_all reaches
+    # too: this collection's count also drops as its documents expire.
+    document = event['document']
+    if event['operation'] != 'insert' or event['local'] or document is None:
+        return
+    deltas = rollups.read_deltas(document)
+    recommender.drop_profiles({user_email for user_email, _ in deltas})
+    rankings.rankings.apply_deltas(deltas)
@@ -0,0 +1,111 @@
+"""
+Incremental maintenance of the team leaderboard.
+
+Team totals are adjusted with atomic `$inc` updates as activities are
+written, so reading `/api/leaderboard/` never rescans the activities
+collection. Ranks are recomputed from the (small) leaderboard collection
+and only rows whose rank actually changed are written back. Writers' teams
+come from the process's identity map, not from `users`.
+"""
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from .cache import invalidate
+from .identity import identity
+from .models import Leaderboard
+
+
+def team_for_email(user_email):
+    """Return the team name of the user with `user_email`, or None."""
+    return identity.team_of(user_email)
+
+
+def activity_totals(activity, sign=1):
+    """Return the leaderboard counters contributed by a single activity."""
+    return {
+        'total_activities': sign,
+        'total_calories': sign * activity.calories_burned,
+        'total_duration': sign * activity.duration,
+    }
+
+
+def apply_delta(team_name, delta):
+    """Atomically add `delta` to the totals of `team_name`'s leaderboard row."""
+    if not team_name or not any(delta.values()):
+        return
+    Leaderboard.objects.mongo_update_one(
+        {'team_name': team_name},
+        {
+            '$inc': delta,
+            '$set': {'updated_at': timezone.now()},
+            '$setOnInsert': {'rank': 0},
+        },
+        upsert=True,
+    )
+    invalidate('leaderboard')
+
+
+def refresh_ranks():
+    """
+    Recompute ranks by total calories and persist only the rows that moved.
+
+    Returns the number of rows whose rank changed.
+    """
+    rows = Leaderboard.objects.mongo_find(
+        {}, {'_id': 1, 'rank': 1}
+    ).sort([('total_calories', -1), ('team_name', 1)])
+    updates = [
+        UpdateOne({'_id': row['_id']}, {'$set': {'rank': rank}})
+        for rank, row in enumerate(rows, start=1)
+        if row.get('rank') != rank
+    ]
+    if updates:
+        Leaderboard.objects.mongo_bulk_write(updates, ordered=False)
+        invalidate('leaderboard')
+    return len(updates)
+
+
+def record_activity_created(activity):
+    apply_delta(team_for_email(activity.user_email), activity_totals(activity))
+    refresh_ranks()
+
+
+def record_activity_deleted(activity):
+    apply_delta(team_for_email(activity.user_email), activity_totals(activity, sign=-1))
+    refresh_ranks()
+
+
+def record_activity_updated(before, after):
+    """Move the difference between two versions of an activity onto the leaderboard."""
+    old_team = team_for_email(before.user_email)
+    new_team = team_for_email(after.user_email)
+    removed = activity_totals(before, sign=-1)
+    added = activity_totals(after)
+    if old_team == new_team:
+        apply_delta(new_team, {key: removed[key] + added[key] for key in added})
+    else:
+        apply_delta(old_team, removed)
+        apply_delta(new_team, added)
+    refresh_ranks()
+
+
+def record_activity_documents(documents):
+    """
+    Apply a batch of inserted activity documents with one `$inc` per team.
+    """
+    if not documents:
+        return
+    teams = identity.teams_of({doc['user_email'] for doc in documents})
+    deltas = {}
+    for doc in documents:
+        team_name = teams.get(doc['user_email'])
+        if not team_name:
+            continue
+        delta = deltas.setdefault(team_name, {'total_activities': 0, 'total_calories': 0, 'total_duration': 0})
+        delta['total_activities'] += 1
+        delta['total_calories'] += doc['calories_burned']
+        delta['total_duration'] += doc['duration']
+    for team_name, delta in deltas.items():
+        apply_delta(team_name, delta)
+    if deltas:
+        refresh_ranks()
@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from octofit_tracker.cache import get_response_cache
+from octofit_tracker.command_metrics import command_listener
+
+DEFAULT_ENDPOINTS = [
+    ('user-list', ''),
+    ('team-list', ''),
+    ('activity-list', ''),
+    ('activity-list', '?page_size=200'),
+    ('activity-stats', '?group_by=team'),
+    ('activity-stats', '?group_by=day&limit=30'),
+    ('leaderboard-list', ''),
+    ('workout-list', ''),
+    ('rollup-list', ''),
+]
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of already sorted `values`."""
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(samples, elapsed):
+    """
+    Return the report entry for one endpoint.
+
+    `samples` holds a (seconds, status, mongo commands) tuple per request;
+    the command count is None when it could not be measured.
+    """
+    latencies = sorted(seconds for seconds, _, _ in samples)
+    commands = [count for _, _, count in samples if count is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if status >= 400),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        'mongo_commands_per_request': round(sum(commands) / len(commands), 2) if commands else None,
+    }
+
+
+def compare(report, baseline, max_regression):
+    """
+    Return a description of each endpoint slower than in `baseline`.
+
+    An endpoint regresses when its p95 latency grows, or its throughput
+    drops, by more than `max_regression` percent.
+    """
+    limit = 1 + max_regression / 100
+    regressions = []
+    for path, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(path)
+        if previous is None:
+            continue
+        p95, previous_p95 = current['latency_ms']['p95'], previous['latency_ms']['p95']
+        if previous_p95 and p95 > previous_p95 * limit:
+            regressions.append(f'{path}: p95 {previous_p95}ms -> {p95}ms')
+        rps, previous_rps = current['throughput_rps'], previous['throughput_rps']
+        if rps and rps * limit < previous_rps:
+            regressions.append(f'{path}: throughput {previous_rps}/s -> {rps}/s')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'Seed a benchmark database and measure API latency, throughput and MongoDB commands per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default='octofit_bench',
+            help='MongoDB database to seed and query; it is wiped when seeding (default: octofit_bench).',
+        )
+        parser.add_argument(
+            '--mongomock',
+            action='store_true',
+            help='Run against an in-memory mongomock client instead of a local mongod.',
+        )
+        parser.add_argument('--users', type=int, default=200, help='Synthetic users to seed (default: 200).')
+        parser.add_argument(
+            '--activities-per-user',
+            type=int,
+            default=25,
+            help='Synthetic activities per user (default: 25).',
+        )
+        parser.add_argument('--teams', type=int, default=8, help='Synthetic teams (default: 8).')
+        parser.add_argument('--seed', type=int, default=800, help='Random seed for the synthetic data (default: 800).')
+        parser.add_argument(
+            '--skip-seed',
+            action='store_true',
+            help='Benchmark the data already in the database.',
+        )
+        parser.add_argument(
+            '--endpoint',
+            action='append',
+            dest='endpoints',
+            default=None,
+            help='API path to benchmark, e.g. "/api/activities/?user_email=x"; repeatable '
+                 '(default: every router list endpoint and the stats action).',
+        )
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint (default: 200).')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per endpoint (default: 10).')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads (default: 8).')
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--baseline', default=None, help='JSON report of an earlier run to compare against.')
+        parser.add_argument(
+            '--max-regression',
+            type=float,
+            default=10.0,
+            help='Percent p95 or throughput change vs. the baseline that fails the run (default: 10).',
+        )
+
+    def handle(self, *args, **options):
+        # Point the default connection at the benchmark database before the
+        # first query opens it, so seeding never touches octofit_db.
+        connection = connections['default']
+        connection.close()
+        connection.settings_dict['NAME'] = options['database']
+        if options['mongomock']:
+            try:
+                import mongomock
+            except ImportError:
+                raise CommandError('--mongomock needs the mongomock package (pip install mongomock).')
+            from djongo import database
+            database.clients[options['database']] = mongomock.MongoClient()
+
+        if not options['skip_seed']:
+            self.stderr.write(f"Seeding {options['database']}...")
+            call_command(
+                'populate_db',
+                users=options['users'],
+                activities_per_user=options['activities_per_user'],
+                teams=options['teams'],
+                seed=options['seed'],
+                # mongomock has no $dateFromParts, which the rollup rebuild needs.
+                skip_rollups=options['mongomock'],
+                stdout=self.stderr,
+            )
+
+        paths = options['endpoints'] or [reverse(name) + query for name, query in DEFAULT_ENDPOINTS]
+        report = {
+            'database': options['database'],
+            'backend': 'mongomock' if options['mongomock'] else 'mongod',
+            'users': options['users'],
+            'activities_per_user': options['activities_per_user'],
+            'teams': options['teams'],
+            'concurrency': options['concurrency'],
+            'endpoints': {},
+        }
+        get_response_cache().clear()
+        with ThreadPoolExecutor(max_workers=max(options['concurrency'], 1)) as executor:
+            for path in paths:
+                self.stderr.write(f'Benchmarking {path}...')
+                report['endpoints'][path] = self.run_endpoint(executor, path, options)
+
+        content = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(content + '\n')
+        else:
+            self.stdout.write(content)
+        for path, result in report['endpoints'].items():
+            latency = result['latency_ms']
+            self.stderr.write(
+                f"{path}: p50 {latency['p50']}ms p95 {latency['p95']}ms p99 {latency['p99']}ms, "
+                f"{result['throughput_rps']}/s, {result['mongo_commands_per_request']} commands/request, "
+                f"{result['errors']} errors"
+            )
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = compare(report, json.load(baseline), options['max_regression'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+            self.stderr.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run_endpoint(self, executor, path, options):
+        local = threading.local()
+        measure_commands = not options['mongomock']
+
+        def request(_):
+            # django.test.Client keeps per-instance state, so each thread gets its own.
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            command_listener.reset()
+            started = time.perf_counter()
+            response = local.client.get(path)
+            seconds = time.perf_counter() - started
+            commands = command_listener.read()[0] if measure_commands else None
+            return seconds, response.status_code, commands
+
+        list(executor.map(request, range(options['warmup'])))
+        started = time.perf_counter()
+        samples = list(executor.map(request, range(options['requests'])))
+        return summarize(samples, time.perf_counter() - started)
@@ -0,0 +1,166 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import BulkWriteError
+
+from octofit_tracker.models import Activity
+
+DUPLICATE_KEY = 11000
+
+# Refuses every insert and update, so writers that were not stopped fail
+# instead of writing to a collection that is being copied.
+FENCE = {'validator': {'$expr': False}, 'validationLevel': 'strict', 'validationAction': 'error'}
+
+
+class Command(BaseCommand):
+    help = 'Store the activities collection as a MongoDB time-series collection (MongoDB 7.0+)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--granularity',
+            choices=['seconds', 'minutes', 'hours'],
+            default=None,
+            help="Bucket granularity (default: ACTIVITIES_TIMESERIES['granularity']).",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Documents copied per insert_many batch (default: 5000).',
+        )
+        parser.add_argument(
+            '--drop-source',
+            action='store_true',
+            help='Drop the legacy collection once every document has been copied.',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Stop every worker that writes activities before running this.
+
+        The regular collection is fenced with a validator that refuses
+        inserts and updates, moved aside and copied in `_id` order into a
+        new time-series collection with a secondary `_id` index. The last
+        copied `_id` is kept in ``<activities>_conversion``, so rerunning
+        the command after an interruption resumes the copy; the batch that
+        was in flight is deleted from the target and copied again. The
+        conversion only completes once both collections hold the same
+        number of documents, which a delete that got past the fence breaks.
+        """
+        database = Activity.objects.mongo_database
+        name = Activity._meta.db_table
+        legacy = f'{name}_legacy'
+        timeseries = dict(getattr(settings, 'ACTIVITIES_TIMESERIES', {}))
+        if options['granularity']:
+            timeseries['granularity'] = options['granularity']
+
+        # Before 7.0 time-series collections only take updates and deletes
+        # filtered on the metaField, while the API updates and deletes
+        # activities by _id.
+        version = tuple(database.command('buildInfo')['versionArray'][:2])
+        if version < (7, 0):
+            raise CommandError(
+                f'MongoDB {version[0]}.{version[1]} rejects updates and deletes by _id on time-series '
+                'collections; activities can only be converted on MongoDB 7.0 or later.'
+            )
+
+        collections = {info['name']: info for info in database.list_collections()}
+        if collections.get(name, {}).get('type') == 'timeseries' and legacy not in collections:
+            self.create_id_index(database[name])
+            self.stdout.write(self.style.SUCCESS(f'{name} is already a time-series collection'))
+            return
+
+        if name in collections and collections[name].get('type') != 'timeseries':
+            if legacy in collections:
+                # A writer that was still running recreated the collection
+                # while it was moved aside.
+                self.merge_stray(database[name], database[legacy])
+            else:
+                self.stdout.write(f'Fencing {name} against writes...')
+                database.command('collMod', name, **FENCE)
+                self.stdout.write(f'Renaming {name} to {legacy}...')
+                database[name].rename(legacy)
+                collections[legacy] = collections[name]
+            del collections[name]
+        if legacy not in collections:
+            raise CommandError(f'{name} is neither a regular nor a time-series collection; nothing to convert.')
+        # Time-series collections cannot be renamed, so the new one is
+        # created under the final name.
+        if name not in collections:
+            self.stdout.write(f'Creating time-series collection {name} {timeseries}...')
+            database.create_collection(name, timeseries=timeseries)
+        self.create_id_index(database[name])
+
+        progress = database[f'{name}_conversion']
+        copied = self.copy(database[legacy], database[name], progress, max(options['batch_size'], 1))
+        self.stdout.write(self.style.SUCCESS(f'Copied {copied} activities into {name}'))
+
+        expected = database[legacy].count_documents({})
+        stored = database[name].count_documents({})
+        if stored != expected:
+            raise CommandError(
+                f'{name} holds {stored} documents but {legacy} has {expected}, so writes reached one of '
+                f'them during the copy; keeping {legacy}. Stop the workers, drop {name} and '
+                f'{progress.name} and rename {legacy} back to {name} to start over.'
+            )
+        progress.drop()
+        if options['drop_source']:
+            database[legacy].drop()
+            self.stdout.write(f'Dropped {legacy}')
+
+        call_command('sync_indexes', stdout=self.stdout)
+        self.stdout.write(self.style.WARNING(
+            'Change streams do not report writes to time-series collections: restart the '
+            'workers so that their change feeds poll activities instead.'
+        ))
+
+    def create_id_index(self, collection):
+        # Time-series collections have no _id index of their own; lookups,
+        # updates and deletes by _id, the export and the change feed's
+        # polling all need one.
+        collection.create_index([('_id', 1)], name=f'{collection.name}_id_idx')
+
+    def merge_stray(self, stray, legacy):
+        """Move the documents written to `stray` into the fenced `legacy` collection and drop `stray`."""
+        documents = list(stray.find({}))
+        self.stdout.write(f'Moving {len(documents)} activities written after {stray.name} was renamed into {legacy.name}...')
+        if documents:
+            try:
+                legacy.insert_many(documents, ordered=False, bypass_document_validation=True)
+            except BulkWriteError as exc:
+                errors = [error for error in exc.details.get('writeErrors', []) if error.get('code') != DUPLICATE_KEY]
+                if errors:
+                    raise CommandError(f'Moving the stray activities failed: {errors[:1]}')
+        stray.drop()
+
+    def copy(self, source, target, progress, batch_size):
+        """
+        Copy `source` into `target` in `_id` order from the last `_id`
+        recorded in `progress`; return the number of documents copied.
+        """
+        marker = progress.find_one({'_id': 'copy'})
+        last_id = marker['last_id'] if marker else None
+        if last_id is not None:
+            self.stdout.write(f'Resuming the copy after _id {last_id}')
+        copied = 0
+        while True:
+            query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+            batch = list(source.find(query).sort('_id', 1).limit(batch_size))
+            if not batch:
+                return copied
+            ids = [document['_id'] for document in batch]
+            if copied == 0:
+                # Whatever an interrupted run stored of this batch; the
+                # target has no unique _id to refuse it a second time.
+                target.delete_many({'_id': {'$in': ids}})
+            try:
+                target.insert_many(batch, ordered=False)
+            except BulkWriteError as exc:
+                raise CommandError(f'Copy failed after _id {last_id}: {exc.details.get("writeErrors", [])[:1]}')
+            stored = target.count_documents({'_id': {'$in': ids}})
+            if stored != len(batch):
+                raise CommandError(f'{stored} of the {len(batch)} activities after _id {last_id} were stored; rerun to copy them again.')
+            copied += len(batch)
+            last_id = ids[-1]
+            progress.replace_one({'_id': 'copy'}, {'_id': 'copy', 'last_id': last_id}, upsert=True)
+            self.stdout.write(f'  {copied} copied (last _id {last_id})')
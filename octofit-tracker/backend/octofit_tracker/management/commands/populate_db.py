@@ -1,12 +1,57 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from octofit_tracker.leaderboard import refresh_ranks
+from octofit_tracker.stats import activity_stats
+from octofit_tracker.utils import batched
+from django.utils import timezone
+from pymongo import ReadPreference
 from datetime import datetime, timedelta
 import random
 
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weight Training', 'Yoga', 'Boxing', 'CrossFit']
+
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=0,
+            help='Generate this many synthetic users instead of the superhero data set.',
+        )
+        parser.add_argument(
+            '--activities-per-user',
+            type=int,
+            default=10,
+            help='Synthetic activities generated for each user (default: 10).',
+        )
+        parser.add_argument(
+            '--teams',
+            type=int,
+            default=2,
+            help='Synthetic teams the users are spread across (default: 2).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Documents per unordered insert_many batch (default: 5000).',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Random seed, for reproducible synthetic data.',
+        )
+        parser.add_argument(
+            '--skip-rollups',
+            action='store_true',
+            help='Do not rebuild the daily rollups (run rebuild_rollups later).',
+        )
+
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Starting database population...'))
         
@@ -18,6 +63,116 @@ class Command(BaseCommand):
         Leaderboard.objects.all().delete()
         Workout.objects.all().delete()
         
+        if options['users']:
+            self.create_synthetic_data(
+                users=options['users'],
+                activities_per_user=options['activities_per_user'],
+                teams=max(options['teams'], 1),
+                batch_size=max(options['batch_size'], 1),
+                seed=options['seed'],
+            )
+        else:
+            self.create_heroes()
+        
+        # Create Leaderboard entries
+        self.stdout.write('Creating leaderboard entries...')
+        
+        # Aggregate team totals in MongoDB and rank them
+        team_totals = {row['team']: row for row in activity_stats('team', read_preference=ReadPreference.PRIMARY)}
+        entries = []
+        for team_name in Team.objects.values_list('name', flat=True):
+            totals = team_totals.get(team_name, {})
+            entries.append({
+                'team_name': team_name,
+                'total_activities': totals.get('total_activities', 0),
+                'total_calories': totals.get('total_calories', 0),
+                'total_duration': totals.get('total_duration', 0),
+                'rank': 0,
+                'updated_at': timezone.now(),
+            })
+        if entries:
+            Leaderboard.objects.mongo_insert_many(entries)
+        refresh_ranks()
+        
+        # Build the per-user daily rollups
+        if not options['skip_rollups']:
+            self.stdout.write('Building daily rollups...')
+            call_command('rebuild_rollups', stdout=self.stdout)
+        
+        # Create Workouts
+        self.stdout.write('Creating workouts...')
+        workouts_data = [
+            {
+                'name': 'Superhero Strength Training',
+                'description': 'Build strength like a superhero with compound movements',
+                'activity_type': 'Weight Training',
+                'difficulty': 'intermediate',
+                'duration': 45,
+                'calories_estimate': 350,
+                'instructions': '1. Warm up 5 mins\n2. Bench press 3x10\n3. Squats 3x10\n4. Deadlifts 3x10\n5. Cool down'
+            },
+            {
+                'name': 'Speedster Cardio Blast',
+                'description': 'High-intensity cardio workout to boost speed and endurance',
+                'activity_type': 'Running',
+                'difficulty': 'advanced',
+                'duration': 30,
+                'calories_estimate': 400,
+                'instructions': '1. Warm up jog 5 mins\n2. Sprint intervals 20 mins\n3. Cool down jog 5 mins'
+            },
+            {
+                'name': 'Warrior Yoga Flow',
+                'description': 'Flexibility and balance training for warriors',
+                'activity_type': 'Yoga',
+                'difficulty': 'beginner',
+                'duration': 30,
+                'calories_estimate': 150,
+                'instructions': '1. Sun salutations\n2. Warrior poses\n3. Balance poses\n4. Relaxation'
+            },
+            {
+                'name': 'Hero HIIT Circuit',
+                'description': 'High-intensity interval training for maximum results',
+                'activity_type': 'CrossFit',
+                'difficulty': 'advanced',
+                'duration': 40,
+                'calories_estimate': 450,
+                'instructions': '1. Burpees 1 min\n2. Mountain climbers 1 min\n3. Jump squats 1 min\n4. Rest 30s\n5. Repeat 8 rounds'
+            },
+            {
+                'name': 'Aquatic Power Swim',
+                'description': 'Build endurance with swimming laps',
+                'activity_type': 'Swimming',
+                'difficulty': 'intermediate',
+                'duration': 45,
+                'calories_estimate': 380,
+                'instructions': '1. Warm up 5 mins easy swim\n2. Freestyle laps 20 mins\n3. Backstroke 10 mins\n4. Cool down 10 mins'
+            },
+            {
+                'name': 'Combat Boxing Session',
+                'description': 'Boxing workout for strength and agility',
+                'activity_type': 'Boxing',
+                'difficulty': 'intermediate',
+                'duration': 50,
+                'calories_estimate': 420,
+                'instructions': '1. Jump rope 5 mins\n2. Shadow boxing 10 mins\n3. Heavy bag work 20 mins\n4. Speed bag 10 mins\n5. Cool down'
+            },
+        ]
+        
+        for workout_data in workouts_data:
+            Workout.objects.create(**workout_data)
+        
+        # Print summary
+        self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
+        self.stdout.write(f'Teams created: {Team.objects.count()}')
+        self.stdout.write(f'Users created: {User.objects.count()}')
+        self.stdout.write(f'Activities created: {Activity.objects.count()}')
+        self.stdout.write(f'Leaderboard entries: {Leaderboard.objects.count()}')
+        self.stdout.write(f'Workouts created: {Workout.objects.count()}')
+        self.stdout.write('')
+        for row in list(team_totals.values())[:10]:
+            self.stdout.write(self.style.SUCCESS('{}: {} total calories'.format(row['team'], row['total_calories'])))
+
+    def create_heroes(self):
         # Create Teams
         self.stdout.write('Creating teams...')
         team_marvel = Team.objects.create(
@@ -78,14 +233,13 @@ class Command(BaseCommand):
         
         # Create Activities
         self.stdout.write('Creating activities...')
-        activity_types = ['Running', 'Cycling', 'Swimming', 'Weight Training', 'Yoga', 'Boxing', 'CrossFit']
         all_users = marvel_users + dc_users
         
         for user in all_users:
             # Create 5-10 activities per user
             num_activities = random.randint(5, 10)
             for i in range(num_activities):
-                activity_type = random.choice(activity_types)
+                activity_type = random.choice(ACTIVITY_TYPES)
                 duration = random.randint(20, 120)
                 calories = int(duration * random.uniform(5, 12))
                 days_ago = random.randint(0, 30)
@@ -98,112 +252,64 @@ class Command(BaseCommand):
                     date=datetime.now() - timedelta(days=days_ago),
                     notes=f'{activity_type} session by {user.name}'
                 )
-        
-        # Create Leaderboard entries
-        self.stdout.write('Creating leaderboard entries...')
-        
-        # Calculate Team Marvel stats
-        marvel_activities = Activity.objects.filter(user_email__in=[u.email for u in marvel_users])
-        marvel_total_activities = marvel_activities.count()
-        marvel_total_calories = sum([a.calories_burned for a in marvel_activities])
-        marvel_total_duration = sum([a.duration for a in marvel_activities])
-        
-        # Calculate Team DC stats
-        dc_activities = Activity.objects.filter(user_email__in=[u.email for u in dc_users])
-        dc_total_activities = dc_activities.count()
-        dc_total_calories = sum([a.calories_burned for a in dc_activities])
-        dc_total_duration = sum([a.duration for a in dc_activities])
-        
-        # Determine ranks
-        if marvel_total_calories > dc_total_calories:
-            marvel_rank, dc_rank = 1, 2
-        else:
-            marvel_rank, dc_rank = 2, 1
-        
-        Leaderboard.objects.create(
-            team_name='Team Marvel',
-            total_activities=marvel_total_activities,
-            total_calories=marvel_total_calories,
-            total_duration=marvel_total_duration,
-            rank=marvel_rank
-        )
-        
-        Leaderboard.objects.create(
-            team_name='Team DC',
-            total_activities=dc_total_activities,
-            total_calories=dc_total_calories,
-            total_duration=dc_total_duration,
-            rank=dc_rank
-        )
-        
-        # Create Workouts
-        self.stdout.write('Creating workouts...')
-        workouts_data = [
-            {
-                'name': 'Superhero Strength Training',
-                'description': 'Build strength like a superhero with compound movements',
-                'activity_type': 'Weight Training',
-                'difficulty': 'intermediate',
-                'duration': 45,
-                'calories_estimate': 350,
-                'instructions': '1. Warm up 5 mins\n2. Bench press 3x10\n3. Squats 3x10\n4. Deadlifts 3x10\n5. Cool down'
-            },
-            {
-                'name': 'Speedster Cardio Blast',
-                'description': 'High-intensity cardio workout to boost speed and endurance',
-                'activity_type': 'Running',
-                'difficulty': 'advanced',
-                'duration': 30,
-                'calories_estimate': 400,
-                'instructions': '1. Warm up jog 5 mins\n2. Sprint intervals 20 mins\n3. Cool down jog 5 mins'
-            },
-            {
-                'name': 'Warrior Yoga Flow',
-                'description': 'Flexibility and balance training for warriors',
-                'activity_type': 'Yoga',
-                'difficulty': 'beginner',
-                'duration': 30,
-                'calories_estimate': 150,
-                'instructions': '1. Sun salutations\n2. Warrior poses\n3. Balance poses\n4. Relaxation'
-            },
-            {
-                'name': 'Hero HIIT Circuit',
-                'description': 'High-intensity interval training for maximum results',
-                'activity_type': 'CrossFit',
-                'difficulty': 'advanced',
-                'duration': 40,
-                'calories_estimate': 450,
-                'instructions': '1. Burpees 1 min\n2. Mountain climbers 1 min\n3. Jump squats 1 min\n4. Rest 30s\n5. Repeat 8 rounds'
-            },
+
+    def create_synthetic_data(self, users, activities_per_user, teams, batch_size, seed=None):
+        """
+        Stream generated teams, users and activities into MongoDB.
+
+        Documents are produced lazily and written with unordered
+        `insert_many` batches, so memory stays flat however many are made.
+        """
+        rng = random.Random(seed)
+        now = timezone.now()
+        team_names = [f'Team {number}' for number in range(1, teams + 1)]
+
+        self.stdout.write(f'Creating {teams} synthetic teams...')
+        Team.objects.mongo_insert_many([
             {
-                'name': 'Aquatic Power Swim',
-                'description': 'Build endurance with swimming laps',
-                'activity_type': 'Swimming',
-                'difficulty': 'intermediate',
-                'duration': 45,
-                'calories_estimate': 380,
-                'instructions': '1. Warm up 5 mins easy swim\n2. Freestyle laps 20 mins\n3. Backstroke 10 mins\n4. Cool down 10 mins'
-            },
+                'name': name,
+                'description': f'Synthetic load-test team {name}.',
+                'created_at': now,
+                'members_count': users // teams + (1 if number < users % teams else 0),
+            }
+            for number, name in enumerate(team_names)
+        ])
+
+        self.stdout.write(f'Creating {users} synthetic users...')
+        user_docs = (
             {
-                'name': 'Combat Boxing Session',
-                'description': 'Boxing workout for strength and agility',
-                'activity_type': 'Boxing',
-                'difficulty': 'intermediate',
-                'duration': 50,
-                'calories_estimate': 420,
-                'instructions': '1. Jump rope 5 mins\n2. Shadow boxing 10 mins\n3. Heavy bag work 20 mins\n4. Speed bag 10 mins\n5. Cool down'
-            },
-        ]
-        
-        for workout_data in workouts_data:
-            Workout.objects.create(**workout_data)
-        
-        # Print summary
-        self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
-        self.stdout.write(f'Teams created: {Team.objects.count()}')
-        self.stdout.write(f'Users created: {User.objects.count()}')
-        self.stdout.write(f'Activities created: {Activity.objects.count()}')
-        self.stdout.write(f'Leaderboard entries: {Leaderboard.objects.count()}')
-        self.stdout.write(f'Workouts created: {Workout.objects.count()}')
-        self.stdout.write(self.style.SUCCESS('\nTeam Marvel: {} total calories'.format(marvel_total_calories)))
-        self.stdout.write(self.style.SUCCESS('Team DC: {} total calories'.format(dc_total_calories)))
+                'name': f'Athlete {number}',
+                'email': f'athlete{number}@octofit.test',
+                'team': team_names[number % teams],
+                'created_at': now,
+            }
+            for number in range(users)
+        )
+        for batch in batched(user_docs, batch_size):
+            User.objects.mongo_insert_many(batch, ordered=False)
+
+        total = users * activities_per_user
+        self.stdout.write(f'Creating {total} synthetic activities...')
+        activity_docs = (
+            self.synthetic_activity(rng, f'athlete{number}@octofit.test', now)
+            for number in range(users)
+            for _ in range(activities_per_user)
+        )
+        written = 0
+        for batch in batched(activity_docs, batch_size):
+            Activity.objects.mongo_insert_many(batch, ordered=False)
+            written += len(batch)
+            self.stdout.write(f'  {written}/{total} activities written')
+
+    @staticmethod
+    def synthetic_activity(rng, user_email, now):
+        activity_type = rng.choice(ACTIVITY_TYPES)
+        duration = rng.randint(20, 120)
+        return {
+            'user_email': user_email,
+            'activity_type': activity_type,
+            'duration': duration,
+            'calories_burned': int(duration * rng.uniform(5, 12)),
+            'date': now - timedelta(days=rng.randint(0, 30), minutes=rng.randint(0, 1439)),
+            'notes': f'{activity_type} session',
+        }
@@ -0,0 +1,100 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from octofit_tracker.management.commands.sync_indexes import declared_indexes
+from octofit_tracker.models import Activity, DailyRollup
+from octofit_tracker.rollups import day_of, rollup_pipeline
+from octofit_tracker.utils import batched
+
+# Rollups written up to this long before the rebuild started are caught up
+# too, in case the clocks of the command and the workers disagree.
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user daily rollups from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-days',
+            type=int,
+            default=30,
+            help='Days of activities aggregated per chunk (default: 30).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rollup documents per insert_many batch (default: 5000).',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Build the rollups into a separate collection and swap it in with one
+        rename, so readers never see them empty or half built.
+
+        The workers keep applying their `$inc` deltas to the live rollups
+        meanwhile. Before the swap, the (user, day) rollups they touched
+        during the build are aggregated again from the activities. Writes
+        landing between that catch-up and the swap are not in the new
+        rollups.
+        """
+        chunk = timedelta(days=max(options['chunk_days'], 1))
+        batch_size = max(options['batch_size'], 1)
+        database = DailyRollup.objects.mongo_database
+        name = DailyRollup._meta.db_table
+        live = database[name]
+        target = database[f'{name}_rebuild']
+        started = timezone.now()
+
+        # Left over by an interrupted rebuild.
+        target.drop()
+        for key, index_options in declared_indexes(DailyRollup).items():
+            target.create_index(list(key), **index_options)
+
+        first = next(Activity.objects.mongo_find({}, {'date': 1}).sort('date', 1).limit(1), None)
+        last = next(Activity.objects.mongo_find({}, {'date': 1}).sort('date', -1).limit(1), None)
+        written = 0
+        if first is not None:
+            start = day_of(first['date'])
+            end = day_of(last['date']) + timedelta(days=1)
+            while start < end:
+                # Chunks are whole days, so no (user, day) rollup spans two chunks.
+                stop = min(start + chunk, end)
+                written += self.write(target, rollup_pipeline(start, stop), batch_size)
+                self.stdout.write(f'  {start:%Y-%m-%d} to {stop:%Y-%m-%d}: {written} rollups written')
+                start = stop
+
+        touched = {}
+        for rollup in live.find({'updated_at': {'$gte': started - CLOCK_SKEW}}, {'user_email': 1, 'day': 1}):
+            touched.setdefault(rollup['day'], set()).add(rollup['user_email'])
+        for day, user_emails in sorted(touched.items()):
+            target.delete_many({'day': day, 'user_email': {'$in': sorted(user_emails)}})
+            self.write(target, rollup_pipeline(day, day + timedelta(days=1), sorted(user_emails)), batch_size)
+        if touched:
+            self.stdout.write(f'  {sum(map(len, touched.values()))} rollups written meanwhile caught up')
+
+        target.rename(name, dropTarget=True)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} daily rollups'))
+
+    def write(self, collection, pipeline, batch_size):
+        """Insert the rollups `pipeline` aggregates from the activities into `collection`."""
+        now = timezone.now()
+        rollups = (
+            {
+                'user_email': row['_id']['user_email'],
+                'day': row['_id']['day'],
+                'total_activities': row['total_activities'],
+                'total_calories': row['total_calories'],
+                'total_duration': row['total_duration'],
+                'updated_at': now,
+            }
+            for row in Activity.objects.mongo_aggregate(pipeline, allowDiskUse=True)
+        )
+        written = 0
+        for batch in batched(rollups, batch_size):
+            collection.insert_many(batch, ordered=False)
+            written += len(batch)
+        return written
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.teams import reconcile_members_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount team members from the users collection and fix drifted members_count values'
+
+    def handle(self, *args, **options):
+        drift = reconcile_members_counts()
+        for team_name, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(self.style.WARNING(f'{team_name}: members_count {stored} -> {actual}'))
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {len(drift)} team(s)'))
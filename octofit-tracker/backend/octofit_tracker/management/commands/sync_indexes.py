@@ -0,0 +1,126 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from pymongo.errors import OperationFailure
+
+from octofit_tracker.changes import timeseries_collections
+
+
+def declared_indexes(model, timeseries=False):
+    """
+    Return {key: options} for the indexes a model declares.
+
+    `key` is the pymongo key specification as a tuple of (field, direction)
+    pairs, covering `Meta.indexes`, `Meta.unique_together`, single-field
+    `unique=True` fields and the model's `text_index`, if any. A
+    time-series collection cannot have a text index, so with `timeseries`
+    the `text_index` is left out.
+    """
+    declared = {}
+    for index in model._meta.indexes:
+        key = tuple(
+            (model._meta.get_field(name.lstrip('-')).column, -1 if name.startswith('-') else 1)
+            for name in index.fields
+        )
+        declared[key] = {'name': index.name}
+    for names in model._meta.unique_together:
+        key = tuple((model._meta.get_field(name).column, 1) for name in names)
+        declared[key] = {'unique': True}
+    for field in model._meta.local_fields:
+        if field.unique and not field.primary_key:
+            declared[((field.column, 1),)] = {'unique': True}
+    text_index = getattr(model, 'text_index', None)
+    if text_index and not timeseries:
+        key = tuple((model._meta.get_field(name).column, 'text') for name in text_index['fields'])
+        declared[key] = {'name': text_index['name']}
+    return declared
+
+
+def key_direction(direction):
+    """Normalize a stored index direction: 1.0 → 1; 'text', '2dsphere' and 'hashed' stay as they are."""
+    if isinstance(direction, (int, float)):
+        return int(direction)
+    return direction
+
+
+def live_key(info):
+    """Return the key of an `index_information()` entry as it would be declared."""
+    key = []
+    for field, direction in info['key']:
+        # A text index is stored as _fts/_ftsx, with its fields in `weights`.
+        if field == '_fts':
+            key.extend((name, 'text') for name in sorted(info.get('weights', {})))
+        elif field != '_ftsx':
+            key.append((field, key_direction(direction)))
+    return tuple(key)
+
+
+def live_indexes(model):
+    """Return {key: name} for the indexes present on the model's collection."""
+    return {live_key(info): name for name, info in model.objects.mongo_index_information().items()}
+
+
+def index_usage(model):
+    """Return {name: ops} from `$indexStats`, or None if the server can't report it."""
+    try:
+        return {
+            row['name']: row['accesses']['ops']
+            for row in model.objects.mongo_aggregate([{'$indexStats': {}}])
+        }
+    except OperationFailure:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Create missing MongoDB indexes declared on the models and report unused ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the differences, do not create any index.',
+        )
+
+    def handle(self, *args, **options):
+        models = list(apps.get_app_config('octofit_tracker').get_models())
+        timeseries = set(timeseries_collections(
+            models[0].objects.mongo_database, [model._meta.db_table for model in models]
+        )) if models else set()
+        failures = 0
+        for model in models:
+            collection = model._meta.db_table
+            declared = declared_indexes(model, timeseries=collection in timeseries)
+            live = live_indexes(model)
+            if collection in timeseries and getattr(model, 'text_index', None):
+                self.stdout.write(self.style.WARNING(
+                    f'{collection}: skipping text index {model.text_index["name"]}; '
+                    'time-series collections cannot have one'
+                ))
+
+            for key, index_options in declared.items():
+                if key in live:
+                    continue
+                spec = ', '.join(f'{field}: {direction}' for field, direction in key)
+                if options['dry_run']:
+                    self.stdout.write(self.style.WARNING(f'{collection}: missing index {{{spec}}}'))
+                    continue
+                try:
+                    name = model.objects.mongo_create_index(list(key), background=True, **index_options)
+                except OperationFailure as exc:
+                    failures += 1
+                    self.stderr.write(self.style.ERROR(f'{collection}: could not create index {{{spec}}}: {exc}'))
+                    continue
+                self.stdout.write(self.style.SUCCESS(f'{collection}: created index {name} {{{spec}}}'))
+
+            usage = index_usage(model)
+            for key, name in live.items():
+                if key == (('_id', 1),):
+                    continue
+                if key not in declared:
+                    self.stdout.write(self.style.WARNING(f'{collection}: index {name} is not declared on {model.__name__}'))
+                if usage is not None and usage.get(name) == 0:
+                    self.stdout.write(self.style.WARNING(f'{collection}: index {name} has not been used since the last restart'))
+
+        if failures:
+            self.stdout.write(self.style.ERROR(f'Index synchronization complete; {failures} indexes could not be created'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Index synchronization complete'))
@@ -6,9 +6,14 @@ class User(models.Model):
     email = models.EmailField(unique=True)
     team = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team'], name='users_team_idx'),
+        ]
     
     def __str__(self):
         return self.name
@@ -20,6 +25,8 @@ class Team(models.Model):
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     members_count = models.IntegerField(default=0)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'teams'
@@ -36,9 +43,21 @@ class Activity(models.Model):
     calories_burned = models.IntegerField()
     date = models.DateTimeField()
     notes = models.TextField(blank=True)
+
+    objects = models.DjongoManager()
+
+    # MongoDB text index behind the search of activity notes (see search.py).
+    # Meta.indexes cannot declare one; sync_indexes reads it from here.
+    text_index = {'fields': ['notes'], 'name': 'activities_notes_text'}
     
     class Meta:
         db_table = 'activities'
+        indexes = [
+            # Serves the newest-first list pages (ActivityViewSet.ordering).
+            models.Index(fields=['-date', '_id'], name='activities_date_idx'),
+            models.Index(fields=['user_email', 'date'], name='activities_user_date_idx'),
+            models.Index(fields=['activity_type', 'date'], name='activities_type_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user_email} - {self.activity_type}"
@@ -52,10 +71,15 @@ class Leaderboard(models.Model):
     total_duration = models.IntegerField(default=0)  # in minutes
     rank = models.IntegerField(default=0)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'leaderboard'
         ordering = ['-total_calories']
+        indexes = [
+            models.Index(fields=['rank'], name='leaderboard_rank_idx'),
+        ]
     
     def __str__(self):
         return f"{self.team_name} - Rank {self.rank}"
@@ -70,9 +94,34 @@ class Workout(models.Model):
     duration = models.IntegerField()  # in minutes
     calories_estimate = models.IntegerField()
     instructions = models.TextField()
+
+    objects = models.DjongoManager()
     
     class Meta:
         db_table = 'workouts'
     
     def __str__(self):
         return self.name
+
+
+class DailyRollup(models.Model):
+    _id = models.ObjectIdField(primary_key=True)
+    user_email = models.EmailField()
+    day = models.DateTimeField()  # midnight UTC of the activity date
+    total_activities = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
+    
+    class Meta:
+        db_table = 'daily_rollups'
+        unique_together = [('user_email', 'day')]
+        indexes = [
+            # Window reads across athletes: rankings reloads and /api/rollups/.
+            models.Index(fields=['day'], name='daily_rollups_day_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_email} - {self.day:%Y-%m-%d}"
@@ -0,0 +1,65 @@
+"""
+Helpers for reading MongoDB collections directly through pymongo.
+
+Djongo keeps a single MongoClient per database, so a different read
+preference cannot be given to a second database alias. Read-only list
+and reporting paths instead take a collection handle carrying
+``MONGO_LIST_READ_PREFERENCE``.
+
+`find_document` and `instance_from_document` fetch and hydrate a single
+document without going through Djongo's SQL translation.
+"""
+from django.conf import settings
+from django.db import connections
+from pymongo import ReadPreference
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
+
+def list_read_preference():
+    return READ_PREFERENCES[getattr(settings, 'MONGO_LIST_READ_PREFERENCE', 'primary')]
+
+
+def list_read_collection(model, read_preference=None):
+    """Return `model`'s collection using the list read preference (or `read_preference`)."""
+    return model.objects.mongo_with_options(read_preference=read_preference or list_read_preference())
+
+
+def find_document(model, object_id):
+    """Return the raw document with `_id` `object_id`, or None."""
+    return model.objects.mongo_find_one({'_id': object_id})
+
+
+_converters = {}
+
+
+def field_converters(model, using='default'):
+    """Return [(column, expression, converters)] mirroring what a Djongo query applies."""
+    key = (model, using)
+    if key not in _converters:
+        connection = connections[using]
+        columns = []
+        for field in model._meta.concrete_fields:
+            expression = field.get_col(model._meta.db_table)
+            converters = connection.ops.get_db_converters(expression) + field.get_db_converters(connection)
+            columns.append((field.column, expression, converters))
+        _converters[key] = columns
+    return _converters[key]
+
+
+def instance_from_document(model, document, using='default'):
+    """Build a `model` instance from a raw document, as `Model.objects.get` would."""
+    connection = connections[using]
+    values = []
+    for column, expression, converters in field_converters(model, using):
+        value = document.get(column)
+        for converter in converters:
+            value = converter(value, expression, connection)
+        values.append(value)
+    return model.from_db(using, [field.attname for field in model._meta.concrete_fields], values)
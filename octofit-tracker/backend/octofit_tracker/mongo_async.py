@@ -0,0 +1,72 @@
+"""
+Non-blocking MongoDB access for async views.
+
+Each event loop gets its own Motor client (and connection pool), built
+from the Djongo connection settings plus ``ASYNC_MONGO_CLIENT``, whose
+``event_listeners`` replace the Djongo client's.
+
+Motor 2.5, the last release working with Djongo's pymongo 3, does not
+import on Python 3.11 and later. There the synchronous stack still runs,
+the ``octofit_tracker.W001`` system check warns at startup, and the
+async views answer 503.
+"""
+import asyncio
+import sys
+import weakref
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+
+from .mongo import list_read_preference
+
+_clients = weakref.WeakKeyDictionary()
+_motor_error = None
+
+
+def motor_client_class():
+    """Return Motor's client class; raises ImproperlyConfigured where Motor does not import."""
+    global _motor_error
+    if _motor_error is None:
+        # Imported here so the synchronous stack never depends on Motor.
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+        except ImportError as exc:
+            _motor_error = (
+                f'Motor does not import on Python {sys.version_info[0]}.{sys.version_info[1]} ({exc}); '
+                'the async endpoints need Python 3.10 (see requirements.txt).'
+            )
+        else:
+            return AsyncIOMotorClient
+    raise ImproperlyConfigured(_motor_error)
+
+
+def motor_available():
+    try:
+        motor_client_class()
+    except ImproperlyConfigured:
+        return False
+    return True
+
+
+@checks.register()
+def check_motor(app_configs, **kwargs):
+    if motor_available():
+        return []
+    return [checks.Warning(_motor_error, hint='Run the server on Python 3.10.', id='octofit_tracker.W001')]
+
+
+def get_database():
+    """Return the Motor database for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        database = settings.DATABASES['default']
+        options = {**database.get('CLIENT', {}), **getattr(settings, 'ASYNC_MONGO_CLIENT', {})}
+        client = _clients[loop] = motor_client_class()(io_loop=loop, **options)
+    return client[settings.DATABASES['default']['NAME']]
+
+
+def get_collection(model):
+    """Return `model`'s collection, reading with the list read preference."""
+    return get_database()[model._meta.db_table].with_options(read_preference=list_read_preference())
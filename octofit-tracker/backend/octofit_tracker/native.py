@@ -0,0 +1,151 @@
+"""
+Native MongoDB queries for the hot list endpoints.
+
+Djongo builds SQL from every ORM call and parses it back into a MongoDB
+query. `NativeQuerySet` implements the part of the QuerySet API the list
+path uses (exact and range `filter` lookups, `order_by`, `values`,
+slicing, iteration and `count`) and runs it as one pymongo `find` on the
+list read collection. Rows are dicts converted like `.values()` rows, so
+the serializers' fast path and the cursor paginator consume them as is.
+
+A viewset using `FastListMixin` opts in with ``native_queries = True``.
+"""
+from django.db import connections
+
+from .mongo import field_converters, list_read_collection
+
+LOOKUP_OPERATORS = {
+    'exact': '$eq',
+    'gt': '$gt',
+    'gte': '$gte',
+    'lt': '$lt',
+    'lte': '$lte',
+    'in': '$in',
+}
+
+
+class NativeQuerySet:
+    """
+    Lazy, immutable MongoDB query on one model's collection.
+    """
+
+    def __init__(self, model, using='default'):
+        self.model = model
+        self.db = using
+        self.query = {}
+        self.sort = []
+        self.fields = None
+        self.offset = 0
+        self.limit = None
+        self._result_cache = None
+
+    def _clone(self):
+        clone = NativeQuerySet(self.model, self.db)
+        clone.query = {column: dict(condition) for column, condition in self.query.items()}
+        clone.sort = list(self.sort)
+        clone.fields = self.fields
+        clone.offset = self.offset
+        clone.limit = self.limit
+        return clone
+
+    def filter(self, **lookups):
+        connection = connections[self.db]
+        clone = self._clone()
+        for name, value in lookups.items():
+            field_name, _, lookup = name.partition('__')
+            operator = LOOKUP_OPERATORS.get(lookup or 'exact')
+            if operator is None:
+                raise ValueError(f"Unsupported lookup '{lookup}' in native query.")
+            field = self.model._meta.get_field(field_name)
+            if operator == '$in':
+                value = [field.get_db_prep_value(field.to_python(item), connection) for item in value]
+            else:
+                value = field.get_db_prep_value(field.to_python(value), connection)
+            clone.query.setdefault(field.column, {})[operator] = value
+        return clone
+
+    def order_by(self, *names):
+        clone = self._clone()
+        clone.sort = [
+            (self.model._meta.get_field(name.lstrip('-')).column, -1 if name.startswith('-') else 1)
+            for name in names
+        ]
+        return clone
+
+    def values(self, *names):
+        clone = self._clone()
+        clone.fields = list(names) or None
+        return clone
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('Native querysets only support [start:stop] slicing.')
+        start, stop = index.start or 0, index.stop
+        clone = self._clone()
+        clone.offset = self.offset + start
+        if stop is not None:
+            clone.limit = max(stop - start, 0)
+            if self.limit is not None:
+                clone.limit = min(clone.limit, max(self.limit - start, 0))
+        elif self.limit is not None:
+            clone.limit = max(self.limit - start, 0)
+        return clone
+
+    def mongo_query(self):
+        """Return the query document, with `$eq`-only conditions as plain values."""
+        return {
+            column: condition['$eq'] if list(condition) == ['$eq'] else condition
+            for column, condition in self.query.items()
+        }
+
+    def columns(self):
+        """Return [(key, column, expression, converters)] for the selected fields."""
+        names = set(self.fields) if self.fields else None
+        return [
+            (field.attname, column, expression, converters)
+            for field, (column, expression, converters) in zip(
+                self.model._meta.concrete_fields, field_converters(self.model, self.db)
+            )
+            if names is None or field.attname in names
+        ]
+
+    def iterator(self):
+        if self.limit == 0:
+            return
+        columns = self.columns()
+        connection = connections[self.db]
+        cursor = list_read_collection(self.model).find(
+            self.mongo_query(), {column: 1 for _, column, _, _ in columns}
+        )
+        if self.sort:
+            cursor = cursor.sort(self.sort)
+        if self.offset:
+            cursor = cursor.skip(self.offset)
+        if self.limit is not None:
+            cursor = cursor.limit(self.limit)
+        for document in cursor:
+            row = {}
+            for key, column, expression, converters in columns:
+                value = document.get(column)
+                for converter in converters:
+                    value = converter(value, expression, connection)
+                row[key] = value
+            yield row
+
+    def __iter__(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.iterator())
+        return iter(self._result_cache)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        options = {'skip': self.offset} if self.offset else {}
+        if self.limit is not None:
+            options['limit'] = self.limit
+            if self.limit == 0:
+                return 0
+        return list_read_collection(self.model).count_documents(self.mongo_query(), **options)
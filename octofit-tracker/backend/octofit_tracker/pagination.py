@@ -0,0 +1,43 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination for the router-registered viewsets.
+
+    Pages are selected with a range filter on the ordering field instead of
+    an OFFSET/skip scan, and the next/previous links carry opaque cursors.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-_id'
+
+    def decode_cursor(self, request):
+        # Cursors carry the position as text; `_id` positions are compared
+        # as ObjectIds by MongoDB, so they are converted back before the
+        # range filter.
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None or self.ordering[0].lstrip('-') != '_id':
+            return cursor
+        try:
+            return cursor._replace(position=ObjectId(cursor.position))
+        except (InvalidId, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class ActivityCursorPagination(KeysetCursorPagination):
+    """
+    Activities are paged newest first by their `date` field.
+    """
+    ordering = '-date'
+
+
+class LeaderboardCursorPagination(KeysetCursorPagination):
+    """
+    Leaderboard rows are paged by rank.
+    """
+    ordering = 'rank'
@@ -0,0 +1,136 @@
+"""
+MongoDB connection pool metrics.
+
+`pool_listener` is registered on the Djongo client through the
+``event_listeners`` client option and records, per server address, how
+long requests wait to check a connection out of the pool and how many
+connections are created and closed (churn). The Motor clients of the
+async views have their own pool, measured by `async_pool_listener`.
+`snapshot()` and `async_snapshot()` expose the numbers for the health
+endpoint.
+"""
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+from pymongo import monitoring
+
+# Number of most recent checkout waits kept per address for percentiles.
+WAIT_SAMPLES = 1024
+
+
+class AddressStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checked_out = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.pool_clears = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.max_wait = 0.0
+
+    def as_dict(self):
+        waits = sorted(self.waits)
+
+        def percentile(fraction):
+            if not waits:
+                return 0.0
+            return round(waits[min(int(len(waits) * fraction), len(waits) - 1)] * 1000, 3)
+
+        return {
+            'checkouts': self.checkouts,
+            'checkout_failures': self.checkout_failures,
+            'checked_out': self.checked_out,
+            'open_connections': self.connections_created - self.connections_closed,
+            'connections_created': self.connections_created,
+            'connections_closed': self.connections_closed,
+            'pool_clears': self.pool_clears,
+            'checkout_wait_ms': {
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'p99': percentile(0.99),
+                'max': round(self.max_wait * 1000, 3),
+            },
+        }
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener measuring checkout waits.
+
+    A checkout starts and completes on the requesting thread, so the start
+    time is kept in a thread local.
+    """
+
+    def __init__(self):
+        self._stats = defaultdict(AddressStats)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _address(self, event):
+        return '{}:{}'.format(*event.address)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        wait = time.perf_counter() - started if started is not None else 0.0
+        with self._lock:
+            stats = self._stats[self._address(event)]
+            stats.checkouts += 1
+            stats.checked_out += 1
+            stats.waits.append(wait)
+            stats.max_wait = max(stats.max_wait, wait)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._stats[self._address(event)].checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._stats[self._address(event)].checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self._stats[self._address(event)].connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._stats[self._address(event)].connections_closed += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._stats[self._address(event)].pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'addresses': {address: stats.as_dict() for address, stats in self._stats.items()},
+            }
+
+
+pool_listener = PoolMetricsListener()
+async_pool_listener = PoolMetricsListener()
+
+
+def snapshot():
+    """Return the pool metrics of this worker process."""
+    return pool_listener.snapshot()
+
+
+def async_snapshot():
+    """Return the pool metrics of this worker process's Motor clients."""
+    return async_pool_listener.snapshot()
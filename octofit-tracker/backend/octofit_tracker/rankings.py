@@ -0,0 +1,231 @@
+"""
+In-process individual leaderboard.
+
+Each worker keeps, per window (today, this week, this month and all
+time, in UTC), every athlete's calories in a score map plus a list of
+(-score, email) pairs kept sorted with `bisect`. Top-N is a slice of that
+list and an athlete's rank a binary search, so neither touches MongoDB.
+
+The index is built from the daily rollups on first use and then follows
+the rollup deltas of every activity write made by this process. It is
+reloaded from the rollups when a window rolls over (a new day, week or
+month) and every ``TTL`` seconds, which bounds how long the writes of
+other processes can be missing.
+
+Only the first build blocks readers. Later reloads run in a background
+thread while readers keep getting the previous indexes, each with the
+window start it covers, until the new ones are swapped in. Reloads read
+MongoDB outside the lock, one at a time. A delta that arrives while a
+reload reads may or may not be in what it read, so it is dropped with
+the old indexes rather than risk counting it twice; the next reload
+brings it in. Each reload takes a new generation, and `reset` takes one
+too, so a reload overtaken by a reset is discarded.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import DailyRollup
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = ('day', 'week', 'month', 'all')
+
+DEFAULTS = {
+    # Seconds before the indexes are reloaded from the rollups; None never.
+    'TTL': 300,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_RANKINGS', {})}
+
+
+def utc_today():
+    """Return midnight UTC of today as a naive datetime, like the rollup days."""
+    now = timezone.now().astimezone(dt_timezone.utc)
+    return datetime(now.year, now.month, now.day)
+
+
+def window_start(window, today):
+    """Return the first day (naive UTC midnight) `window` covers on `today`, None for all time."""
+    if window == 'day':
+        return today
+    if window == 'week':
+        return today - timedelta(days=today.weekday())
+    if window == 'month':
+        return today.replace(day=1)
+    return None
+
+
+class RankingIndex:
+    """
+    Athletes of one window ordered by score.
+    """
+
+    def __init__(self, scores=None):
+        self.scores = {email: score for email, score in (scores or {}).items() if score > 0}
+        self.order = sorted((-score, email) for email, score in self.scores.items())
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self, email, delta):
+        old = self.scores.get(email)
+        if old is not None:
+            del self.order[bisect_left(self.order, (-old, email))]
+        score = (old or 0) + delta
+        if score > 0:
+            self.scores[email] = score
+            insort(self.order, (-score, email))
+        else:
+            self.scores.pop(email, None)
+
+    def rank_of_score(self, score):
+        # Athletes with equal scores share a rank: one plus the number of
+        # athletes with a strictly higher score.
+        return bisect_left(self.order, (-score,)) + 1
+
+    def top(self, limit):
+        """Return [(rank, email, score)] for the `limit` best athletes."""
+        rows = []
+        for position, (negative, email) in enumerate(self.order[:limit]):
+            if rows and rows[-1][2] == -negative:
+                rank = rows[-1][0]
+            else:
+                rank = position + 1
+            rows.append((rank, email, -negative))
+        return rows
+
+    def rank(self, email):
+        """Return (rank, score) of `email`, or (None, 0) if it has no score."""
+        score = self.scores.get(email)
+        if score is None:
+            return None, 0
+        return self.rank_of_score(score), score
+
+
+def load_scores(start):
+    """Return {user_email: calories} summed from the rollups from day `start` on."""
+    pipeline = [{'$group': {'_id': '$user_email', 'score': {'$sum': '$total_calories'}}}]
+    if start is not None:
+        pipeline.insert(0, {'$match': {'day': {'$gte': start}}})
+    return {row['_id']: row['score'] for row in DailyRollup.objects.mongo_aggregate(pipeline)}
+
+
+class Rankings:
+    """
+    The windowed indexes of this process, built lazily and thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Serializes reloads, which read MongoDB without holding `_lock`.
+        self._reload_lock = threading.Lock()
+        self._indexes = None
+        self._starts = {}
+        self._loaded_at = None
+        self._generation = 0
+        self._refresher = None
+
+    def _stale_windows(self, today):
+        # Callers hold the lock.
+        ttl = get_config()['TTL']
+        if self._indexes is None or (ttl and time.monotonic() - self._loaded_at >= ttl):
+            return list(WINDOWS)
+        return [window for window in WINDOWS if self._starts[window] != window_start(window, today)]
+
+    def _reload(self, today):
+        with self._reload_lock:
+            with self._lock:
+                windows = self._stale_windows(today)
+                if not windows:
+                    # Reloaded by another thread while this one waited.
+                    return
+                self._generation += 1
+                generation = self._generation
+            starts = {window: window_start(window, today) for window in windows}
+            indexes = {window: RankingIndex(load_scores(start)) for window, start in starts.items()}
+            with self._lock:
+                if self._generation != generation:
+                    # reset() ran during the load.
+                    return
+                if self._indexes is None or len(windows) == len(WINDOWS):
+                    self._indexes = {}
+                    self._loaded_at = time.monotonic()
+                self._indexes.update(indexes)
+                self._starts.update(starts)
+
+    def _refresh(self, today):
+        # Callers hold the lock.
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._refresher = threading.Thread(
+            target=self._background_reload, args=(today,), name='octofit-rankings', daemon=True
+        )
+        self._refresher.start()
+
+    def _background_reload(self, today):
+        try:
+            self._reload(today)
+        except Exception:
+            # The previous indexes are still served; the next read retries.
+            logger.exception('Reloading the rankings failed')
+
+    def _read(self, window, read):
+        """
+        Return `read(index, start)` for `window` under the lock. Stale windows
+        are reloaded in the background, except on first use.
+        """
+        while True:
+            today = utc_today()
+            with self._lock:
+                if self._indexes is not None:
+                    if self._stale_windows(today):
+                        self._refresh(today)
+                    return read(self._indexes[window], self._starts[window])
+            self._reload(today)
+
+    def join(self, timeout=None):
+        """Wait for a background reload in progress, if any."""
+        refresher = self._refresher
+        if refresher is not None:
+            refresher.join(timeout)
+
+    def top(self, window, limit):
+        """Return ([(rank, email, score)], number of athletes, window start)."""
+        return self._read(window, lambda index, start: (index.top(limit), len(index), start))
+
+    def rank(self, window, email):
+        """Return (rank, score, number of athletes, window start) for `email`."""
+        return self._read(window, lambda index, start: (*index.rank(email), len(index), start))
+
+    def apply_deltas(self, deltas):
+        """Fold rollup deltas {(user_email, day): [activities, calories, duration]} into built windows."""
+        with self._lock:
+            if self._indexes is None:
+                # Not built yet; the first read loads the rollups these deltas were written to.
+                return
+            for (email, day), (_, calories, _) in deltas.items():
+                if not calories:
+                    continue
+                for window, index in self._indexes.items():
+                    start = self._starts[window]
+                    if start is None or day >= start:
+                        index.add(email, calories)
+
+    def reset(self):
+        """Drop the indexes; the next read rebuilds them from MongoDB."""
+        with self._lock:
+            self._generation += 1
+            self._indexes = None
+            self._starts = {}
+            self._loaded_at = None
+
+
+rankings = Rankings()
@@ -0,0 +1,284 @@
+"""
+Personalized workout recommendations.
+
+An athlete's profile holds, per activity type, how many activities they
+logged and their minutes and calories. Its feature vector is the type mix
+(share of activities per type), the average duration and the calories
+burned per minute. Every workout of the catalog is scored against it at
+once with NumPy: the user's share of the workout's type, plus how close
+the workout's duration and intensity are to the athlete's averages.
+
+The catalog arrays are built from MongoDB on first use and rebuilt after
+a workout write. Profiles are loaded with one aggregation over the
+athlete's activities, kept in a bounded LRU of ``MAX_PROFILES`` and then
+follow the activity writes of this process; the change feed drops those
+touched by other processes.
+"""
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .models import Activity, Workout
+from .serializers import WorkoutSerializer
+
+DEFAULTS = {
+    'MAX_PROFILES': 100000,
+}
+
+# Weights of the type mix, duration and intensity terms of a score.
+TYPE_WEIGHT = 0.6
+DURATION_WEIGHT = 0.2
+INTENSITY_WEIGHT = 0.2
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'OCTOFIT_RECOMMENDATIONS', {})}
+
+
+def closeness(values, target):
+    """Return min/max of each value and `target`: 1 when equal, towards 0 as they drift apart."""
+    return np.minimum(values, target) / np.maximum(values, target)
+
+
+class WorkoutCatalog:
+    """
+    Column arrays of every workout, in the order of `rows`.
+    """
+
+    def __init__(self, documents):
+        documents = list(documents)
+        self.rows = list(WorkoutSerializer.represent_rows(documents))
+        self.types = sorted({document['activity_type'] for document in documents})
+        self.type_positions = {name: position for position, name in enumerate(self.types)}
+        self.type_index = np.array(
+            [self.type_positions[document['activity_type']] for document in documents], dtype=np.intp
+        )
+        self.activity_types = np.array([document['activity_type'] for document in documents], dtype=object)
+        self.difficulties = np.array([document['difficulty'] for document in documents], dtype=object)
+        self.durations = np.array([max(document['duration'], 1) for document in documents], dtype=float)
+        calories = np.array([document['calories_estimate'] for document in documents], dtype=float)
+        self.intensities = np.maximum(calories / self.durations, 0.1)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def scores(self, mix, duration, intensity):
+        """Return the score of every workout for a feature vector."""
+        if not len(self):
+            return np.zeros(0)
+        return (
+            TYPE_WEIGHT * mix[self.type_index]
+            + DURATION_WEIGHT * closeness(self.durations, duration)
+            + INTENSITY_WEIGHT * closeness(self.intensities, intensity)
+        )
+
+    def default_vector(self):
+        """Feature vector for athletes without activities: no type preference, median workout."""
+        if not len(self):
+            return np.zeros(0), 1.0, 1.0
+        return np.zeros(len(self.types)), float(np.median(self.durations)), float(np.median(self.intensities))
+
+
+class Profile:
+    """
+    Per-type activity totals of one athlete and its memoized feature vector.
+
+    Cached profiles change under `Recommender._lock`, which their readers
+    hold too.
+    """
+
+    def __init__(self, totals=None):
+        # {activity_type: [activities, duration, calories]}
+        self.totals = totals or {}
+        self._vector = None
+
+    def add(self, activity_type, duration, calories, sign=1):
+        total = self.totals.setdefault(activity_type, [0, 0, 0])
+        total[0] += sign
+        total[1] += sign * duration
+        total[2] += sign * calories
+        if total[0] <= 0:
+            del self.totals[activity_type]
+        self._vector = None
+
+    def vector(self, catalog):
+        """Return (type mix, average duration, calories per minute) over `catalog`'s types, or None."""
+        if self._vector is not None and self._vector[0] is catalog:
+            return self._vector[1]
+        activities = sum(total[0] for total in self.totals.values())
+        if activities <= 0:
+            return None
+        minutes = sum(total[1] for total in self.totals.values())
+        calories = sum(total[2] for total in self.totals.values())
+        mix = np.zeros(len(catalog.types))
+        for activity_type, (count, _, _) in self.totals.items():
+            position = catalog.type_positions.get(activity_type)
+            if position is not None:
+                mix[position] = count / activities
+        vector = (mix, max(minutes / activities, 1.0), max(calories / max(minutes, 1), 0.1))
+        self._vector = (catalog, vector)
+        return vector
+
+
+def load_profile(user_email):
+    pipeline = [
+        {'$match': {'user_email': user_email}},
+        {'$group': {
+            '_id': '$activity_type',
+            'activities': {'$sum': 1},
+            'duration': {'$sum': '$duration'},
+            'calories': {'$sum': '$calories_burned'},
+        }},
+    ]
+    return Profile({
+        row['_id']: [row['activities'], row['duration'], row['calories']]
+        for row in Activity.objects.mongo_aggregate(pipeline)
+    })
+
+
+def add_activity(changes, activity, sign=1):
+    """Accumulate an activity (model instance or document) into {user_email: [(type, duration, calories, sign)]}."""
+    get = activity.get if isinstance(activity, dict) else lambda name: getattr(activity, name)
+    changes.setdefault(get('user_email'), []).append(
+        (get('activity_type'), get('duration'), get('calories_burned'), sign)
+    )
+    return changes
+
+
+class Recommender:
+    """
+    The process's workout catalog and athlete profiles, thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._profiles = OrderedDict()
+        # {user_email: token of the latest load}; a write during the load
+        # removes the entry, so only a load that saw every write is kept.
+        self._loading = {}
+        self._tokens = itertools.count()
+
+    def catalog(self):
+        with self._lock:
+            catalog = self._catalog
+        if catalog is None:
+            catalog = WorkoutCatalog(Workout.objects.mongo_find({}))
+            with self._lock:
+                if self._catalog is None:
+                    self._catalog = catalog
+        return catalog
+
+    def profile(self, user_email):
+        with self._lock:
+            profile = self._profiles.get(user_email)
+            if profile is not None:
+                self._profiles.move_to_end(user_email)
+                return profile
+            token = next(self._tokens)
+            self._loading[user_email] = token
+        try:
+            profile = load_profile(user_email)
+        except BaseException:
+            with self._lock:
+                if self._loading.get(user_email) == token:
+                    del self._loading[user_email]
+            raise
+        with self._lock:
+            # A write during the load may or may not be in the result, and a
+            # later load of the same athlete is at least as recent; either
+            # way this profile serves the request but is not kept.
+            if self._loading.get(user_email) == token:
+                del self._loading[user_email]
+                self._profiles[user_email] = profile
+                while len(self._profiles) > get_config()['MAX_PROFILES']:
+                    self._profiles.popitem(last=False)
+        return profile
+
+    def vector(self, user_email, catalog):
+        """Return the athlete's feature vector over `catalog`, or None without a history."""
+        profile = self.profile(user_email)
+        with self._lock:
+            return profile.vector(catalog)
+
+    def recommend(self, user_email, limit, activity_type=None, difficulty=None):
+        """Return ([(score, workout row)] best first, whether the athlete has a history)."""
+        catalog = self.catalog()
+        vector = self.vector(user_email, catalog)
+        scores = catalog.scores(*(vector or catalog.default_vector()))
+        if activity_type is not None:
+            scores[catalog.activity_types != activity_type] = -np.inf
+        if difficulty is not None:
+            scores[catalog.difficulties != difficulty] = -np.inf
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return [], vector is not None
+        if limit < len(scores):
+            best = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [
+            (float(scores[position]), catalog.rows[position])
+            for position in best if np.isfinite(scores[position])
+        ], vector is not None
+
+    def apply_changes(self, changes):
+        """Fold {user_email: [(type, duration, calories, sign)]} into cached profiles."""
+        with self._lock:
+            for user_email, activities in changes.items():
+                self._loading.pop(user_email, None)
+                profile = self._profiles.get(user_email)
+                if profile is None:
+                    continue
+                for activity_type, duration, calories, sign in activities:
+                    profile.add(activity_type, duration, calories, sign)
+
+    def drop_profiles(self, user_emails=None):
+        """Forget the profiles of `user_emails` (all when None); they reload on next use."""
+        with self._lock:
+            if user_emails is None:
+                self._profiles.clear()
+                self._loading.clear()
+                return
+            for user_email in user_emails:
+                self._profiles.pop(user_email, None)
+                self._loading.pop(user_email, None)
+
+    def invalidate_catalog(self):
+        with self._lock:
+            self._catalog = None
+
+    def reset(self):
+        with self._lock:
+            self._catalog = None
+            self._profiles.clear()
+
+
+recommender = Recommender()
+
+
+def record_activity_created(activity):
+    recommender.apply_changes(add_activity({}, activity))
+
+
+def record_activity_deleted(activity):
+    recommender.apply_changes(add_activity({}, activity, sign=-1))
+
+
+def record_activity_updated(before, after):
+    recommender.apply_changes(add_activity(add_activity({}, before, sign=-1), after))
+
+
+def record_activity_documents(documents):
+    changes = {}
+    for document in documents:
+        add_activity(changes, document)
+    recommender.apply_changes(changes)
+
+
+def record_workouts_changed():
+    recommender.invalidate_catalog()
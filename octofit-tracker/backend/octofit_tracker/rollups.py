@@ -0,0 +1,165 @@
+"""
+Per-user daily activity rollups.
+
+One `daily_rollups` document per (user_email, day) holds that day's
+totals. Activity writes adjust it with atomic `$inc` upserts, so per-user
+charts read one small document per day instead of the raw activities.
+The same deltas keep this process's individual rankings current. Those
+of updates and deletes are also published to `activity_deltas` while the
+change feed runs, so that the other processes apply them to their
+rankings: the change events of updates and deletes do not say what the
+activity was before.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from bson import ObjectId
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from . import changes
+from .models import DailyRollup
+from .rankings import rankings
+
+DELTAS = 'activity_deltas'
+# Seconds published deltas are kept, far longer than a change feed lags.
+DELTAS_TTL = 3600
+
+_deltas_indexed = False
+
+
+def day_of(value):
+    """Return midnight UTC (as a naive datetime, like stored dates) of `value`."""
+    if timezone.is_aware(value):
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return datetime(value.year, value.month, value.day)
+
+
+def add_activity(deltas, activity, sign=1):
+    """Accumulate an activity (model instance or document) into `deltas`."""
+    get = activity.get if isinstance(activity, dict) else lambda name: getattr(activity, name)
+    total = deltas.setdefault((get('user_email'), day_of(get('date'))), [0, 0, 0])
+    total[0] += sign
+    total[1] += sign * get('calories_burned')
+    total[2] += sign * get('duration')
+    return deltas
+
+
+def apply_deltas(deltas):
+    """
+    Apply {(user_email, day): [activities, calories, duration]} deltas in one
+    unordered batch, then remove the touched days that no longer hold any
+    activity.
+    """
+    now = timezone.now()
+    updates = [
+        UpdateOne(
+            {'user_email': user_email, 'day': day},
+            {
+                '$inc': {
+                    'total_activities': activities,
+                    'total_calories': calories,
+                    'total_duration': duration,
+                },
+                '$set': {'updated_at': now},
+            },
+            upsert=True,
+        )
+        for (user_email, day), (activities, calories, duration) in deltas.items()
+        if activities or calories or duration
+    ]
+    if not updates:
+        return
+    DailyRollup.objects.mongo_bulk_write(updates, ordered=False)
+    shrunk = [
+        {'user_email': user_email, 'day': day}
+        for (user_email, day), (activities, _, _) in deltas.items()
+        if activities < 0
+    ]
+    if shrunk:
+        DailyRollup.objects.mongo_delete_many({'$or': shrunk, 'total_activities': {'$lte': 0}})
+    rankings.apply_deltas(deltas)
+
+
+def publish_deltas(deltas):
+    """
+    Record `deltas` in `activity_deltas`, where the other processes' change
+    feeds find them, if the change feed runs.
+
+    Deltas that cancel out are published too: the athletes' recommendation
+    profiles still changed.
+    """
+    global _deltas_indexed
+    if not changes.enabled():
+        return
+    collection = DailyRollup.objects.mongo_database[DELTAS]
+    if not _deltas_indexed:
+        collection.create_index('created_at', expireAfterSeconds=DELTAS_TTL)
+        _deltas_indexed = True
+    object_id = ObjectId()
+    changes.mark_local(DELTAS, [object_id])
+    collection.insert_one({
+        '_id': object_id,
+        'created_at': timezone.now(),
+        'deltas': [
+            {'user_email': user_email, 'day': day, 'activities': activities, 'calories': calories, 'duration': duration}
+            for (user_email, day), (activities, calories, duration) in deltas.items()
+        ],
+    })
+
+
+def read_deltas(document):
+    """Return the deltas an `activity_deltas` document holds."""
+    return {
+        (row['user_email'], row['day']): [row['activities'], row['calories'], row['duration']]
+        for row in document['deltas']
+    }
+
+
+def record_activity_created(activity):
+    apply_deltas(add_activity({}, activity))
+
+
+def record_activity_deleted(activity):
+    deltas = add_activity({}, activity, sign=-1)
+    apply_deltas(deltas)
+    publish_deltas(deltas)
+
+
+def record_activity_updated(before, after):
+    deltas = add_activity(add_activity({}, before, sign=-1), after)
+    apply_deltas(deltas)
+    publish_deltas(deltas)
+
+
+def record_activity_documents(documents):
+    """Fold a batch of inserted activity documents into their rollups."""
+    deltas = {}
+    for doc in documents:
+        add_activity(deltas, doc)
+    apply_deltas(deltas)
+
+
+def rollup_pipeline(date_from, date_to, user_emails=None):
+    """
+    Aggregation building the rollup documents for activities in
+    [date_from, date_to), of `user_emails` only when given.
+    """
+    match = {'date': {'$gte': date_from, '$lt': date_to}}
+    if user_emails is not None:
+        match['user_email'] = {'$in': list(user_emails)}
+    return [
+        {'$match': match},
+        {'$group': {
+            '_id': {
+                'user_email': '$user_email',
+                'day': {'$dateFromParts': {
+                    'year': {'$year': '$date'},
+                    'month': {'$month': '$date'},
+                    'day': {'$dayOfMonth': '$date'},
+                }},
+            },
+            'total_activities': {'$sum': 1},
+            'total_calories': {'$sum': '$calories_burned'},
+            'total_duration': {'$sum': '$duration'},
+        }},
+    ]
@@ -0,0 +1,266 @@
+"""
+Full-text search over the workout catalog and activity notes.
+
+Workouts are searched in process. An inverted index maps each term to
+the workouts containing it, with a sorted vocabulary for prefix matching
+("cardi" finds "cardio"), and results are ranked with BM25; a workout's
+name weighs three times its description and instructions. The index is
+built from MongoDB on first use and kept current by the workout write
+paths of this process and the change feed.
+
+Activity notes grow with every logged activity, so they stay in MongoDB
+and are searched through the text index `Activity.text_index` declares
+(created by ``manage.py sync_indexes``), ranked by MongoDB's text score.
+MongoDB matches stemmed words, not prefixes. A time-series `activities`
+collection cannot have a text index; without one, the newest notes
+containing a term are scanned instead and ranked by how many terms they
+contain. The scores are not on one scale: workouts come first, then
+activities.
+"""
+import heapq
+import logging
+import math
+import re
+import threading
+from bisect import bisect_left, insort
+
+from pymongo.errors import OperationFailure
+
+from .models import Activity, Workout
+from .mongo import list_read_collection
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    'a an and are as at be by for from in into is it of on or the to with your you'.split()
+)
+
+# Shortest prefix expanded to longer terms, and how many terms it may expand to.
+MIN_PREFIX = 2
+MAX_EXPANSIONS = 64
+# Score factor of a prefix match against an exact match.
+PREFIX_BOOST = 0.7
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+WORKOUT_FIELDS = (('name', 3), ('description', 1), ('instructions', 1))
+
+# Server error code of a $text query without a text index.
+INDEX_NOT_FOUND = 27
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.casefold()) if token not in STOPWORDS]
+
+
+class InvertedIndex:
+    """
+    Weighted term postings with BM25 ranking and prefix expansion.
+
+    Documents are keyed by any hashable and carry a metadata dict used to
+    filter results.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.vocabulary = []
+        self.documents = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, key, fields, meta):
+        """Index `key` from [(text, weight)] `fields`, replacing an earlier version."""
+        self.remove(key)
+        frequencies = {}
+        for text, weight in fields:
+            for token in tokenize(text or ''):
+                frequencies[token] = frequencies.get(token, 0) + weight
+        if not frequencies:
+            return
+        for term, frequency in frequencies.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                insort(self.vocabulary, term)
+            posting[key] = frequency
+        length = sum(frequencies.values())
+        self.documents[key] = (length, list(frequencies), meta)
+        self.total_length += length
+
+    def remove(self, key):
+        entry = self.documents.pop(key, None)
+        if entry is None:
+            return
+        length, terms, _ = entry
+        self.total_length -= length
+        for term in terms:
+            posting = self.postings[term]
+            del posting[key]
+            if not posting:
+                del self.postings[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+
+    def expand(self, token):
+        """Return [(term, boost)] matching `token` exactly or as a prefix."""
+        terms = [(token, 1.0)] if token in self.postings else []
+        if len(token) >= MIN_PREFIX:
+            position = bisect_left(self.vocabulary, token)
+            for term in self.vocabulary[position:position + MAX_EXPANSIONS + 1]:
+                if not term.startswith(token):
+                    break
+                if term != token:
+                    terms.append((term, PREFIX_BOOST))
+        return terms
+
+    def search(self, query, limit, predicate=None):
+        """Return the `limit` best [(score, key)] for `query`, optionally filtered on metadata."""
+        if not self.documents:
+            return []
+        count = len(self.documents)
+        average_length = self.total_length / count
+        scores = {}
+        for token in set(tokenize(query)):
+            best = {}
+            for term, boost in self.expand(token):
+                posting = self.postings[term]
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for key, frequency in posting.items():
+                    length = self.documents[key][0]
+                    score = boost * idf * frequency * (BM25_K1 + 1) / (
+                        frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    )
+                    if score > best.get(key, 0):
+                        best[key] = score
+            for key, score in best.items():
+                scores[key] = scores.get(key, 0) + score
+        if predicate is not None:
+            scores = {key: score for key, score in scores.items() if predicate(self.documents[key][2])}
+        return heapq.nlargest(limit, ((score, key) for key, score in scores.items()), key=lambda item: item[0])
+
+
+def workout_entry(workout):
+    """Return (fields, meta) for a workout instance or document."""
+    get = workout.get if isinstance(workout, dict) else lambda name: getattr(workout, name)
+    fields = [(get(name), weight) for name, weight in WORKOUT_FIELDS]
+    return fields, {'activity_type': get('activity_type'), 'difficulty': get('difficulty')}
+
+
+def build_workout_index():
+    index = InvertedIndex()
+    projection = {name: 1 for name, _ in WORKOUT_FIELDS}
+    projection.update(activity_type=1, difficulty=1)
+    for document in Workout.objects.mongo_find({}, projection):
+        index.add(document['_id'], *workout_entry(document))
+    return index
+
+
+def search_notes(query, limit, activity_type=None):
+    """
+    Return the `limit` best [(score, _id)] activities by their notes'
+    MongoDB text score, or from `scan_notes` without a text index.
+    """
+    terms = tokenize(query)
+    if not terms or limit <= 0:
+        return []
+    # Plain terms only: quotes and '-' would be phrase and negation operators.
+    match = {'$text': {'$search': ' '.join(terms)}}
+    if activity_type is not None:
+        match['activity_type'] = activity_type
+    score = {'$meta': 'textScore'}
+    try:
+        cursor = list_read_collection(Activity).find(match, {'score': score}).sort([('score', score)]).limit(limit)
+        return [(document['score'], document['_id']) for document in cursor]
+    except OperationFailure as exc:
+        if exc.code != INDEX_NOT_FOUND:
+            raise
+    logger.info('Activity notes have no text index; scanning them')
+    return scan_notes(terms, limit, activity_type)
+
+
+def scan_notes(terms, limit, activity_type=None):
+    """Return up to `limit` [(terms found, _id)] of the newest activities whose notes contain one of `terms`."""
+    match = {'notes': {'$regex': '|'.join(re.escape(term) for term in terms), '$options': 'i'}}
+    if activity_type is not None:
+        match['activity_type'] = activity_type
+    cursor = list_read_collection(Activity).find(match, {'notes': 1}).sort('date', -1).limit(limit)
+    matches = []
+    for document in cursor:
+        notes = (document.get('notes') or '').casefold()
+        matches.append((sum(term in notes for term in terms), document['_id']))
+    # Stable, so equally scored activities stay newest first.
+    matches.sort(key=lambda match: -match[0])
+    return matches
+
+
+class CatalogSearch:
+    """
+    The process's workout index, built lazily and thread-safe, and the
+    activity notes search.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        # Bumped by writes and resets while the index is not built, so a
+        # build that may have missed them is not kept.
+        self._generation = 0
+
+    def search_workouts(self, query, limit, predicate=None):
+        """Return the `limit` best [(score, _id)] workouts for `query`."""
+        with self._lock:
+            if self._index is not None:
+                return self._index.search(query, limit, predicate)
+            generation = self._generation
+        index = build_workout_index()
+        with self._lock:
+            if self._index is None and self._generation == generation:
+                self._index = index
+            return index.search(query, limit, predicate)
+
+    def search(self, query, limit, kind=None, activity_type=None, difficulty=None):
+        """Return [(score, kind, _id)] for the best matches of `query`, workouts first."""
+        def predicate(meta):
+            return (
+                (activity_type is None or meta['activity_type'] == activity_type)
+                and (difficulty is None or meta['difficulty'] == difficulty)
+            )
+
+        matches = []
+        if kind in (None, 'workout'):
+            matches += [(score, 'workout', object_id) for score, object_id in self.search_workouts(query, limit, predicate)]
+        # Activities have no difficulty.
+        if kind in (None, 'activity') and difficulty is None:
+            notes = search_notes(query, limit - len(matches), activity_type)
+            matches += [(score, 'activity', object_id) for score, object_id in notes]
+        return matches
+
+    def update(self, entries=(), removed=()):
+        """Index [(_id, (fields, meta))] workout `entries` and drop `removed` ids."""
+        with self._lock:
+            if self._index is None:
+                self._generation += 1
+                return
+            for object_id in removed:
+                self._index.remove(object_id)
+            for object_id, (fields, meta) in entries:
+                self._index.add(object_id, fields, meta)
+
+    def reset(self):
+        with self._lock:
+            self._index = None
+            self._generation += 1
+
+
+catalog = CatalogSearch()
+
+
+def record_workout_saved(workout):
+    catalog.update([(workout._id, workout_entry(workout))])
+
+
+def record_workout_deleted(object_id):
+    catalog.update(removed=[object_id])
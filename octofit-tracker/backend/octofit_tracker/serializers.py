@@ -1,9 +1,85 @@
-from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .models import User, Team, Activity, Leaderboard, Workout, DailyRollup
 from bson import ObjectId
 
-
-class UserSerializer(serializers.ModelSerializer):
+# Field types whose representation of a stored value is the value itself.
+PASSTHROUGH_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+
+def datetime_converter(field):
+    """
+    Return a converter matching `field.to_representation` for ISO 8601
+    output in a fixed timezone, resolving the field settings only once.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        if isinstance(value, str):
+            return value
+        if timezone.is_aware(value):
+            value = value.astimezone(field_timezone)
+        else:
+            value = timezone.make_aware(value, field_timezone)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return convert
+
+
+class FastRepresentationMixin:
+    """
+    Read-only fast path for list endpoints.
+
+    Converts plain `.values()` rows straight to response dicts, producing
+    the same output as `to_representation` without instantiating models or
+    walking DRF's per-field attribute machinery for every row.
+    """
+
+    @classmethod
+    def fast_fields(cls):
+        return list(cls.Meta.fields)
+
+    @classmethod
+    def fast_converters(cls):
+        """Return (name, converter) pairs, with None for passthrough fields."""
+        converters = cls.__dict__.get('_fast_converters')
+        if converters is None:
+            converters = []
+            for name, field in cls().fields.items():
+                if name == '_id':
+                    converters.append((name, str))
+                elif isinstance(field, PASSTHROUGH_FIELDS):
+                    converters.append((name, None))
+                elif isinstance(field, serializers.DateTimeField):
+                    converters.append((name, datetime_converter(field)))
+                else:
+                    converters.append((name, field.to_representation))
+            cls._fast_converters = converters
+        return converters
+
+    @classmethod
+    def represent_rows(cls, rows, fields=None):
+        """
+        Yield the representation of each `.values()` row or raw document,
+        limited to `fields` when given.
+        """
+        converters = cls.fast_converters()
+        if fields is not None:
+            converters = [(name, convert) for name, convert in converters if name in fields]
+        for row in rows:
+            representation = {}
+            for name, convert in converters:
+                value = row.get(name)
+                representation[name] = value if convert is None or value is None else convert(value)
+            yield representation
+
+
+class UserSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     _id = serializers.SerializerMethodField()
 
     class Meta:
@@ -14,7 +90,7 @@ class UserSerializer(serializers.ModelSerializer):
         return str(obj._id)
 
 
-class TeamSerializer(serializers.ModelSerializer):
+class TeamSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     _id = serializers.SerializerMethodField()
 
     class Meta:
@@ -25,18 +101,42 @@ class TeamSerializer(serializers.ModelSerializer):
         return str(obj._id)
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivityListSerializer(serializers.ListSerializer):
+    """
+    Validates a batch of activities item by item, so one invalid item does
+    not reject the rest of the batch.
+    """
+
+    def validate_items(self):
+        """Return a list of (validated_data, errors) pairs, one per item."""
+        if not isinstance(self.initial_data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of activities.']})
+        if self.max_length is not None and len(self.initial_data) > self.max_length:
+            raise serializers.ValidationError(
+                {'non_field_errors': [f'Ensure this batch has no more than {self.max_length} activities.']}
+            )
+        results = []
+        for item in self.initial_data:
+            try:
+                results.append((self.child.run_validation(item), None))
+            except serializers.ValidationError as exc:
+                results.append((None, exc.detail))
+        return results
+
+
+class ActivitySerializer(FastRepresentationMixin, serializers.ModelSerializer):
     _id = serializers.SerializerMethodField()
 
     class Meta:
         model = Activity
         fields = ['_id', 'user_email', 'activity_type', 'duration', 'calories_burned', 'date', 'notes']
+        list_serializer_class = ActivityListSerializer
 
     def get__id(self, obj):
         return str(obj._id)
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     _id = serializers.SerializerMethodField()
 
     class Meta:
@@ -47,7 +147,7 @@ class LeaderboardSerializer(serializers.ModelSerializer):
         return str(obj._id)
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     _id = serializers.SerializerMethodField()
 
     class Meta:
@@ -56,3 +156,14 @@ class WorkoutSerializer(serializers.ModelSerializer):
 
     def get__id(self, obj):
         return str(obj._id)
+
+
+class DailyRollupSerializer(FastRepresentationMixin, serializers.ModelSerializer):
+    _id = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DailyRollup
+        fields = ['_id', 'user_email', 'day', 'total_activities', 'total_calories', 'total_duration', 'updated_at']
+
+    def get__id(self, obj):
+        return str(obj._id)
@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 import os
 from pathlib import Path
 
+from octofit_tracker.command_metrics import command_listener
+from octofit_tracker.pool_metrics import async_pool_listener, pool_listener
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -62,6 +66,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Opt-in request instrumentation: Server-Timing headers, Prometheus metrics
+# at /metrics and cProfile dumps of a sample of the slow requests.
+OCTOFIT_INSTRUMENTATION = {
+    'ENABLED': os.environ.get('OCTOFIT_INSTRUMENTATION', 'false').lower() == 'true',
+    'PROFILE_THRESHOLD_MS': float(os.environ.get('OCTOFIT_PROFILE_THRESHOLD_MS', 0)) or None,
+    'PROFILE_SAMPLE_RATE': float(os.environ.get('OCTOFIT_PROFILE_SAMPLE_RATE', 0.1)),
+    'PROFILE_DIR': os.environ.get('OCTOFIT_PROFILE_DIR', str(BASE_DIR / 'profiles')),
+}
+
 ROOT_URLCONF = 'octofit_tracker.urls'
 
 TEMPLATES = [
@@ -86,18 +99,125 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# MongoDB client options; pool sizes, timeouts and write concern can be
+# tuned per deployment through the environment.
+MONGO_WRITE_CONCERN = os.environ.get('MONGO_WRITE_CONCERN', '1')
+MONGO_CLIENT = {
+    'host': 'localhost',
+    'port': 27017,
+    'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+    'waitQueueTimeoutMS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+    'serverSelectionTimeoutMS': int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'w': int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN,
+    'journal': os.environ.get('MONGO_JOURNAL', 'false').lower() == 'true',
+    'event_listeners': [pool_listener, command_listener],
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
-        'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
-        }
+        'CLIENT': MONGO_CLIENT,
     }
 }
 
+# Read preference for list and reporting reads issued directly through
+# pymongo (see octofit_tracker/mongo.py); everything else reads the primary.
+MONGO_LIST_READ_PREFERENCE = os.environ.get('MONGO_LIST_READ_PREFERENCE', 'secondaryPreferred')
+
+# Time-series layout applied by `manage.py convert_activities_timeseries`.
+ACTIVITIES_TIMESERIES = {
+    'timeField': 'date',
+    'metaField': 'user_email',
+    'granularity': 'hours',
+}
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 50,
+    'DEFAULT_FILTER_BACKENDS': [
+        'octofit_tracker.filters.FieldFilterBackend',
+        'rest_framework.filters.OrderingFilter',
+    ],
+}
+
+# Response cache for the teams, leaderboard and workouts endpoints.
+# BACKEND is 'lru' (in-process) or 'django' (the CACHES entry named ALIAS).
+OCTOFIT_RESPONSE_CACHE = {
+    'BACKEND': os.environ.get('OCTOFIT_RESPONSE_CACHE_BACKEND', 'lru'),
+    'ALIAS': 'default',
+    'TIMEOUT': 60,
+    'MAX_ENTRIES': 1024,
+    # Seconds detail lookups of teams, workouts and leaderboard rows are cached (0 disables).
+    'OBJECT_TIMEOUT': int(os.environ.get('OCTOFIT_OBJECT_CACHE_TIMEOUT', 5)),
+}
+
+
+# Write-behind activity ingestion: POST /api/activities/ answers 202 and a
+# background thread writes the spooled activities in insert_many batches.
+OCTOFIT_INGEST = {
+    'ENABLED': os.environ.get('OCTOFIT_INGEST', 'false').lower() == 'true',
+    'SPOOL_DIR': os.environ.get('OCTOFIT_INGEST_SPOOL_DIR', str(BASE_DIR / 'spool')),
+    'MAX_QUEUE': int(os.environ.get('OCTOFIT_INGEST_MAX_QUEUE', 10000)),
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL': 0.2,
+}
+
+
+# Individual leaderboard kept in memory per worker process; TTL is how many
+# seconds it goes before reloading from the daily rollups.
+OCTOFIT_RANKINGS = {
+    'TTL': float(os.environ.get('OCTOFIT_RANKINGS_TTL', 300)) or None,
+}
+
+
+# Workout recommendations: athlete profiles kept in memory per worker process.
+OCTOFIT_RECOMMENDATIONS = {
+    'MAX_PROFILES': int(os.environ.get('OCTOFIT_RECOMMENDATION_PROFILES', 100000)),
+}
+
+
+# Team members kept in memory per worker process for the activities' team
+# filters; TTL is how many seconds they go before reloading from users.
+OCTOFIT_IDENTITY = {
+    'TTL': float(os.environ.get('OCTOFIT_IDENTITY_TTL', 60)) or None,
+}
+
+
+# Change feed bringing other worker processes' writes into this process's
+# caches and derived data (see octofit_tracker/changes.py). Started by the
+# WSGI/ASGI entry points; MODE is 'auto', 'stream' or 'poll'. ENABLED is
+# 'auto' unless OCTOFIT_CHANGES is 'true' or 'false': the feed then runs
+# whenever there is more than one worker, each with its own in-process
+# state (identity map, rankings, 'lru' response cache). WORKERS comes from WEB_CONCURRENCY, which gunicorn and uvicorn
+# read as their default worker count.
+OCTOFIT_CHANGES_ENABLED = os.environ.get('OCTOFIT_CHANGES', 'auto').lower()
+OCTOFIT_CHANGES = {
+    'ENABLED': 'auto' if OCTOFIT_CHANGES_ENABLED == 'auto' else OCTOFIT_CHANGES_ENABLED == 'true',
+    'WORKERS': int(os.environ.get('WEB_CONCURRENCY', 1)),
+    'MODE': os.environ.get('OCTOFIT_CHANGES_MODE', 'auto'),
+    'POLL': os.environ.get('OCTOFIT_CHANGES_POLL', 'true').lower() == 'true',
+    'POLL_INTERVAL': float(os.environ.get('OCTOFIT_CHANGES_POLL_INTERVAL', 5.0)),
+}
+
+
+# Async MongoDB (Motor) client for the ASGI read endpoints in async_views.py.
+# It has its own connection pool, separate from the Djongo one above, and
+# its own pool listener. It has no command listener: command metrics are
+# counted per thread, and Motor runs its operations on executor threads
+# rather than on the thread serving the request.
+ASYNC_MONGO_CLIENT = {
+    'maxPoolSize': int(os.environ.get('ASYNC_MONGO_MAX_POOL_SIZE', 100)),
+    'minPoolSize': 0,
+    'event_listeners': [async_pool_listener],
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
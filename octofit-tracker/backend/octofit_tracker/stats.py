@@ -0,0 +1,102 @@
+"""
+Activity statistics computed by MongoDB aggregation pipelines.
+
+Totals are grouped server side with `$match/$group/$sort` on the raw
+`activities` collection, so no model instances are materialized. Team
+totals are grouped per athlete and then regrouped by the athletes' teams
+from the identity map, without reading `users`.
+"""
+from .identity import identity
+from .models import Activity
+from .mongo import list_read_collection
+
+# Group key expression for each supported `group_by` value; teams are
+# regrouped from the per-athlete totals (see `activity_stats`).
+GROUP_KEYS = {
+    'user': '$user_email',
+    'team': '$user_email',
+    'activity_type': '$activity_type',
+    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$date'}},
+    'week': {'$dateToString': {'format': '%G-W%V', 'date': '$date'}},
+}
+
+# Time buckets read chronologically, everything else by calories burned.
+CHRONOLOGICAL = {'day', 'week'}
+
+
+def build_match(user_email=None, activity_type=None, date_from=None, date_to=None):
+    """Build the `$match` stage for the optional activity filters."""
+    match = {}
+    if user_email:
+        match['user_email'] = user_email
+    if activity_type:
+        match['activity_type'] = activity_type
+    if date_from or date_to:
+        match['date'] = {}
+        if date_from:
+            match['date']['$gte'] = date_from
+        if date_to:
+            match['date']['$lte'] = date_to
+    return match
+
+
+def build_pipeline(group_by, match=None, limit=None):
+    """
+    Return the aggregation pipeline grouping activities by `group_by`.
+
+    The per-athlete totals of `team` are neither sorted nor limited here:
+    that happens once they are regrouped.
+    """
+    if group_by not in GROUP_KEYS:
+        raise ValueError(f"Unsupported group_by '{group_by}'.")
+    pipeline = [
+        {'$match': match or {}},
+        {'$group': {
+            '_id': GROUP_KEYS[group_by],
+            'total_activities': {'$sum': 1},
+            'total_calories': {'$sum': '$calories_burned'},
+            'total_duration': {'$sum': '$duration'},
+        }},
+    ]
+    if group_by == 'team':
+        return pipeline
+    pipeline.append({'$sort': {'_id': 1} if group_by in CHRONOLOGICAL else {'total_calories': -1, '_id': 1}})
+    if limit:
+        pipeline.append({'$limit': limit})
+    return pipeline
+
+
+def activity_stats(group_by, limit=None, read_preference=None, **filters):
+    """
+    Aggregate activity totals grouped by `group_by` (see GROUP_KEYS).
+
+    Reads use the list read preference unless `read_preference` is given,
+    e.g. `ReadPreference.PRIMARY` right after writing the activities.
+    """
+    pipeline = build_pipeline(group_by, build_match(**filters), limit=limit)
+    rows = list_read_collection(Activity, read_preference).aggregate(pipeline, allowDiskUse=True)
+    if group_by == 'team':
+        rows = by_team(list(rows))[:limit or None]
+    return [
+        {
+            group_by: row['_id'],
+            'total_activities': row['total_activities'],
+            'total_calories': row['total_calories'],
+            'total_duration': row['total_duration'],
+        }
+        for row in rows
+    ]
+
+
+def by_team(rows):
+    """Regroup per-athlete totals by team, by calories burned; athletes without a user are left out."""
+    teams = identity.teams_of([row['_id'] for row in rows])
+    totals = {}
+    for row in rows:
+        if row['_id'] not in teams:
+            continue
+        team = teams[row['_id']]
+        total = totals.setdefault(team, {'_id': team, 'total_activities': 0, 'total_calories': 0, 'total_duration': 0})
+        for key in ('total_activities', 'total_calories', 'total_duration'):
+            total[key] += row[key]
+    return sorted(totals.values(), key=lambda total: (-total['total_calories'], total['_id'] or ''))
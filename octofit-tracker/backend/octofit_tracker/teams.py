@@ -0,0 +1,55 @@
+"""
+Maintenance of the denormalized `Team.members_count`.
+
+User writes adjust the count of the affected teams with atomic `$inc`
+updates, so `/api/teams/` never has to count the users collection.
+`reconcile_members_counts` repairs any drift in one aggregation pass.
+"""
+from pymongo import UpdateOne
+
+from .cache import invalidate
+from .models import Team, User
+
+
+def adjust_members_count(team_name, delta):
+    if not team_name or not delta:
+        return
+    Team.objects.mongo_update_one({'name': team_name}, {'$inc': {'members_count': delta}})
+    invalidate('team')
+
+
+def record_user_created(user):
+    adjust_members_count(user.team, 1)
+
+
+def record_user_deleted(user):
+    adjust_members_count(user.team, -1)
+
+
+def record_user_updated(before, after):
+    if before.team != after.team:
+        adjust_members_count(before.team, -1)
+        adjust_members_count(after.team, 1)
+
+
+def reconcile_members_counts():
+    """
+    Set every team's `members_count` to its actual number of users.
+
+    Returns {team_name: (stored, actual)} for the teams that had drifted.
+    """
+    actual = {
+        row['_id']: row['count']
+        for row in User.objects.mongo_aggregate([{'$group': {'_id': '$team', 'count': {'$sum': 1}}}])
+    }
+    drift = {}
+    updates = []
+    for team in Team.objects.mongo_find({}, {'name': 1, 'members_count': 1}):
+        count = actual.get(team['name'], 0)
+        if team.get('members_count') != count:
+            drift[team['name']] = (team.get('members_count'), count)
+            updates.append(UpdateOne({'_id': team['_id']}, {'$set': {'members_count': count}}))
+    if updates:
+        Team.objects.mongo_bulk_write(updates, ordered=False)
+        invalidate('team')
+    return drift
@@ -1,9 +1,63 @@
-from django.test import TestCase
-from django.urls import reverse
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import resolve, reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.test import APIRequestFactory
+from rest_framework.request import Request
+from .models import User, Team, Activity, Leaderboard, Workout, DailyRollup
+from .cache import LRUCache, get_response_cache
+from .exports import csv_lines
+from .filters import FieldFilterBackend
+from .views import (
+    ActivityViewSet, DailyRollupViewSet, LeaderboardViewSet, TeamViewSet, UserViewSet, WorkoutViewSet,
+    get_object_by_id,
+)
+from .native import NativeQuerySet
+from .mongo import list_read_collection
+from .rankings import RankingIndex, Rankings, rankings, utc_today, window_start
+from .ingest import DUPLICATE_KEY, IngestQueue, Spool
+from .search import InvertedIndex
+from .identity import IdentityMap, identity
+from .changes import ChangeStreamFeed, LocalWrites, PollingFeed
+from . import changes, invalidation  # noqa: F401
+from .recommendations import Profile, Recommender, WorkoutCatalog
+from . import ingest, recommendations, rollups, search
+from .pagination import KeysetCursorPagination
+from .serializers import ActivitySerializer, UserSerializer
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from django.utils import timezone
+from .stats import build_match, build_pipeline
+from .utils import batched
+from .rollups import add_activity, day_of
+from .mongo_async import motor_available
+from .pool_metrics import PoolMetricsListener
+from .command_metrics import CommandMetricsListener
+from .instrumentation import InstrumentationMiddleware, RequestMetrics, request_metrics, serializing, view_name
+from .teams import reconcile_members_counts
+from types import SimpleNamespace
+from .management.commands.sync_indexes import declared_indexes, live_indexes
+from .management.commands.populate_db import Command as PopulateCommand
+from .management.commands.rebuild_rollups import Command as RebuildRollupsCommand
+from .management.commands.convert_activities_timeseries import FENCE, Command as ConvertActivitiesCommand
+from .management.commands.benchmark_api import compare, summarize
+from datetime import datetime, timedelta, timezone as dt_timezone
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
 
 
 class UserTests(APITestCase):
@@ -25,8 +79,32 @@ class UserTests(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_user_writes_maintain_members_count(self):
+        Team.objects.create(name='Team Marvel', description='Avengers assemble!', members_count=1)
+        Team.objects.create(name='Team DC', description='Justice League!', members_count=0)
+        url = reverse('user-list')
+        data = {'name': 'Thor', 'email': 'thor.odinson@marvel.com', 'team': 'Team Marvel'}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(Team.objects.get(name='Team Marvel').members_count, 2)
+
+        detail = reverse('user-detail', kwargs={'_id': response.data['_id']})
+        self.client.patch(detail, {'team': 'Team DC'}, format='json')
+        self.assertEqual(Team.objects.get(name='Team Marvel').members_count, 1)
+        self.assertEqual(Team.objects.get(name='Team DC').members_count, 1)
+
+        self.client.delete(detail)
+        self.assertEqual(Team.objects.get(name='Team DC').members_count, 0)
+
+    def test_reconcile_members_counts(self):
+        Team.objects.create(name='Team Marvel', description='Avengers assemble!', members_count=7)
+        self.assertEqual(reconcile_members_counts(), {'Team Marvel': (7, 1)})
+        self.assertEqual(Team.objects.get(name='Team Marvel').members_count, 1)
+        self.assertEqual(reconcile_members_counts(), {})
+
     def tearDown(self):
         User.objects.all().delete()
+        Team.objects.all().delete()
+        get_response_cache().clear()
 
 
 class TeamTests(APITestCase):
@@ -48,8 +126,69 @@ class TeamTests(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_document_lookup_matches_orm(self):
+        team = get_object_by_id(Team.objects.all(), str(self.team._id))
+        expected = Team.objects.get(_id=self.team._id)
+        for field in Team._meta.concrete_fields:
+            self.assertEqual(getattr(team, field.attname), getattr(expected, field.attname))
+        with self.assertRaises(NotFound):
+            get_object_by_id(Team.objects.all(), str(ObjectId()))
+
+    def test_cached_detail_is_invalidated_on_update(self):
+        url = reverse('team-detail', args=[self.team._id])
+        self.assertEqual(self.client.get(url).data['members_count'], 6)
+        response = self.client.patch(url, {'members_count': 7}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).data['members_count'], 7)
+
+    def test_writes_do_not_start_from_cached_documents(self):
+        url = reverse('team-detail', args=[self.team._id])
+        self.client.get(url)
+        # Written by another worker: this process still caches members_count 6.
+        Team.objects.mongo_update_one({'_id': self.team._id}, {'$set': {'members_count': 9}})
+        response = self.client.patch(url, {'description': 'Justice League!'}, format='json')
+        self.assertEqual(response.data['members_count'], 9)
+        self.assertEqual(Team.objects.get(_id=self.team._id).members_count, 9)
+
+    def test_pages_follow_next_links(self):
+        for number in range(4):
+            Team.objects.create(name=f'Team {number}', description='', members_count=0)
+        url = f"{reverse('team-list')}?page_size=2"
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            names.extend(row['name'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(names, ['Team 3', 'Team 2', 'Team 1', 'Team 0', 'Team Marvel'])
+
+    def test_lists_read_with_the_list_read_preference(self):
+        get_response_cache().clear()
+        for name, model in (('team', Team), ('leaderboard', Leaderboard), ('workout', Workout), ('rollup', DailyRollup)):
+            with mock.patch('octofit_tracker.native.list_read_collection', wraps=list_read_collection) as read:
+                response = self.client.get(reverse(f'{name}-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            read.assert_called_with(model)
+        response = self.client.get(reverse('team-list'), {'name': 'Team Marvel'})
+        self.assertEqual([team['members_count'] for team in response.data['results']], [6])
+
     def tearDown(self):
         Team.objects.all().delete()
+        get_response_cache().clear()
+
+
+class AsyncCursor:
+    """Motor-like cursor over a pymongo one."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        method = getattr(self.cursor, name)
+        return lambda *args, **kwargs: AsyncCursor(method(*args, **kwargs))
+
+    async def to_list(self, length):
+        return list(self.cursor)[:length]
 
 
 class ActivityTests(APITestCase):
@@ -81,8 +220,188 @@ class ActivityTests(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_native_query_matches_orm(self):
+        for day in range(1, 4):
+            Activity.objects.create(
+                user_email='tony.stark@marvel.com', activity_type='Cycling', duration=20 * day,
+                calories_burned=150 * day, date=timezone.make_aware(datetime(2024, 3, day, 7)), notes=''
+            )
+        fields = ('_id', 'date', 'duration')
+        lookups = {'activity_type': 'Cycling', 'date__gte': '2024-03-02', 'duration__lt': '100'}
+        native = NativeQuerySet(Activity).filter(**lookups).order_by('-date').values(*fields)
+        orm = Activity.objects.filter(**lookups).order_by('-date').values(*fields)
+        self.assertEqual(list(native), list(orm))
+        self.assertEqual(len(list(native[1:2])), 1)
+        self.assertEqual(native.count(), 2)
+
+    def test_list_activities_is_cursor_paginated(self):
+        Activity.objects.create(
+            user_email='tony.stark@marvel.com',
+            activity_type='Cycling',
+            duration=45,
+            calories_burned=400,
+            date=datetime.now(),
+        )
+        url = reverse('activity-list')
+        response = self.client.get(url, {'page_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+    def test_bulk_create_reports_partial_failures(self):
+        url = reverse('activity-bulk')
+        data = [
+            {
+                'user_email': 'bruce.wayne@dc.com',
+                'activity_type': 'Boxing',
+                'duration': 60,
+                'calories_burned': 500,
+                'date': datetime.now().isoformat(),
+            },
+            {'user_email': 'not-an-email', 'activity_type': 'Yoga'},
+        ]
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['results'][0]['status'], 'created')
+        self.assertEqual(response.data['results'][1]['status'], 'error')
+        self.assertEqual(Activity.objects.filter(user_email='bruce.wayne@dc.com').count(), 1)
+
+    def test_filter_and_project_activities(self):
+        url = reverse('activity-list')
+        response = self.client.get(url, {
+            'activity_type': 'Running',
+            'duration__gte': 30,
+            'fields': 'user_email,duration',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [{'user_email': 'tony.stark@marvel.com', 'duration': 30}])
+        response = self.client.get(url, {'activity_type': 'Yoga'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_unknown_projection_field_is_rejected(self):
+        url = reverse('activity-list')
+        response = self.client.get(url, {'fields': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_activities_as_ndjson(self):
+        url = reverse('activity-export')
+        response = self.client.get(url, {'user_email': 'tony.stark@marvel.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['notes'], 'Morning run')
+
+    def test_export_activities_as_csv(self):
+        url = reverse('activity-export')
+        response = self.client.get(url, {'export_format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0]['activity_type'], 'Running')
+
+    def test_activity_stats_by_type(self):
+        url = reverse('activity-stats')
+        response = self.client.get(url, {'group_by': 'activity_type'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{
+            'activity_type': 'Running',
+            'total_activities': 1,
+            'total_calories': 300,
+            'total_duration': 30,
+        }])
+
+    def test_activity_stats_rejects_unknown_group(self):
+        url = reverse('activity-stats')
+        response = self.client.get(url, {'group_by': 'planet'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_activity_updates_daily_rollup(self):
+        url = reverse('activity-list')
+        data = {
+            'user_email': 'tony.stark@marvel.com',
+            'activity_type': 'Cycling',
+            'duration': 40,
+            'calories_burned': 350,
+            'date': '2024-03-05T18:30:00Z',
+        }
+        self.client.post(url, data, format='json')
+        self.client.post(url, {**data, 'date': '2024-03-05T06:00:00Z'}, format='json')
+        response = self.client.get(reverse('rollup-list'), {'user_email': 'tony.stark@marvel.com', 'day': '2024-03-05T00:00:00Z'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['total_activities'], 2)
+        self.assertEqual(response.data['results'][0]['total_calories'], 700)
+
+    def test_async_list_pages_like_the_sync_list(self):
+        for day, calories in ((3, 100), (3, 200), (2, 300), (1, 400)):
+            Activity.objects.create(
+                user_email='tony.stark@marvel.com', activity_type='Running', duration=30,
+                calories_burned=calories, date=datetime(2024, 3, day, tzinfo=dt_timezone.utc),
+            )
+        collection = Activity.objects.mongo_with_options()
+        motor = SimpleNamespace(find=lambda *args: AsyncCursor(collection.find(*args)))
+
+        def walk(url, link):
+            pages = []
+            while url:
+                page = self.client.get(url, {'page_size': 2} if not pages else None).json()
+                pages.append(page)
+                url = page[link]
+            return pages
+
+        with mock.patch('octofit_tracker.async_views.get_collection', lambda model: motor), \
+                mock.patch('octofit_tracker.async_views.motor_client_class'):
+            sync_pages = walk(reverse('activity-list'), 'next')
+            async_pages = walk(reverse('async-activity-list'), 'next')
+            async_back = walk(async_pages[-1]['previous'], 'previous')
+        sync_back = walk(sync_pages[-1]['previous'], 'previous')
+
+        def contents(pages):
+            return [
+                ([row['calories_burned'] for row in page['results']],
+                 [parse_qs(urlparse(page[link]).query).get('cursor') if page[link] else None for link in ('next', 'previous')])
+                for page in pages
+            ]
+
+        self.assertEqual(len(sync_pages), 3)
+        self.assertEqual(contents(async_pages), contents(sync_pages))
+        self.assertEqual(contents(async_back), contents(sync_back))
+
+    def test_rebuild_rollups_catches_up_writes_made_meanwhile(self):
+        url = reverse('activity-list')
+        data = {
+            'user_email': 'tony.stark@marvel.com',
+            'activity_type': 'Cycling',
+            'duration': 40,
+            'calories_burned': 350,
+            'date': '2024-03-05T18:30:00Z',
+        }
+        self.client.post(url, data, format='json')
+        DailyRollup.objects.mongo_update_many({}, {'$set': {'total_calories': 1}})
+        write = RebuildRollupsCommand.write
+        posted = []
+
+        def write_then_post(command, collection, pipeline, batch_size):
+            written = write(command, collection, pipeline, batch_size)
+            if not posted:
+                # Lands in the live rollups after its day was rebuilt.
+                posted.append(self.client.post(url, {**data, 'calories_burned': 150}, format='json'))
+            return written
+
+        with mock.patch.object(RebuildRollupsCommand, 'write', write_then_post):
+            call_command('rebuild_rollups', stdout=io.StringIO())
+        rollup = DailyRollup.objects.mongo_find_one({'user_email': 'tony.stark@marvel.com', 'day': datetime(2024, 3, 5)})
+        self.assertEqual((rollup['total_activities'], rollup['total_calories']), (2, 500))
+        self.assertEqual(DailyRollup.objects.mongo_count_documents({}), 2)
+        self.assertNotIn('daily_rollups_rebuild', DailyRollup.objects.mongo_database.list_collection_names())
+
     def tearDown(self):
         Activity.objects.all().delete()
+        DailyRollup.objects.all().delete()
 
 
 class LeaderboardTests(APITestCase):
@@ -100,8 +419,80 @@ class LeaderboardTests(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_activity_writes_update_team_totals(self):
+        User.objects.create(name='Thor', email='thor.odinson@marvel.com', team='Team Marvel')
+        data = {
+            'user_email': 'thor.odinson@marvel.com',
+            'activity_type': 'Boxing',
+            'duration': 60,
+            'calories_burned': 500,
+            'date': datetime.now().isoformat(),
+        }
+        response = self.client.post(reverse('activity-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        entry = Leaderboard.objects.get(team_name='Team Marvel')
+        self.assertEqual(entry.total_activities, 53)
+        self.assertEqual(entry.total_calories, 31534)
+        self.assertEqual(entry.total_duration, 3535)
+
+        url = reverse('activity-detail', kwargs={'_id': response.data['_id']})
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        entry = Leaderboard.objects.get(team_name='Team Marvel')
+        self.assertEqual(entry.total_activities, 52)
+        self.assertEqual(entry.total_calories, 31034)
+        self.assertEqual(entry.total_duration, 3475)
+
+    def test_new_team_is_ranked(self):
+        User.objects.create(name='Batman', email='bruce.wayne@dc.com', team='Team DC')
+        data = {
+            'user_email': 'bruce.wayne@dc.com',
+            'activity_type': 'Boxing',
+            'duration': 60,
+            'calories_burned': 500,
+            'date': datetime.now().isoformat(),
+        }
+        self.client.post(reverse('activity-list'), data, format='json')
+        self.assertEqual(Leaderboard.objects.get(team_name='Team Marvel').rank, 1)
+        self.assertEqual(Leaderboard.objects.get(team_name='Team DC').rank, 2)
+
+    def test_athlete_rankings(self):
+        rankings.reset()
+        DailyRollup.objects.create(
+            user_email='thor.odinson@marvel.com', day=timezone.make_aware(datetime(2024, 1, 1)),
+            total_activities=2, total_calories=1000, total_duration=90
+        )
+        url = reverse('leaderboard-athletes')
+        response = self.client.get(url, {'window': 'all'})
+        self.assertEqual(response.data['results'], [
+            {'rank': 1, 'user_email': 'thor.odinson@marvel.com', 'total_calories': 1000},
+        ])
+
+        data = {
+            'user_email': 'bruce.wayne@dc.com',
+            'activity_type': 'Boxing',
+            'duration': 60,
+            'calories_burned': 500,
+            'date': datetime.now().isoformat(),
+        }
+        self.client.post(reverse('activity-list'), data, format='json')
+        response = self.client.get(url, {'window': 'week'})
+        self.assertEqual(response.data['athletes'], 1)
+        self.assertEqual(response.data['results'][0]['user_email'], 'bruce.wayne@dc.com')
+
+        response = self.client.get(reverse('leaderboard-athlete-rank'), {'window': 'all', 'user_email': 'bruce.wayne@dc.com'})
+        self.assertEqual((response.data['rank'], response.data['total_calories'], response.data['athletes']), (2, 500, 2))
+        response = self.client.get(url, {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def tearDown(self):
+        rankings.reset()
+        identity.reset()
+        get_response_cache().clear()
         Leaderboard.objects.all().delete()
+        Activity.objects.all().delete()
+        DailyRollup.objects.all().delete()
+        User.objects.all().delete()
 
 
 class WorkoutTests(APITestCase):
@@ -135,8 +526,361 @@ class WorkoutTests(APITestCase):
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_list_workouts_etag(self):
+        url = reverse('workout-list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_create_workout_invalidates_cached_list(self):
+        url = reverse('workout-list')
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 1)
+        data = {
+            'name': 'Speedster Cardio',
+            'description': 'Fast cardio session',
+            'activity_type': 'Running',
+            'difficulty': 'advanced',
+            'duration': 30,
+            'calories_estimate': 400,
+            'instructions': '1. Sprint\n2. Rest\n3. Repeat'
+        }
+        self.client.post(url, data, format='json')
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def tearDown(self):
+        Workout.objects.all().delete()
+        get_response_cache().clear()
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        search.catalog.reset()
+        self.workout = Workout.objects.create(
+            name='Cardio Blast',
+            description='High intensity cardio intervals',
+            activity_type='Running',
+            difficulty='advanced',
+            duration=30,
+            calories_estimate=400,
+            instructions='1. Sprint\n2. Walk\n3. Repeat'
+        )
+
+    def tearDown(self):
+        search.catalog.reset()
+        Workout.objects.all().delete()
+        Activity.objects.all().delete()
+        DailyRollup.objects.all().delete()
+        get_response_cache().clear()
+
+    def test_search_ranks_prefixes_and_follows_writes(self):
+        url = reverse('api-search')
+        response = self.client.get(url, {'q': 'cardi', 'type': 'workout'})
+        self.assertEqual([row['_id'] for row in response.data['results']], [str(self.workout._id)])
+        self.assertEqual(response.data['results'][0]['name'], 'Cardio Blast')
+
+        data = {
+            'name': 'Easy Cardio Walk',
+            'description': 'Low intensity walk',
+            'activity_type': 'Walking',
+            'difficulty': 'beginner',
+            'duration': 45,
+            'calories_estimate': 200,
+            'instructions': '1. Walk',
+        }
+        workout_id = self.client.post(reverse('workout-list'), data, format='json').data['_id']
+        response = self.client.get(url, {'q': 'cardio', 'type': 'workout'})
+        self.assertEqual([row['_id'] for row in response.data['results']], [str(self.workout._id), workout_id])
+        response = self.client.get(url, {'q': 'cardio', 'type': 'workout', 'difficulty': 'beginner'})
+        self.assertEqual([row['_id'] for row in response.data['results']], [workout_id])
+
+        self.client.delete(reverse('workout-detail', kwargs={'_id': workout_id}))
+        self.assertEqual(self.client.get(url, {'q': 'easy', 'type': 'workout'}).data['results'], [])
+
+    def test_activity_notes_use_their_text_index(self):
+        Activity.objects.mongo_create_index([('notes', 'text')], name=Activity.text_index['name'])
+        url = reverse('api-search')
+        data = {
+            'user_email': 'peter.parker@marvel.com',
+            'activity_type': 'Running',
+            'duration': 40,
+            'calories_burned': 350,
+            'date': datetime.now().isoformat(),
+            'notes': 'Easy cardio run around Queens',
+        }
+        activity_id = self.client.post(reverse('activity-list'), data, format='json').data['_id']
+        response = self.client.get(url, {'q': 'cardio'})
+        self.assertEqual([row['type'] for row in response.data['results']], ['workout', 'activity'])
+        response = self.client.get(url, {'q': 'cardio', 'difficulty': 'advanced'})
+        self.assertEqual([row['type'] for row in response.data['results']], ['workout'])
+        response = self.client.get(url, {'q': 'queens', 'type': 'activity'})
+        self.assertEqual([row['_id'] for row in response.data['results']], [activity_id])
+
+        self.client.delete(reverse('activity-detail', kwargs={'_id': activity_id}))
+        self.assertEqual(self.client.get(url, {'q': 'queens'}).data['results'], [])
+
+    def test_activity_notes_are_scanned_without_a_text_index(self):
+        base = {'user_email': 'peter.parker@marvel.com', 'activity_type': 'Running', 'duration': 40, 'calories_burned': 350}
+        older = Activity.objects.create(**base, date=timezone.now() - timedelta(days=1), notes='Cardio run around Queens')
+        newer = Activity.objects.create(**base, date=timezone.now(), notes='cardio intervals')
+        Activity.objects.create(**base, date=timezone.now(), notes='Rest day')
+        self.assertEqual(search.scan_notes(['cardio', 'queens'], 5), [(2, older._id), (1, newer._id)])
+        self.assertEqual(search.scan_notes(['cardio'], 1), [(1, newer._id)])
+
+    def test_query_is_required(self):
+        response = self.client.get(reverse('api-search'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecommendationTests(APITestCase):
+    def setUp(self):
+        recommendations.recommender.reset()
+        Workout.objects.create(
+            name='Tempo Run', description='Steady run', activity_type='Running', difficulty='intermediate',
+            duration=40, calories_estimate=400, instructions='Run'
+        )
+        self.swim_workout = Workout.objects.create(
+            name='Lap Swim', description='Easy laps', activity_type='Swimming', difficulty='beginner',
+            duration=30, calories_estimate=240, instructions='Swim'
+        )
+        Activity.objects.create(
+            user_email='diana@dc.com', activity_type='Running', duration=40,
+            calories_burned=400, date=timezone.now()
+        )
+
+    def tearDown(self):
+        recommendations.recommender.reset()
+        Workout.objects.all().delete()
+        Activity.objects.all().delete()
+        DailyRollup.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        get_response_cache().clear()
+
+    def recommended(self, **params):
+        response = self.client.get(reverse('workout-recommended'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_recommendations_follow_activity_history(self):
+        data = self.recommended(user_email='diana@dc.com')
+        self.assertTrue(data['personalized'])
+        self.assertEqual([row['name'] for row in data['results']], ['Tempo Run', 'Lap Swim'])
+
+        for _ in range(3):
+            self.client.post(reverse('activity-list'), {
+                'user_email': 'diana@dc.com',
+                'activity_type': 'Swimming',
+                'duration': 30,
+                'calories_burned': 240,
+                'date': datetime.now().isoformat(),
+            }, format='json')
+        data = self.recommended(user_email='diana@dc.com')
+        self.assertEqual([row['name'] for row in data['results']], ['Lap Swim', 'Tempo Run'])
+        data = self.recommended(user_email='diana@dc.com', difficulty='intermediate')
+        self.assertEqual([row['name'] for row in data['results']], ['Tempo Run'])
+
+    def test_workout_writes_rebuild_the_catalog(self):
+        self.recommended(user_email='diana@dc.com')
+        self.client.delete(reverse('workout-detail', kwargs={'_id': str(self.swim_workout._id)}))
+        data = self.recommended(user_email='bruce@dc.com', limit=5)
+        self.assertFalse(data['personalized'])
+        self.assertEqual([row['name'] for row in data['results']], ['Tempo Run'])
+
+    def test_user_email_is_required(self):
+        response = self.client.get(reverse('workout-recommended'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class IdentityMapTests(APITestCase):
+    def setUp(self):
+        identity.reset()
+        self.users = {}
+        for name, email, team in (
+            ('Flash', 'barry.allen@dc.com', 'Team DC'),
+            ('Hulk', 'bruce.banner@marvel.com', 'Team Marvel'),
+        ):
+            response = self.client.post(reverse('user-list'), {'name': name, 'email': email, 'team': team}, format='json')
+            self.users[email] = response.data['_id']
+        for email, calories in (('barry.allen@dc.com', 300), ('bruce.banner@marvel.com', 500)):
+            Activity.objects.create(
+                user_email=email, activity_type='Running', duration=30,
+                calories_burned=calories, date=timezone.now()
+            )
+
+    def tearDown(self):
+        identity.reset()
+        User.objects.all().delete()
+        Team.objects.all().delete()
+        Activity.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        get_response_cache().clear()
+
+    def team_activities(self, team):
+        response = self.client.get(reverse('activity-list'), {'team': team})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['user_email'] for row in response.data['results']]
+
+    def test_team_filter_follows_user_writes(self):
+        self.assertEqual(identity.members('Team DC'), ['barry.allen@dc.com'])
+        self.assertEqual(self.team_activities('Team DC'), ['barry.allen@dc.com'])
+
+        detail = reverse('user-detail', kwargs={'_id': self.users['bruce.banner@marvel.com']})
+        self.client.patch(detail, {'team': 'Team DC'}, format='json')
+        self.assertEqual(identity.members('Team DC'), ['barry.allen@dc.com', 'bruce.banner@marvel.com'])
+        self.assertEqual(sorted(self.team_activities('Team DC')), ['barry.allen@dc.com', 'bruce.banner@marvel.com'])
+        self.assertEqual(self.team_activities('Team Marvel'), [])
+
+        self.client.delete(detail)
+        self.assertEqual(identity.members('Team DC'), ['barry.allen@dc.com'])
+        self.assertEqual(self.team_activities('Team DC'), ['barry.allen@dc.com'])
+
+    def test_team_stats_group_athletes_by_team(self):
+        response = self.client.get(reverse('activity-stats'), {'group_by': 'team'})
+        self.assertEqual(
+            [(row['team'], row['total_calories']) for row in response.data],
+            [('Team Marvel', 500), ('Team DC', 300)],
+        )
+        response = self.client.get(reverse('activity-stats'), {'group_by': 'team', 'limit': 1})
+        self.assertEqual([row['team'] for row in response.data], ['Team Marvel'])
+
+    def test_leaderboard_writes_take_teams_from_the_map(self):
+        detail = reverse('user-detail', kwargs={'_id': self.users['bruce.banner@marvel.com']})
+        self.client.patch(detail, {'team': 'Team DC'}, format='json')
+        self.assertEqual(identity.members('Team DC'), ['barry.allen@dc.com', 'bruce.banner@marvel.com'])
+        data = {
+            'user_email': 'bruce.banner@marvel.com', 'activity_type': 'Running',
+            'duration': 30, 'calories_burned': 200, 'date': timezone.now().isoformat(),
+        }
+        with mock.patch('octofit_tracker.leaderboard.identity.team_of', wraps=identity.team_of) as team_of, \
+                mock.patch.object(User.objects, 'mongo_find', side_effect=AssertionError('users read')):
+            response = self.client.post(reverse('activity-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        team_of.assert_called_with('bruce.banner@marvel.com')
+        row = Leaderboard.objects.mongo_find_one({'team_name': 'Team DC'})
+        self.assertEqual(row['total_calories'], 200)
+
+
+class ChangeFeedTests(APITestCase):
+    def setUp(self):
+        search.catalog.reset()
+        rankings.reset()
+        identity.reset()
+        self.feed = PollingFeed(User.objects.mongo_database, lookback=60)
+        self.feed.poll()
+
     def tearDown(self):
+        search.catalog.reset()
+        rankings.reset()
+        identity.reset()
+        User.objects.all().delete()
         Workout.objects.all().delete()
+        Activity.objects.all().delete()
+        DailyRollup.objects.all().delete()
+        Leaderboard.objects.all().delete()
+        User.objects.mongo_database['activity_deltas'].delete_many({})
+        get_response_cache().clear()
+
+    def test_polling_applies_writes_of_other_processes(self):
+        self.assertEqual(search.catalog.search_workouts('kettlebell', 10), [])
+        self.assertEqual(identity.members('Team DC'), [])
+        # Written straight to MongoDB, as another worker would.
+        Workout.objects.mongo_insert_one({
+            'name': 'Kettlebell Swings', 'description': 'Hip hinge power', 'activity_type': 'Strength',
+            'difficulty': 'beginner', 'duration': 20, 'calories_estimate': 200, 'instructions': 'Swing',
+        })
+        result = User.objects.mongo_insert_one({'name': 'Cyborg', 'email': 'victor.stone@dc.com', 'team': 'Team DC'})
+        self.feed.poll()
+        self.assertEqual(len(search.catalog.search_workouts('kettlebell', 10)), 1)
+        self.assertEqual(identity.members('Team DC'), ['victor.stone@dc.com'])
+
+        # Deletions only show in the document count, and reload the collection.
+        User.objects.mongo_delete_one({'_id': result.inserted_id})
+        self.feed.poll()
+        self.assertEqual(identity.members('Team DC'), [])
+
+    def test_local_inserts_are_not_applied_twice(self):
+        self.assertEqual(rankings.top('all', 10)[0], [])
+        self.client.post(reverse('activity-list'), {
+            'user_email': 'diana@dc.com',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': 300,
+            'date': datetime.now().isoformat(),
+        }, format='json')
+        Activity.objects.mongo_insert_one({
+            'user_email': 'clark.kent@dc.com', 'activity_type': 'Flying', 'duration': 60,
+            'calories_burned': 900, 'date': datetime(2024, 1, 1), 'notes': '',
+        })
+        self.feed.poll()
+        rows, athletes, _ = rankings.top('all', 10)
+        self.assertEqual([(email, score) for _, email, score in rows], [('clark.kent@dc.com', 900), ('diana@dc.com', 300)])
+
+
+    def test_deltas_of_other_processes_are_applied_where_they_belong(self):
+        for email, calories in (('clark.kent@dc.com', 900), ('diana@dc.com', 300)):
+            DailyRollup.objects.mongo_insert_one({
+                'user_email': email, 'day': datetime(2024, 1, 1),
+                'total_activities': 1, 'total_calories': calories, 'total_duration': 60,
+            })
+        self.assertEqual(len(rankings.top('all', 10)[0]), 2)
+        # Published by another worker that edited one of Clark's activities.
+        User.objects.mongo_database['activity_deltas'].insert_one({
+            'created_at': timezone.now(),
+            'deltas': [{'user_email': 'clark.kent@dc.com', 'day': datetime(2024, 1, 1),
+                        'activities': 0, 'calories': -700, 'duration': 0}],
+        })
+        with mock.patch.object(rankings, 'reset') as reset, \
+                mock.patch.object(recommendations.recommender, 'drop_profiles') as drop_profiles:
+            self.feed.poll()
+        reset.assert_not_called()
+        drop_profiles.assert_called_once_with({'clark.kent@dc.com'})
+        rows, _, _ = rankings.top('all', 10)
+        self.assertEqual([(email, score) for _, email, score in rows], [('diana@dc.com', 300), ('clark.kent@dc.com', 200)])
+
+    @override_settings(OCTOFIT_CHANGES={'ENABLED': True})
+    def test_local_updates_and_deletes_publish_but_do_not_reload(self):
+        data = {
+            'user_email': 'diana@dc.com', 'activity_type': 'Running', 'duration': 30,
+            'calories_burned': 300, 'date': datetime(2024, 1, 1).isoformat(),
+        }
+        detail = reverse('activity-detail', kwargs={'_id': self.client.post(reverse('activity-list'), data, format='json').data['_id']})
+        self.feed.poll()
+        self.client.patch(detail, {'calories_burned': 250}, format='json')
+        self.client.delete(detail)
+        published = list(User.objects.mongo_database['activity_deltas'].find({}).sort('_id', 1))
+        self.assertEqual([rollups.read_deltas(document) for document in published], [
+            {('diana@dc.com', datetime(2024, 1, 1)): [0, -50, 0]},
+            {('diana@dc.com', datetime(2024, 1, 1)): [-1, -250, -30]},
+        ])
+        with mock.patch.object(rankings, 'reset') as reset, \
+                mock.patch.object(recommendations.recommender, 'drop_profiles') as drop_profiles:
+            self.feed.poll()
+        reset.assert_not_called()
+        drop_profiles.assert_not_called()
+
+@skipUnless(motor_available(), 'Motor does not import on this Python version.')
+class AsyncEndpointTests(APITestCase):
+    def setUp(self):
+        for number in range(3):
+            User.objects.create(name=f'Hero {number}', email=f'hero{number}@marvel.com', team='Team Marvel')
+
+    def test_async_user_list_pages_by_cursor(self):
+        url = reverse('async-user-list')
+        response = self.client.get(url, {'page_size': 2, 'team': 'Team Marvel'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = response.json()
+        self.assertEqual([user['email'] for user in first_page['results']], ['hero2@marvel.com', 'hero1@marvel.com'])
+        self.assertIsNone(first_page['previous'])
+        second_page = self.client.get(first_page['next']).json()
+        self.assertEqual([user['email'] for user in second_page['results']], ['hero0@marvel.com'])
+        self.assertIsNone(second_page['next'])
+        back = self.client.get(second_page['previous']).json()
+        self.assertEqual(back['results'], first_page['results'])
+
+    def tearDown(self):
+        User.objects.all().delete()
 
 
 class APIRootTests(APITestCase):
@@ -149,3 +893,779 @@ class APIRootTests(APITestCase):
         self.assertIn('activities', response.data)
         self.assertIn('leaderboard', response.data)
         self.assertIn('workouts', response.data)
+        self.assertIn('rollups', response.data)
+        self.assertIn('search', response.data)
+        self.assertIn('health', response.data)
+
+    def test_health(self):
+        response = self.client.get(reverse('api-health'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['databases']['default']['status'], 'ok')
+        self.assertIn('addresses', response.data['pool'])
+        self.assertIn('addresses', response.data['async_pool'])
+
+
+@override_settings(OCTOFIT_INSTRUMENTATION={'ENABLED': True})
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        request_metrics.clear()
+        Workout.objects.create(
+            name='Plank',
+            description='Core hold',
+            activity_type='Yoga',
+            difficulty='beginner',
+            duration=5,
+            calories_estimate=30,
+            instructions='1. Hold'
+        )
+
+    def tearDown(self):
+        Workout.objects.all().delete()
+        get_response_cache().clear()
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get(reverse('workout-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('desc="WorkoutViewSet.list"', response['Server-Timing'])
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ mongo commands"')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode()
+        self.assertIn('octofit_requests_total{view="WorkoutViewSet.list",status="200"} 1', content)
+        self.assertIn('octofit_request_duration_seconds_count{view="WorkoutViewSet.list"} 1', content)
+
+
+class PaginationTests(SimpleTestCase):
+    def test_page_size_is_capped(self):
+        paginator = KeysetCursorPagination()
+        request = Request(APIRequestFactory().get('/api/activities/', {'page_size': 100000}))
+        self.assertEqual(paginator.get_page_size(request), paginator.max_page_size)
+
+    def test_default_page_size(self):
+        paginator = KeysetCursorPagination()
+        request = Request(APIRequestFactory().get('/api/activities/'))
+        self.assertEqual(paginator.get_page_size(request), paginator.page_size)
+
+
+class StatsPipelineTests(SimpleTestCase):
+    def test_team_pipeline_groups_per_athlete(self):
+        pipeline = build_pipeline('team', build_match(activity_type='Running'), limit=5)
+        self.assertEqual(pipeline[0], {'$match': {'activity_type': 'Running'}})
+        self.assertEqual(pipeline[1]['$group']['_id'], '$user_email')
+        # Regrouped by the identity map's teams, then sorted and limited.
+        self.assertEqual(len(pipeline), 2)
+
+    def test_time_buckets_sort_chronologically(self):
+        pipeline = build_pipeline('week', limit=10)
+        self.assertEqual(pipeline[-2], {'$sort': {'_id': 1}})
+        self.assertEqual(pipeline[-1], {'$limit': 10})
+
+    def test_unknown_group_is_rejected(self):
+        with self.assertRaises(ValueError):
+            build_pipeline('planet')
+
+
+class IndexDeclarationTests(SimpleTestCase):
+    def test_activity_compound_indexes(self):
+        declared = declared_indexes(Activity)
+        self.assertIn((('date', -1), ('_id', 1)), declared)
+        self.assertIn((('user_email', 1), ('date', 1)), declared)
+        self.assertIn((('activity_type', 1), ('date', 1)), declared)
+        self.assertEqual(declared[(('notes', 'text'),)], {'name': 'activities_notes_text'})
+        self.assertNotIn((('notes', 'text'),), declared_indexes(Activity, timeseries=True))
+
+    def test_default_orderings_are_indexed(self):
+        for viewset in (
+            UserViewSet, TeamViewSet, ActivityViewSet, LeaderboardViewSet, WorkoutViewSet, DailyRollupViewSet
+        ):
+            model = viewset.queryset.model
+            column = model._meta.get_field(viewset.ordering.lstrip('-')).column
+            leading = {key[0][0] for key in declared_indexes(model)} | {'_id'}
+            self.assertIn(column, leading, viewset.__name__)
+
+    def test_unique_fields_are_declared(self):
+        self.assertEqual(declared_indexes(User)[(('email', 1),)], {'unique': True})
+        self.assertIn((('team', 1),), declared_indexes(User))
+        self.assertIn((('rank', 1),), declared_indexes(Leaderboard))
+
+    def test_rollup_days_are_indexed(self):
+        declared = declared_indexes(DailyRollup)
+        self.assertEqual(declared[(('user_email', 1), ('day', 1))], {'unique': True})
+        self.assertIn((('day', 1),), declared)
+
+    def test_live_indexes_keep_special_directions(self):
+        information = {
+            '_id_': {'key': [('_id', 1)]},
+            'date_-1': {'key': [('date', -1.0)]},
+            'activities_notes_text': {'key': [('_fts', 'text'), ('_ftsx', 1)], 'weights': {'notes': 1}},
+            'user_email_hashed': {'key': [('user_email', 'hashed')]},
+        }
+        model = SimpleNamespace(objects=SimpleNamespace(mongo_index_information=lambda: information))
+        self.assertEqual(live_indexes(model), {
+            (('_id', 1),): '_id_',
+            (('date', -1),): 'date_-1',
+            (('notes', 'text'),): 'activities_notes_text',
+            (('user_email', 'hashed'),): 'user_email_hashed',
+        })
+
+
+
+class SyncIndexesTests(TestCase):
+    def test_failures_are_reported_per_index(self):
+        out, err = io.StringIO(), io.StringIO()
+        command = 'octofit_tracker.management.commands.sync_indexes'
+        with mock.patch(f'{command}.timeseries_collections', return_value=('activities',)), \
+                mock.patch(f'{command}.live_indexes', lambda model: {} if model is User else live_indexes(model)), \
+                mock.patch(f'{command}.index_usage', return_value=None), \
+                mock.patch.object(User.objects, 'mongo_create_index', side_effect=OperationFailure('too many')):
+            call_command('sync_indexes', stdout=out, stderr=err)
+        self.assertIn('activities: skipping text index activities_notes_text', out.getvalue())
+        self.assertNotIn('notes: text', out.getvalue())
+        self.assertIn('users: could not create index {email: 1}', err.getvalue())
+        self.assertIn('users: could not create index {team: 1}', err.getvalue())
+        failures = len(declared_indexes(User))
+        self.assertEqual(err.getvalue().count('users: could not create index'), failures)
+        self.assertIn('indexes could not be created', out.getvalue())
+
+class PopulateSyntheticDataTests(SimpleTestCase):
+    def test_batched_streams_fixed_size_chunks(self):
+        batches = list(batched(iter(range(7)), 3))
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_synthetic_activity_is_reproducible(self):
+        now = datetime(2024, 1, 1)
+        first = PopulateCommand.synthetic_activity(random.Random(42), 'athlete1@octofit.test', now)
+        second = PopulateCommand.synthetic_activity(random.Random(42), 'athlete1@octofit.test', now)
+        self.assertEqual(first, second)
+        self.assertEqual(first['user_email'], 'athlete1@octofit.test')
+        self.assertLessEqual(first['date'], now)
+
+
+class ConvertActivitiesTimeseriesTests(SimpleTestCase):
+    def database(self, version, collections=()):
+        database = mock.MagicMock()
+        database.command.return_value = {'versionArray': version}
+        database.list_collections.return_value = list(collections)
+        return database
+
+    def convert(self, database):
+        out = io.StringIO()
+        model = SimpleNamespace(objects=SimpleNamespace(mongo_database=database), _meta=Activity._meta)
+        with mock.patch('octofit_tracker.management.commands.convert_activities_timeseries.Activity', model):
+            call_command('convert_activities_timeseries', stdout=out)
+        return out.getvalue()
+
+    def test_refuses_servers_before_7_0(self):
+        for version in ([4, 4, 29, 0], [6, 0, 12, 0]):
+            database = self.database(version)
+            with self.assertRaisesMessage(CommandError, 'MongoDB 7.0 or later'):
+                self.convert(database)
+            database.command.assert_called_once_with('buildInfo')
+            database.list_collections.assert_not_called()
+            database.create_collection.assert_not_called()
+
+    def test_converted_collection_is_left_alone(self):
+        database = self.database([7, 0, 2, 0], [{'name': 'activities', 'type': 'timeseries'}])
+        self.assertIn('already a time-series collection', self.convert(database))
+        database.create_collection.assert_not_called()
+
+    def test_conversion_waits_for_equal_counts(self):
+        collections = {
+            'activities': mock.MagicMock(**{'count_documents.return_value': 3}),
+            'activities_legacy': mock.MagicMock(**{'count_documents.return_value': 4}),
+        }
+        database = self.database([7, 0, 2, 0], [{'name': 'activities', 'type': 'collection'}])
+        database.__getitem__.side_effect = lambda name: collections.setdefault(name, mock.MagicMock())
+        with mock.patch.object(ConvertActivitiesCommand, 'copy', return_value=3):
+            with self.assertRaisesMessage(CommandError, 'keeping activities_legacy'):
+                self.convert(database)
+        database.command.assert_any_call('collMod', 'activities', **FENCE)
+        collections['activities'].rename.assert_called_once_with('activities_legacy')
+        database.create_collection.assert_called_once()
+        collections['activities'].create_index.assert_called_once_with([('_id', 1)], name=mock.ANY)
+        collections['activities_legacy'].drop.assert_not_called()
+
+
+class ConvertActivitiesCopyTests(TestCase):
+    def setUp(self):
+        database = Activity.objects.mongo_database
+        self.source = database['convert_test_source']
+        self.target = database['convert_test_target']
+        self.progress = database['convert_test_progress']
+        self.addCleanup(self.source.drop)
+        self.addCleanup(self.target.drop)
+        self.addCleanup(self.progress.drop)
+
+    def test_resumed_copy_replaces_the_batch_in_flight(self):
+        documents = [{'_id': ObjectId(), 'duration': minutes} for minutes in range(5)]
+        self.source.insert_many(documents)
+        # Interrupted after the first batch was recorded and part of the
+        # second one was stored.
+        self.target.insert_many(documents[:3])
+        self.progress.insert_one({'_id': 'copy', 'last_id': documents[1]['_id']})
+
+        command = ConvertActivitiesCommand(stdout=io.StringIO())
+        self.assertEqual(command.copy(self.source, self.target, self.progress, 2), 3)
+        self.assertEqual(
+            [document['_id'] for document in self.target.find({}).sort('_id', 1)],
+            [document['_id'] for document in documents],
+        )
+        self.assertEqual(self.progress.find_one({'_id': 'copy'})['last_id'], documents[-1]['_id'])
+
+
+class ActivityBulkValidationTests(SimpleTestCase):
+    def test_items_are_validated_independently(self):
+        data = [
+            {
+                'user_email': 'clark.kent@dc.com',
+                'activity_type': 'Running',
+                'duration': 30,
+                'calories_burned': 300,
+                'date': '2024-01-01T08:00:00Z',
+            },
+            {'user_email': 'clark.kent@dc.com'},
+        ]
+        results = ActivitySerializer(data=data, many=True).validate_items()
+        self.assertEqual(results[0][0]['activity_type'], 'Running')
+        self.assertIsNone(results[0][1])
+        self.assertIsNone(results[1][0])
+        self.assertIn('duration', results[1][1])
+
+    def test_batch_size_is_capped(self):
+        serializer = ActivitySerializer(data=[{}] * 3, many=True, max_length=2)
+        with self.assertRaises(ValidationError):
+            serializer.validate_items()
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expired_entry_is_dropped(self):
+        cache = LRUCache()
+        cache.set('a', 1, timeout=-1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_bump_changes_generation(self):
+        cache = LRUCache()
+        generation = cache.generation('team')
+        cache.bump('team')
+        self.assertNotEqual(cache.generation('team'), generation)
+
+
+class FastRepresentationTests(SimpleTestCase):
+    def assertMatchesSerializer(self, serializer_class, instance):
+        row = {name: getattr(instance, name) for name in serializer_class.fast_fields()}
+        self.assertEqual(list(serializer_class.represent_rows([row])), [serializer_class(instance).data])
+
+    def test_activity_rows_match_serializer_output(self):
+        activity = Activity(
+            _id=ObjectId(),
+            user_email='diana.prince@dc.com',
+            activity_type='Swimming',
+            duration=45,
+            calories_burned=380,
+            date=timezone.now(),
+            notes='',
+        )
+        self.assertMatchesSerializer(ActivitySerializer, activity)
+
+    def test_naive_and_missing_datetimes_match_serializer_output(self):
+        user = User(_id=ObjectId(), name='Flash', email='barry.allen@dc.com', team='Team DC')
+        self.assertMatchesSerializer(UserSerializer, user)
+        user.created_at = datetime(2024, 5, 1, 7, 30)
+        self.assertMatchesSerializer(UserSerializer, user)
+
+
+class ExportEncodingTests(SimpleTestCase):
+    def test_csv_lines_stream_header_then_rows(self):
+        rows = iter([{'a': 1, 'b': 'x,y'}, {'a': 2, 'b': ''}])
+        self.assertEqual(list(csv_lines(rows, ['a', 'b'])), ['a,b\r\n', '1,"x,y"\r\n', '2,\r\n'])
+
+
+class FieldFilterBackendTests(SimpleTestCase):
+    def filter(self, params):
+        request = Request(APIRequestFactory().get('/api/activities/', params))
+        return FieldFilterBackend().filter_queryset(request, Activity.objects.all(), ActivityViewSet())
+
+    def test_only_declared_lookups_are_applied(self):
+        queryset = self.filter({'activity_type': 'Running', 'notes__contains': 'run', 'duration__gte': '30'})
+        lookups = sorted(
+            (child.lhs.target.name, child.lookup_name) for child in queryset.query.where.children
+        )
+        self.assertEqual(lookups, [('activity_type', 'exact'), ('duration', 'gte')])
+
+    def test_invalid_value_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.filter({'date__gte': 'yesterday'})
+
+
+class DailyRollupDeltaTests(SimpleTestCase):
+    def test_day_of_truncates_to_utc_midnight(self):
+        aware = datetime(2024, 3, 5, 23, 30, tzinfo=timezone.get_fixed_timezone(-120))
+        self.assertEqual(day_of(aware), datetime(2024, 3, 6))
+        self.assertEqual(day_of(datetime(2024, 3, 5, 12)), datetime(2024, 3, 5))
+
+    def test_update_moves_totals_between_days(self):
+        before = Activity(user_email='hal.jordan@dc.com', duration=30, calories_burned=200, date=datetime(2024, 3, 5, 9))
+        after = Activity(user_email='hal.jordan@dc.com', duration=45, calories_burned=300, date=datetime(2024, 3, 6, 9))
+        deltas = add_activity(add_activity({}, before, sign=-1), after)
+        self.assertEqual(deltas, {
+            ('hal.jordan@dc.com', datetime(2024, 3, 5)): [-1, -200, -30],
+            ('hal.jordan@dc.com', datetime(2024, 3, 6)): [1, 300, 45],
+        })
+
+    def test_documents_accumulate(self):
+        documents = [
+            {'user_email': 'hal.jordan@dc.com', 'duration': 30, 'calories_burned': 200, 'date': datetime(2024, 3, 5, 9)},
+            {'user_email': 'hal.jordan@dc.com', 'duration': 10, 'calories_burned': 50, 'date': datetime(2024, 3, 5, 20)},
+        ]
+        deltas = {}
+        for document in documents:
+            add_activity(deltas, document)
+        self.assertEqual(deltas, {('hal.jordan@dc.com', datetime(2024, 3, 5)): [2, 250, 40]})
+
+
+class AsyncViewTests(SimpleTestCase):
+    def test_endpoints_answer_503_without_motor(self):
+        with mock.patch('octofit_tracker.mongo_async._motor_error', 'Motor does not import.'):
+            response = self.client.get(reverse('async-user-list'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json(), {'detail': 'Motor does not import.'})
+
+
+class PoolMetricsTests(SimpleTestCase):
+    def test_checkout_waits_and_churn_are_recorded(self):
+        listener = PoolMetricsListener()
+        event = SimpleNamespace(address=('localhost', 27017))
+        listener.connection_created(event)
+        listener.connection_check_out_started(event)
+        listener.connection_checked_out(event)
+        listener.connection_check_out_started(event)
+        listener.connection_check_out_failed(event)
+        stats = listener.snapshot()['addresses']['localhost:27017']
+        self.assertEqual(stats['checkouts'], 1)
+        self.assertEqual(stats['checkout_failures'], 1)
+        self.assertEqual(stats['checked_out'], 1)
+        self.assertEqual(stats['open_connections'], 1)
+        self.assertGreaterEqual(stats['checkout_wait_ms']['max'], stats['checkout_wait_ms']['p50'])
+        listener.connection_checked_in(event)
+        listener.connection_closed(event)
+        stats = listener.snapshot()['addresses']['localhost:27017']
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['open_connections'], 0)
+
+
+class CommandMetricsTests(SimpleTestCase):
+    def test_commands_are_counted_per_thread(self):
+        listener = CommandMetricsListener()
+        listener.started(SimpleNamespace())
+        listener.succeeded(SimpleNamespace(duration_micros=1500))
+        listener.started(SimpleNamespace())
+        listener.failed(SimpleNamespace(duration_micros=500))
+        self.assertEqual(listener.reset(), (2, 1, 0.002))
+        self.assertEqual(listener.read(), (0, 0, 0.0))
+
+
+class BenchmarkReportTests(SimpleTestCase):
+    def test_summarize_reports_percentiles_and_commands(self):
+        samples = [(n / 1000, 500 if n == 100 else 200, 3) for n in range(1, 101)]
+        result = summarize(samples, elapsed=2.0)
+        self.assertEqual(result['requests'], 100)
+        self.assertEqual(result['errors'], 1)
+        self.assertEqual(result['throughput_rps'], 50.0)
+        self.assertEqual(result['latency_ms'], {'p50': 51.0, 'p95': 96.0, 'p99': 100.0, 'max': 100.0})
+        self.assertEqual(result['mongo_commands_per_request'], 3.0)
+
+    def test_compare_flags_regressions_beyond_the_threshold(self):
+        def report(p95, rps):
+            return {'endpoints': {'/api/users/': {'latency_ms': {'p95': p95}, 'throughput_rps': rps}}}
+
+        self.assertEqual(compare(report(105, 95), report(100, 100), max_regression=10), [])
+        self.assertEqual(len(compare(report(120, 80), report(100, 100), max_regression=10)), 2)
+        self.assertEqual(compare(report(120, 80), {'endpoints': {}}, max_regression=10), [])
+
+
+class InstrumentationMetricsTests(SimpleTestCase):
+    def test_view_names(self):
+        users = resolve(reverse('user-list')).func
+        self.assertEqual(view_name(users, 'GET'), 'UserViewSet.list')
+        self.assertEqual(view_name(users, 'POST'), 'UserViewSet.create')
+        self.assertEqual(view_name(resolve(reverse('activity-stats')).func, 'GET'), 'ActivityViewSet.stats')
+        self.assertEqual(view_name(resolve(reverse('api-health')).func, 'GET'), 'health')
+
+    def test_prometheus_rendering(self):
+        metrics = RequestMetrics()
+        metrics.record('UserViewSet.list', 200, 0.02, 0.01, 0.005, 3)
+        metrics.record('UserViewSet.list', 200, 0.3, 0.1, 0.05, 4)
+        content = metrics.render()
+        self.assertIn('octofit_requests_total{view="UserViewSet.list",status="200"} 2', content)
+        self.assertIn('octofit_request_duration_seconds_bucket{view="UserViewSet.list",le="0.025"} 1', content)
+        self.assertIn('octofit_request_duration_seconds_bucket{view="UserViewSet.list",le="+Inf"} 2', content)
+        self.assertIn('octofit_mongo_commands_total{view="UserViewSet.list"} 7', content)
+        self.assertIn('octofit_request_db_seconds_total{view="UserViewSet.list"} 0.110000', content)
+
+    def test_metrics_are_not_served_when_disabled(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(OCTOFIT_INSTRUMENTATION={'ENABLED': True})
+    def test_async_requests_are_timed(self):
+        async def get_response(request):
+            return HttpResponse('ok')
+
+        middleware = InstrumentationMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        request_metrics.clear()
+        self.addCleanup(request_metrics.clear)
+        response = async_to_sync(middleware)(APIRequestFactory().get('/api/async/users/'))
+        self.assertRegex(response['Server-Timing'], r'total;dur=[\d.]+;desc="unmatched"')
+        self.assertIn('octofit_requests_total{view="unmatched",status="200"} 1', request_metrics.render())
+
+
+    def test_views_add_their_row_building_to_serialize_time(self):
+        http_request = APIRequestFactory().get('/api/activities/')
+        http_request._instrumentation_serialize = 0.0
+        with mock.patch('octofit_tracker.instrumentation.time.perf_counter', side_effect=[1.0, 1.25]):
+            with serializing(Request(http_request)):
+                pass
+        self.assertEqual(http_request._instrumentation_serialize, 0.25)
+        with serializing(APIRequestFactory().get('/api/activities/')):
+            pass
+
+class NativeQueryTests(SimpleTestCase):
+    def test_filters_become_a_mongo_query(self):
+        queryset = NativeQuerySet(Activity).filter(
+            user_email='tony.stark@marvel.com', date__gte='2024-03-01', date__lt='2024-04-01', duration__gt='10'
+        )
+        self.assertEqual(queryset.mongo_query(), {
+            'user_email': 'tony.stark@marvel.com',
+            'date': {'$gte': datetime(2024, 3, 1), '$lt': datetime(2024, 4, 1)},
+            'duration': {'$gt': 10},
+        })
+        self.assertEqual(queryset.order_by('-date', '_id').sort, [('date', -1), ('_id', 1)])
+
+    def test_slices_compose(self):
+        queryset = NativeQuerySet(Activity)[10:60][5:20]
+        self.assertEqual((queryset.offset, queryset.limit), (15, 15))
+        self.assertEqual(NativeQuerySet(Activity)[10:12][5:].limit, 0)
+
+    def test_unsupported_lookup_is_rejected(self):
+        with self.assertRaises(ValueError):
+            NativeQuerySet(Activity).filter(notes__icontains='run')
+
+
+class RankingIndexTests(SimpleTestCase):
+    def test_top_and_rank_share_ranks_on_ties(self):
+        index = RankingIndex({'a@x.com': 300, 'b@x.com': 500, 'c@x.com': 300, 'd@x.com': 0})
+        self.assertEqual(index.top(3), [(1, 'b@x.com', 500), (2, 'a@x.com', 300), (2, 'c@x.com', 300)])
+        self.assertEqual(index.rank('c@x.com'), (2, 300))
+        self.assertEqual(index.rank('d@x.com'), (None, 0))
+
+    def test_updates_move_and_drop_athletes(self):
+        index = RankingIndex({'a@x.com': 300, 'b@x.com': 500})
+        index.add('a@x.com', 250)
+        index.add('c@x.com', 100)
+        self.assertEqual(index.rank('a@x.com'), (1, 550))
+        index.add('b@x.com', -500)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.top(10), [(1, 'a@x.com', 550), (2, 'c@x.com', 100)])
+
+    def test_window_starts(self):
+        today = datetime(2024, 3, 14)
+        self.assertEqual(window_start('day', today), today)
+        self.assertEqual(window_start('week', today), datetime(2024, 3, 11))
+        self.assertEqual(window_start('month', today), datetime(2024, 3, 1))
+        self.assertIsNone(window_start('all', today))
+
+
+@override_settings(OCTOFIT_RANKINGS={'TTL': 60})
+class RankingsReloadTests(SimpleTestCase):
+    def setUp(self):
+        self.rankings = Rankings()
+        self.scores = {'a@x.com': 100}
+        self.clock = [1000.0]
+        for target, replacement in (
+            ('octofit_tracker.rankings.load_scores', lambda start: dict(self.scores)),
+            ('octofit_tracker.rankings.time.monotonic', lambda: self.clock[0]),
+        ):
+            patcher = mock.patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reloads_after_ttl(self):
+        self.assertEqual(self.rankings.rank('all', 'a@x.com')[:2], (1, 100))
+        # Written by another process.
+        self.scores = {'a@x.com': 100, 'b@x.com': 500}
+        self.clock[0] += 59
+        self.assertEqual(self.rankings.rank('all', 'a@x.com')[:2], (1, 100))
+        self.clock[0] += 1
+        # Served from the previous index while the reload runs.
+        self.assertEqual(self.rankings.rank('all', 'a@x.com')[:2], (1, 100))
+        self.rankings.join()
+        self.assertEqual(self.rankings.rank('all', 'a@x.com')[:2], (2, 100))
+
+    def test_readers_do_not_wait_for_a_reload(self):
+        self.rankings.top('all', 10)
+        self.clock[0] += 60
+        loading, release = threading.Event(), threading.Event()
+
+        def load_scores(start):
+            loading.set()
+            release.wait(5)
+            return {'a@x.com': 100, 'b@x.com': 500}
+
+        with mock.patch('octofit_tracker.rankings.load_scores', load_scores):
+            self.rankings.top('all', 10)
+            self.assertTrue(loading.wait(5))
+            self.assertEqual(self.rankings.top('all', 10)[0], [(1, 'a@x.com', 100)])
+            release.set()
+            self.rankings.join()
+        self.assertEqual(self.rankings.top('all', 10)[0], [(1, 'b@x.com', 500), (2, 'a@x.com', 100)])
+
+    def test_deltas_during_a_reload_are_not_counted_twice(self):
+        self.rankings.top('all', 10)
+        self.clock[0] += 60
+
+        def load_scores(start):
+            # The rollup write lands before the read; its delta arrives during it.
+            self.rankings.apply_deltas({('a@x.com', utc_today()): [1, 50, 10]})
+            return {'a@x.com': 150}
+
+        with mock.patch('octofit_tracker.rankings.load_scores', load_scores):
+            self.rankings.top('all', 10)
+            self.rankings.join()
+        rows, _, _ = self.rankings.top('all', 10)
+        self.assertEqual(rows, [(1, 'a@x.com', 150)])
+        self.rankings.apply_deltas({('a@x.com', utc_today()): [1, 25, 5]})
+        self.assertEqual(self.rankings.rank('day', 'a@x.com')[:2], (1, 175))
+
+
+class IdentityReloadTests(SimpleTestCase):
+    def setUp(self):
+        self.identity = IdentityMap()
+        self.users = [{'_id': 1, 'email': 'a@x.com', 'team': 'Team DC'}]
+        self.clock = [1000.0]
+        users = SimpleNamespace(objects=SimpleNamespace(mongo_find=lambda *args: list(self.users)))
+        for target, replacement in (
+            ('octofit_tracker.identity.User', users),
+            ('octofit_tracker.identity.time.monotonic', lambda: self.clock[0]),
+        ):
+            patcher = mock.patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reloads_after_ttl(self):
+        self.assertEqual(self.identity.members('Team DC'), ['a@x.com'])
+        # Written by another process.
+        self.users = [{'_id': 1, 'email': 'a@x.com', 'team': 'Team Marvel'}]
+        self.clock[0] += 59
+        self.assertEqual(self.identity.members('Team DC'), ['a@x.com'])
+        self.clock[0] += 1
+        self.assertEqual(self.identity.members('Team DC'), [])
+        self.assertEqual(self.identity.members('Team Marvel'), ['a@x.com'])
+
+    def test_writes_during_a_reload_are_kept(self):
+        def mongo_find(*args):
+            # The user is created after the read.
+            self.identity.set_user(2, 'b@x.com', 'Team DC')
+            return list(self.users)
+
+        with mock.patch('octofit_tracker.identity.User', SimpleNamespace(objects=SimpleNamespace(mongo_find=mongo_find))):
+            self.assertEqual(self.identity.members('Team DC'), ['a@x.com', 'b@x.com'])
+
+    def test_reset_discards_a_reload_in_progress(self):
+        def mongo_find(*args):
+            # The user is deleted, and the map reset, during the read.
+            users, self.users = list(self.users), []
+            if users:
+                self.identity.reset()
+            return users
+
+        with mock.patch('octofit_tracker.identity.User', SimpleNamespace(objects=SimpleNamespace(mongo_find=mongo_find))):
+            self.assertEqual(self.identity.members('Team DC'), [])
+
+
+class IngestSpoolTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_drained_segments_are_removed(self):
+        spool = Spool(self.directory, fsync=False)
+        segment = spool.append({'_id': ObjectId(), 'duration': 30})
+        spool.append({'_id': ObjectId(), 'duration': 45})
+        spool.written(segment)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        spool.written(segment)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_segments_of_dead_processes_are_replayed(self):
+        document = {'_id': ObjectId(), 'date': datetime(2024, 3, 5, 9, 30, tzinfo=dt_timezone.utc), 'duration': 30}
+        owner = Spool(self.directory, fsync=False)
+        segment = owner.append(document)
+        self.assertEqual(Spool(self.directory).recover(), [])
+
+        owner._files[segment].close()
+        self.assertEqual(Spool(self.directory).recover(), [(segment, document)])
+
+
+    def test_replayed_activities_already_stored_are_skipped(self):
+        stored, missing = ObjectId(), ObjectId()
+        model = SimpleNamespace(objects=SimpleNamespace(
+            mongo_find=mock.Mock(return_value=[{'_id': stored}]),
+            mongo_insert_many=mock.Mock(),
+        ))
+        ingest_queue = IngestQueue({**ingest.DEFAULTS, 'SPOOL_DIR': self.directory})
+        with mock.patch('octofit_tracker.ingest.Activity', model):
+            errors, retried = ingest_queue.insert([{'_id': stored}, {'_id': missing}], check_stored=True)
+        self.assertEqual(errors[0]['code'], DUPLICATE_KEY)
+        self.assertNotIn(1, errors)
+        self.assertFalse(retried)
+        model.objects.mongo_insert_many.assert_called_once_with([{'_id': missing}], ordered=False)
+
+class InvertedIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add('plank', [('Plank Hold', 3), ('Core strength hold', 1)], {'difficulty': 'beginner'})
+        self.index.add('sprint', [('Sprint Intervals', 3), ('Short sprints for strength and speed', 1)], {'difficulty': 'advanced'})
+        self.index.add('yoga', [('Morning Yoga', 3), ('Stretch and breathe', 1)], {'difficulty': 'beginner'})
+
+    def test_exact_matches_outrank_prefix_matches(self):
+        self.assertEqual([key for _, key in self.index.search('sprint', 10)], ['sprint'])
+        self.assertEqual({key for _, key in self.index.search('str', 10)}, {'plank', 'sprint', 'yoga'})
+        self.assertEqual(self.index.search('hold', 10)[0][1], 'plank')
+
+    def test_filters_and_removal(self):
+        matches = self.index.search('strength', 10, lambda meta: meta['difficulty'] == 'beginner')
+        self.assertEqual([key for _, key in matches], ['plank'])
+        self.index.remove('plank')
+        self.assertEqual(self.index.search('hold', 10), [])
+        self.assertNotIn('hold', self.index.vocabulary)
+        self.assertEqual(self.index.search('the', 10), [])
+
+
+class RecommendationScoringTests(SimpleTestCase):
+    def setUp(self):
+        documents = [
+            {'_id': ObjectId(), 'name': name, 'description': '', 'activity_type': activity_type,
+             'difficulty': 'beginner', 'duration': duration, 'calories_estimate': calories, 'instructions': ''}
+            for name, activity_type, duration, calories in (
+                ('Long Ride', 'Cycling', 90, 720),
+                ('Short Ride', 'Cycling', 20, 160),
+                ('Yoga Flow', 'Yoga', 30, 90),
+            )
+        ]
+        self.catalog = WorkoutCatalog(documents)
+
+    def test_type_mix_duration_and_intensity(self):
+        profile = Profile({'Cycling': [4, 80, 640], 'Yoga': [1, 30, 90]})
+        mix, duration, intensity = profile.vector(self.catalog)
+        self.assertEqual(list(mix), [0.8, 0.2])
+        self.assertEqual(duration, 22.0)
+        self.assertAlmostEqual(intensity, 730 / 110)
+        scores = self.catalog.scores(mix, duration, intensity)
+        names = [self.catalog.rows[position]['name'] for position in scores.argsort()[::-1]]
+        self.assertEqual(names, ['Short Ride', 'Long Ride', 'Yoga Flow'])
+
+    def test_profile_updates_reset_the_vector(self):
+        profile = Profile()
+        self.assertIsNone(profile.vector(self.catalog))
+        profile.add('Yoga', 30, 90)
+        self.assertEqual(list(profile.vector(self.catalog)[0]), [0.0, 1.0])
+        profile.add('Yoga', 30, 90, sign=-1)
+        self.assertEqual(profile.totals, {})
+        self.assertIsNone(profile.vector(self.catalog))
+
+    def test_a_load_overtaken_by_a_write_is_not_kept(self):
+        recommender = Recommender()
+        first, second = Profile({'Yoga': [1, 30, 90]}), Profile({'Yoga': [2, 60, 180]})
+        first_thread = threading.current_thread()
+        second_loading, first_done = threading.Event(), threading.Event()
+
+        def load_profile(user_email):
+            if threading.current_thread() is first_thread:
+                # An activity is written, then a second request loads the athlete too.
+                recommender.apply_changes({user_email: [('Yoga', 30, 90, 1)]})
+                other.start()
+                second_loading.wait(5)
+                return first
+            second_loading.set()
+            first_done.wait(5)
+            return second
+
+        other = threading.Thread(target=recommender.profile, args=['a@x.com'])
+        with mock.patch('octofit_tracker.recommendations.load_profile', load_profile):
+            self.assertIs(recommender.profile('a@x.com'), first)
+            first_done.set()
+            other.join(5)
+        self.assertIs(recommender.profile('a@x.com'), second)
+
+
+class ChangeEventTests(SimpleTestCase):
+    def setUp(self):
+        self.events = []
+        changes.register('teams', self.events.append)
+
+    def tearDown(self):
+        changes._handlers['teams'].remove(self.events.append)
+
+    def test_stream_changes_become_events(self):
+        feed = ChangeStreamFeed(database=None)
+        object_id = ObjectId()
+        changes.mark_local('teams', [object_id])
+        feed.translate({
+            'operationType': 'update', 'ns': {'db': 'octofit_db', 'coll': 'teams'},
+            'documentKey': {'_id': object_id}, 'fullDocument': {'_id': object_id, 'name': 'Team DC'},
+        })
+        feed.translate({'operationType': 'delete', 'ns': {'db': 'octofit_db', 'coll': 'teams'}, 'documentKey': {'_id': object_id}})
+        feed.translate({'operationType': 'drop', 'ns': {'db': 'octofit_db', 'coll': 'teams'}})
+        self.assertEqual(
+            [(event['operation'], event['local']) for event in self.events],
+            [('update', True), ('delete', False), ('reload', False)],
+        )
+        self.assertEqual(self.events[0]['document']['name'], 'Team DC')
+
+    def test_stream_follower_polls_timeseries_collections(self):
+        stopping = threading.Event()
+        polls = []
+        stream = SimpleNamespace(try_next=stopping.set, close=lambda: None)
+        ChangeStreamFeed(database=None).follow(stream, stopping, SimpleNamespace(poll=lambda: polls.append(1)))
+        self.assertEqual(polls, [1])
+
+    def test_feed_runs_when_there_are_several_workers(self):
+        for enabled, workers, backend, expected in (
+            ('auto', 4, 'lru', True),
+            ('auto', 1, 'lru', False),
+            # The identity map the leaderboard writes use is in process.
+            ('auto', 4, 'django', True),
+            (False, 4, 'lru', False),
+            (True, 1, 'django', True),
+        ):
+            with override_settings(
+                OCTOFIT_CHANGES={'ENABLED': enabled, 'WORKERS': workers},
+                OCTOFIT_RESPONSE_CACHE={'BACKEND': backend},
+            ):
+                self.assertIs(changes.enabled(), expected, (enabled, workers, backend))
+
+    def test_local_writes_are_bounded(self):
+        local = LocalWrites(max_entries=2)
+        local.add('users', [1, 2, 3])
+        self.assertFalse(local.pop('users', 1))
+        self.assertTrue(local.pop('users', 3))
+        self.assertFalse(local.pop('users', 3))
+
+    def test_local_deletes_are_taken_once(self):
+        local = LocalWrites(max_entries=10)
+        local.add('activities', [1, 2], deleted=True)
+        self.assertEqual(local.take_deleted('activities', 5), 2)
+        self.assertEqual(local.take_deleted('activities', 5), 0)
@@ -11,13 +11,17 @@ import os
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from octofit_tracker import async_views, instrumentation
 from octofit_tracker.views import (
     api_root,
+    health,
+    search_view,
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
     LeaderboardViewSet,
     WorkoutViewSet,
+    DailyRollupViewSet,
 )
 
 router = DefaultRouter()
@@ -26,6 +30,7 @@ router.register(r'teams', TeamViewSet, basename='team')
 router.register(r'activities', ActivityViewSet, basename='activity')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
+router.register(r'rollups', DailyRollupViewSet, basename='rollup')
 
 # Codespace URL configuration for API endpoints
 # Format: https://${CODESPACE_NAME}-8000.app.github.dev/api/[endpoint]/
@@ -41,5 +46,11 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', api_root, name='api-root'),
     path('api/', include(router.urls)),
+    path('api/health/', health, name='api-health'),
+    path('api/search/', search_view, name='api-search'),
+    path('api/async/activities/', async_views.activity_list, name='async-activity-list'),
+    path('api/async/users/', async_views.user_list, name='async-user-list'),
+    path('api/async/leaderboard/', async_views.leaderboard_list, name='async-leaderboard-list'),
+    path('metrics', instrumentation.metrics, name='metrics'),
     path('', api_root, name='api-root-index'),
 ]
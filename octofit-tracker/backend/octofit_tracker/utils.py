@@ -0,0 +1,11 @@
+from itertools import islice
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items from `iterable` without materializing it."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
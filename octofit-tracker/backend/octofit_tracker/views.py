@@ -1,24 +1,153 @@
-from rest_framework import viewsets
-from rest_framework.decorators import api_view
+import copy
+import json
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connections
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from pymongo.errors import BulkWriteError
+from rest_framework import status, viewsets
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.utils.encoders import JSONEncoder
 from bson import ObjectId
 from bson.errors import InvalidId
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, Workout, DailyRollup
 from .serializers import (
     UserSerializer, TeamSerializer, ActivitySerializer,
-    LeaderboardSerializer, WorkoutSerializer
+    LeaderboardSerializer, WorkoutSerializer, DailyRollupSerializer
+)
+from .filters import EXACT, RANGE
+from .mongo import find_document, instance_from_document, list_read_collection
+from .native import NativeQuerySet
+from .pagination import ActivityCursorPagination, LeaderboardCursorPagination
+from .cache import CachedResponseMixin
+from .instrumentation import serializing
+from . import (
+    changes, exports, identity, ingest, leaderboard, pool_metrics, rankings,
+    recommendations, rollups, search, stats, teams
 )
 
 
-def get_object_by_id(queryset, id_str):
-    """Look up a Djongo/MongoDB document by its ObjectId string."""
+def get_object_by_id(queryset, id_str, load_document=find_document):
+    """
+    Look up a Djongo/MongoDB document by its ObjectId string.
+
+    Unfiltered querysets skip Djongo's SQL translation: the document is
+    fetched with `load_document`, a direct `find_one` by default, and
+    hydrated into a model instance.
+    """
     try:
-        obj = queryset.get(_id=ObjectId(id_str))
-    except (InvalidId, queryset.model.DoesNotExist):
+        object_id = ObjectId(id_str)
+    except InvalidId:
         raise NotFound(detail=f"Object with id '{id_str}' not found.")
-    return obj
+    if queryset.query.has_filters():
+        try:
+            return queryset.get(_id=object_id)
+        except queryset.model.DoesNotExist:
+            raise NotFound(detail=f"Object with id '{id_str}' not found.")
+    document = load_document(queryset.model, object_id)
+    if document is None:
+        raise NotFound(detail=f"Object with id '{id_str}' not found.")
+    return instance_from_document(queryset.model, document, queryset.db)
+
+
+def get_datetime_param(params, name):
+    """Parse an optional ISO date or datetime query parameter."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = datetime.combine(day, datetime.min.time()) if day else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: f"'{value}' is not a valid date or datetime."})
+    return parsed
+
+
+def get_positive_int_param(params, name):
+    """Parse an optional positive integer query parameter."""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = int(value)
+    except ValueError:
+        parsed = 0
+    if parsed < 1:
+        raise ValidationError({name: f"'{value}' is not a positive integer."})
+    return parsed
+
+
+def stream_json_array(items):
+    """Encode `items` as a JSON array one element at a time."""
+    yield '['
+    for position, item in enumerate(items):
+        yield (',' if position else '') + json.dumps(
+            item, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')
+        )
+    yield ']'
+
+
+class FastListMixin:
+    """
+    Serves `list` from `.values()` rows through the serializer's fast path.
+
+    Only the columns named by `?fields=` (plus the ordering fields the
+    paginator needs) are read. Pages are returned as usual; with pagination
+    disabled the rows are streamed straight from the database cursor.
+    Set `native_queries` to run the list query with pymongo instead of
+    through Djongo's SQL translation.
+    """
+    native_queries = False
+
+    def get_list_queryset(self):
+        if self.native_queries:
+            return NativeQuerySet(self.get_queryset().model)
+        return self.get_queryset()
+
+    def get_requested_fields(self, serializer_class):
+        """Return the `?fields=` subset of the serializer fields, or all of them."""
+        available = serializer_class.fast_fields()
+        requested = self.request.query_params.get('fields')
+        if not requested:
+            return available
+        names = {name.strip() for name in requested.split(',') if name.strip()}
+        unknown = sorted(names - set(available))
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}."})
+        return [name for name in available if name in names]
+
+    def get_ordering_fields(self, queryset):
+        for backend in self.filter_backends:
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(self.request, queryset, self) or []
+                return [name.lstrip('-') for name in ordering]
+        return []
+
+    def list(self, request, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
+        queryset = self.filter_queryset(self.get_list_queryset())
+        fields = self.get_requested_fields(serializer_class)
+        columns = fields + [name for name in self.get_ordering_fields(queryset) if name not in fields]
+        queryset = queryset.values(*columns)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            with serializing(request):
+                results = list(serializer_class.represent_rows(page, fields))
+            return self.get_paginated_response(results)
+        return StreamingHttpResponse(
+            stream_json_array(serializer_class.represent_rows(queryset.iterator(), fields)),
+            content_type='application/json',
+        )
 
 
 @api_view(['GET'])
@@ -32,72 +161,492 @@ def api_root(request, format=None):
         'activities': reverse('activity-list', request=request, format=format),
         'leaderboard': reverse('leaderboard-list', request=request, format=format),
         'workouts': reverse('workout-list', request=request, format=format),
+        'rollups': reverse('rollup-list', request=request, format=format),
+        'search': reverse('api-search', request=request, format=format),
+        'health': reverse('api-health', request=request, format=format),
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+def health(request, format=None):
+    """
+    Database health and connection pool metrics for this worker process.
+    """
+    databases = {}
+    for alias in settings.DATABASES:
+        started = time.perf_counter()
+        try:
+            connections[alias].ensure_connection()
+            connections[alias].connection.command('ping')
+        except Exception as exc:
+            databases[alias] = {'status': 'error', 'error': str(exc)}
+        else:
+            databases[alias] = {'status': 'ok', 'ping_ms': round((time.perf_counter() - started) * 1000, 3)}
+    healthy = all(database['status'] == 'ok' for database in databases.values())
+    return Response(
+        {
+            'status': 'ok' if healthy else 'error',
+            'databases': databases,
+            'pool': pool_metrics.snapshot(),
+            'async_pool': pool_metrics.async_snapshot(),
+        },
+        status=status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+@api_view(['GET'])
+def search_view(request, format=None):
+    """
+    Ranked full-text search over workouts and activity notes.
+
+    `?q=` words to look for (prefixes match workouts too), with optional
+    `type` (workout or activity), `activity_type`, `difficulty` and `limit`
+    (default 20, at most 100). Matching workouts come first, then the
+    activities whose notes match.
+    """
+    params = request.query_params
+    query = params.get('q', '').strip()
+    if not query:
+        raise ValidationError({'q': 'This parameter is required.'})
+    kind = params.get('type') or None
+    if kind not in (None, 'workout', 'activity'):
+        raise ValidationError({'type': 'Must be one of: workout, activity.'})
+    limit = min(get_positive_int_param(params, 'limit') or 20, 100)
+    matches = search.catalog.search(
+        query, limit, kind=kind,
+        activity_type=params.get('activity_type') or None,
+        difficulty=params.get('difficulty') or None,
+    )
+
+    # Only the returned page is read back from MongoDB.
+    documents = {}
+    for model, serializer_class, match_kind in (
+        (Workout, WorkoutSerializer, 'workout'),
+        (Activity, ActivitySerializer, 'activity'),
+    ):
+        ids = [object_id for _, found, object_id in matches if found == match_kind]
+        if ids:
+            rows = list(model.objects.mongo_find({'_id': {'$in': ids}}))
+            with serializing(request):
+                documents.update(
+                    ((match_kind, row['_id']), row) for row in serializer_class.represent_rows(rows)
+                )
+    results = []
+    for score, match_kind, object_id in matches:
+        row = documents.get((match_kind, str(object_id)))
+        if row is not None:
+            results.append({'type': match_kind, 'score': round(score, 4), **row})
+    return Response({'query': query, 'results': results})
+
+
+class UserViewSet(FastListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing users (superheroes).
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    filter_fields = {'name': EXACT, 'email': EXACT, 'team': EXACT}
+    ordering_fields = ['_id', 'name', 'created_at']
+    ordering = '-_id'
     lookup_field = '_id'
+    native_queries = True
 
     def get_object(self):
         obj = get_object_by_id(self.get_queryset(), self.kwargs['_id'])
         self.check_object_permissions(self.request, obj)
         return obj
 
+    def perform_create(self, serializer):
+        user = serializer.save()
+        teams.record_user_created(user)
+        identity.record_user_created(user)
+
+    def perform_update(self, serializer):
+        before = copy.copy(serializer.instance)
+        user = serializer.save()
+        teams.record_user_updated(before, user)
+        identity.record_user_updated(before, user)
+
+    def perform_destroy(self, instance):
+        # delete() clears the primary key on the instance.
+        object_id = instance._id
+        changes.mark_local('users', [object_id], deleted=True)
+        instance.delete()
+        teams.record_user_deleted(instance)
+        identity.record_user_deleted(object_id)
 
-class TeamViewSet(viewsets.ModelViewSet):
+
+class TeamViewSet(CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing teams (Team Marvel, Team DC).
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    filter_fields = {'name': EXACT, 'members_count': RANGE}
+    ordering_fields = ['_id', 'name', 'members_count']
+    ordering = '-_id'
     lookup_field = '_id'
+    native_queries = True
 
     def get_object(self):
-        obj = get_object_by_id(self.get_queryset(), self.kwargs['_id'])
+        obj = get_object_by_id(self.get_queryset(), self.kwargs['_id'], self.load_document)
         self.check_object_permissions(self.request, obj)
         return obj
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(FastListMixin, viewsets.ModelViewSet):
     """
     API endpoint for logging and managing fitness activities.
+
+    Besides the field filters, `?team=` lists the activities of a team's
+    members. Activities only name their athlete, so the filter (and the
+    export's) is an `$in` over the members the identity map holds, which
+    the `user_email` indexes serve; no `users` query is made.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = ActivityCursorPagination
+    filter_fields = {
+        'user_email': EXACT,
+        'activity_type': EXACT,
+        'date': RANGE,
+        'duration': RANGE,
+        'calories_burned': RANGE,
+    }
+    ordering_fields = ['_id', 'date', 'duration', 'calories_burned']
+    ordering = '-date'
     lookup_field = '_id'
+    native_queries = True
+    bulk_max_items = 1000
 
     def get_object(self):
         obj = get_object_by_id(self.get_queryset(), self.kwargs['_id'])
         self.check_object_permissions(self.request, obj)
         return obj
 
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        team = self.request.query_params.get('team')
+        if team:
+            queryset = queryset.filter(user_email__in=identity.identity.members(team))
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        """
+        Log an activity; with write-behind ingestion enabled it is queued
+        and a 202 points at its status.
+        """
+        if not ingest.enabled():
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        document = {'_id': ObjectId(), 'notes': '', **serializer.validated_data}
+        ingest.get_ingest_queue().submit(document)
+        url = reverse('activity-ingest-status', kwargs={'ingest_id': str(document['_id'])}, request=request)
+        return Response(
+            {'_id': str(document['_id']), 'status': 'queued', 'status_url': url},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': url},
+        )
+
+    def perform_create(self, serializer):
+        # Marked before the insert, so its change event cannot arrive first.
+        object_id = ObjectId()
+        changes.mark_local('activities', [object_id])
+        activity = serializer.save(_id=object_id)
+        leaderboard.record_activity_created(activity)
+        rollups.record_activity_created(activity)
+        recommendations.record_activity_created(activity)
+
+    @action(detail=False, methods=['get'], url_path=r'ingest/(?P<ingest_id>[0-9a-f]{24})', url_name='ingest-status')
+    def ingest_status(self, request, ingest_id):
+        """State of an activity accepted for write-behind ingestion: queued, written or failed."""
+        object_id = ObjectId(ingest_id)
+        state = ingest.get_ingest_queue().status(object_id) if ingest.enabled() else None
+        if state is None:
+            # Accepted by another worker or before a restart; it counts as
+            # written once it is in the collection.
+            if find_document(Activity, object_id) is None:
+                raise NotFound(detail=f"No ingested activity with id '{ingest_id}'.")
+            state = ('written', None)
+        body = {'_id': ingest_id, 'status': state[0]}
+        if state[1]:
+            body['error'] = state[1]
+        return Response(body)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create a batch of activities with a single unordered insert_many.
+
+        Every item is validated on its own; the response reports the outcome
+        of each item by its position in the request body.
+        """
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.bulk_max_items)
+        results = []
+        pending = []
+        for index, (validated, errors) in enumerate(serializer.validate_items()):
+            result = {'index': index, 'status': 'created'}
+            if errors is not None:
+                result.update(status='error', errors=errors)
+            else:
+                pending.append((result, {'_id': ObjectId(), 'notes': '', **validated}))
+            results.append(result)
+
+        write_errors = {}
+        if pending:
+            changes.mark_local('activities', [document['_id'] for _, document in pending])
+            try:
+                Activity.objects.mongo_insert_many([document for _, document in pending], ordered=False)
+            except BulkWriteError as exc:
+                write_errors = {
+                    error['index']: error.get('errmsg', 'Write failed.')
+                    for error in exc.details.get('writeErrors', [])
+                }
+
+        created = []
+        for position, (result, document) in enumerate(pending):
+            if position in write_errors:
+                result.update(status='error', errors={'non_field_errors': [write_errors[position]]})
+            else:
+                result['_id'] = str(document['_id'])
+                created.append(document)
+        leaderboard.record_activity_documents(created)
+        rollups.record_activity_documents(created)
+        recommendations.record_activity_documents(created)
+
+        failed = len(results) - len(created)
+        if not failed:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {'created': len(created), 'failed': failed, 'results': results},
+            status=response_status,
+        )
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """
+        Activity totals aggregated in MongoDB.
+
+        `?group_by=` one of user, team, activity_type, day or week, with
+        optional `user_email`, `activity_type`, `date__gte`, `date__lte`
+        and `limit` filters.
+        """
+        params = request.query_params
+        group_by = params.get('group_by', 'user')
+        if group_by not in stats.GROUP_KEYS:
+            raise ValidationError({'group_by': f"Must be one of: {', '.join(stats.GROUP_KEYS)}."})
+        return Response(stats.activity_stats(
+            group_by,
+            limit=get_positive_int_param(params, 'limit'),
+            user_email=params.get('user_email'),
+            activity_type=params.get('activity_type'),
+            date_from=get_datetime_param(params, 'date__gte'),
+            date_to=get_datetime_param(params, 'date__lte'),
+        ))
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream matching activities as NDJSON or CSV.
+
+        `?export_format=` ndjson (default) or csv, with optional
+        `user_email`, `team`, `activity_type`, `date__gte` and `date__lte`
+        filters. `batch_size` sets how many documents each cursor batch
+        fetches from MongoDB. Activities come in creation (`_id`) order,
+        which the `_id` index serves without an in-memory sort.
+        """
+        params = request.query_params
+        export_format = params.get('export_format', 'ndjson')
+        if export_format not in exports.CONTENT_TYPES:
+            raise ValidationError({'export_format': f"Must be one of: {', '.join(exports.CONTENT_TYPES)}."})
+        batch_size = min(get_positive_int_param(params, 'batch_size') or 1000, 10000)
+        match = stats.build_match(
+            user_email=params.get('user_email'),
+            activity_type=params.get('activity_type'),
+            date_from=get_datetime_param(params, 'date__gte'),
+            date_to=get_datetime_param(params, 'date__lte'),
+        )
+        if params.get('team'):
+            team_emails = set(identity.identity.members(params['team']))
+            if params.get('user_email'):
+                team_emails &= {params['user_email']}
+            match['user_email'] = {'$in': sorted(team_emails)}
+
+        serializer_class = self.get_serializer_class()
+        fields = serializer_class.fast_fields()
+        cursor = list_read_collection(Activity).find(match, {name: 1 for name in fields}).sort('_id', 1).batch_size(batch_size)
+        response = StreamingHttpResponse(
+            exports.encode(serializer_class.represent_rows(cursor), export_format, fields),
+            content_type=exports.CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="activities.{export_format}"'
+        return response
+
+    def perform_update(self, serializer):
+        before = copy.copy(serializer.instance)
+        changes.mark_local('activities', [before._id])
+        activity = serializer.save()
+        leaderboard.record_activity_updated(before, activity)
+        rollups.record_activity_updated(before, activity)
+        recommendations.record_activity_updated(before, activity)
+
+    def perform_destroy(self, instance):
+        # delete() clears the primary key on the instance.
+        object_id = instance._id
+        changes.mark_local('activities', [object_id], deleted=True)
+        instance.delete()
+        leaderboard.record_activity_deleted(instance)
+        rollups.record_activity_deleted(instance)
+        recommendations.record_activity_deleted(instance)
+
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """
     API endpoint for competitive leaderboard rankings.
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardCursorPagination
+    filter_fields = {'team_name': EXACT, 'rank': RANGE}
+    ordering_fields = ['rank', 'total_activities', 'total_calories', 'total_duration']
+    ordering = 'rank'
     lookup_field = '_id'
+    native_queries = True
+    athletes_max_limit = 1000
 
     def get_object(self):
-        obj = get_object_by_id(self.get_queryset(), self.kwargs['_id'])
+        obj = get_object_by_id(self.get_queryset(), self.kwargs['_id'], self.load_document)
         self.check_object_permissions(self.request, obj)
         return obj
 
+    def get_window(self, params):
+        window = params.get('window', 'week')
+        if window not in rankings.WINDOWS:
+            raise ValidationError({'window': f"Must be one of: {', '.join(rankings.WINDOWS)}."})
+        return window
+
+    @action(detail=False, methods=['get'])
+    def athletes(self, request):
+        """
+        Top athletes by calories burned, served from the in-process index.
+
+        `?window=` one of day, week (default), month or all, and `?limit=`
+        (default 100).
+        """
+        params = request.query_params
+        window = self.get_window(params)
+        limit = min(get_positive_int_param(params, 'limit') or 100, self.athletes_max_limit)
+        rows, athletes, since = rankings.rankings.top(window, limit)
+        return Response({
+            'window': window,
+            'since': since,
+            'athletes': athletes,
+            'results': [
+                {'rank': rank, 'user_email': email, 'total_calories': score}
+                for rank, email, score in rows
+            ],
+        })
+
+    @action(detail=False, methods=['get'], url_path='athletes/rank', url_name='athlete-rank')
+    def athlete_rank(self, request):
+        """Rank and calories of `?user_email=` in `?window=`."""
+        params = request.query_params
+        window = self.get_window(params)
+        user_email = params.get('user_email')
+        if not user_email:
+            raise ValidationError({'user_email': 'This parameter is required.'})
+        rank, score, athletes, since = rankings.rankings.rank(window, user_email)
+        return Response({
+            'window': window,
+            'since': since,
+            'athletes': athletes,
+            'user_email': user_email,
+            'rank': rank,
+            'total_calories': score,
+        })
+
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """
     API endpoint for personalized workout suggestions.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    filter_fields = {
+        'activity_type': EXACT,
+        'difficulty': EXACT,
+        'duration': RANGE,
+        'calories_estimate': RANGE,
+    }
+    ordering_fields = ['_id', 'name', 'duration', 'calories_estimate']
+    ordering = '-_id'
+    lookup_field = '_id'
+    native_queries = True
+    recommendations_max_limit = 100
+
+    def get_object(self):
+        obj = get_object_by_id(self.get_queryset(), self.kwargs['_id'], self.load_document)
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    @action(detail=False, methods=['get'])
+    def recommended(self, request):
+        """
+        Workouts suited to `?user_email=`, scored against their activity
+        history, with optional `activity_type`, `difficulty` and `limit`
+        (default 10, at most 100).
+        """
+        params = request.query_params
+        user_email = params.get('user_email')
+        if not user_email:
+            raise ValidationError({'user_email': 'This parameter is required.'})
+        limit = min(get_positive_int_param(params, 'limit') or 10, self.recommendations_max_limit)
+        matches, personalized = recommendations.recommender.recommend(
+            user_email, limit,
+            activity_type=params.get('activity_type') or None,
+            difficulty=params.get('difficulty') or None,
+        )
+        return Response({
+            'user_email': user_email,
+            'personalized': personalized,
+            'results': [{'score': round(score, 4), **row} for score, row in matches],
+        })
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        search.record_workout_saved(serializer.instance)
+        recommendations.record_workouts_changed()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        search.record_workout_saved(serializer.instance)
+        recommendations.record_workouts_changed()
+
+    def perform_destroy(self, instance):
+        object_id = instance._id
+        changes.mark_local('workouts', [object_id], deleted=True)
+        super().perform_destroy(instance)
+        search.record_workout_deleted(object_id)
+        recommendations.record_workouts_changed()
+
+
+class DailyRollupViewSet(FastListMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint for per-user daily activity totals, maintained on every
+    activity write.
+    """
+    queryset = DailyRollup.objects.all()
+    serializer_class = DailyRollupSerializer
+    filter_fields = {'user_email': EXACT, 'day': RANGE}
+    ordering_fields = ['day', 'total_calories', 'total_duration']
+    ordering = 'day'
     lookup_field = '_id'
+    native_queries = True
 
     def get_object(self):
         obj = get_object_by_id(self.get_queryset(), self.kwargs['_id'])